@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Library Audit and Repair
+Scans every asset folder in a process pool (decoding each JPEG to catch truncation and
+corruption, hashing to find duplicates, counting slots against images_per_asset), writes
+a machine-readable repair plan and runs it through the existing fetch, generate and fill paths.
+"""
+
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from config import load_config
+from image_store import NEAR_DUPLICATE_DISTANCE, ContentStore, hamming
+from manifest import Manifest, slot_number
+from metrics import REGISTRY, add_instrumentation_args, instrumented
+
+PLAN_FILE = "audit-plan.json"
+QUARANTINE_DIR = ".audit/quarantine"
+
+SOURCES = ('unsplash', 'dalle', 'fill')
+PROBLEMS = ('missing', 'corrupt', 'truncated', 'duplicate', 'near-duplicate', 'filled')
+# Filled slots are deliberate duplicates; they are only replaced when asked for by name
+DEFAULT_PROBLEMS = PROBLEMS[:-1]
+ACTIONS = {'unsplash': 'fetch', 'dalle': 'generate', 'fill': 'fill'}
+
+# Every complete JPEG ends with the End Of Image marker
+JPEG_EOI = b'\xff\xd9'
+
+
+def inspect_image(path: str) -> Dict:
+    """Hash and fully decode one image; runs in a worker process."""
+    from PIL import Image
+    from image_store import dhash
+
+    try:
+        data = Path(path).read_bytes()
+    except OSError as e:
+        return {'problem': 'corrupt', 'detail': str(e)}
+
+    result = {'problem': None, 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
+    if not data:
+        result.update(problem='truncated', detail="empty file")
+        return result
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Decoding every scanline is what exposes a cut-off download
+            image.load()
+            result['width'], result['height'] = image.size
+            result['dhash'] = f"{dhash(image):016x}"
+            is_jpeg = image.format == 'JPEG'
+    except Image.UnidentifiedImageError:
+        result.update(problem='corrupt', detail="not a readable image")
+        return result
+    except Exception as e:
+        detail = str(e) or type(e).__name__
+        result.update(problem='truncated' if 'truncated' in detail else 'corrupt', detail=detail)
+        return result
+
+    if is_jpeg and not data.rstrip(b'\0').endswith(JPEG_EOI):
+        result.update(problem='truncated', detail="no JPEG end-of-image marker")
+    return result
+
+
+class LibraryAudit:
+    def __init__(self, config_path: Optional[str] = None, base_dir: Optional[Path] = None,
+                 workers: Optional[int] = None):
+        """Audit the library described by config.json."""
+        self.config = load_config(config_path)
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.workers = workers or self.config.get('audit', {}).get('workers') or os.cpu_count()
+        self.assets = {asset['folder']: asset for asset in self.config['assets']}
+
+    def expected_slots(self, asset: Dict) -> List[str]:
+        folder = asset['folder']
+        return [f"{folder}/{folder}-{i + 1}.jpg" for i in range(asset['images_per_asset'])]
+
+    def scan(self) -> Dict[str, Dict]:
+        """slot -> inspection of every image file in every asset folder."""
+        slots = []
+        for folder in self.assets:
+            if (self.base_dir / folder).is_dir():
+                slots.extend(f"{folder}/{path.name}" for path in sorted((self.base_dir / folder).glob("*.jpg")))
+
+        print(f"🔬 Auditing {len(slots)} images in {len(self.assets)} folders with {self.workers} processes...")
+        from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing
+
+        with REGISTRY.stage('audit', 'scan'), ProcessPoolExecutor(max_workers=self.workers) as executor:
+            chunksize = max(1, len(slots) // (self.workers * 4))
+            results = list(executor.map(inspect_image, [str(self.base_dir / slot) for slot in slots],
+                                        chunksize=chunksize))
+        return dict(zip(slots, results))
+
+    def findings(self, scanned: Dict[str, Dict]) -> List[Dict]:
+        """Everything wrong with the library, in config order.
+
+        Within a set of identical (or, inside one asset, near-identical) images the
+        first slot in config order keeps it and the others are reported. Slots a
+        fill repair linked to a stand-in are reported as 'filled', never as duplicates.
+        """
+        manifest = Manifest(self.base_dir)
+        findings = []
+        owners: Dict[str, str] = {}
+        kept_hashes: Dict[str, List[tuple]] = {}
+
+        for folder, asset in self.assets.items():
+            expected = self.expected_slots(asset)
+            for slot in expected:
+                inspection = scanned.get(slot)
+                if inspection is None:
+                    findings.append({'slot': slot, 'problem': 'missing'})
+                elif inspection['problem']:
+                    findings.append({'slot': slot, 'problem': inspection['problem'], 'detail': inspection['detail']})
+                elif self.is_fill(manifest.get(slot), inspection):
+                    findings.append({'slot': slot, 'problem': 'filled', 'of': manifest.get(slot)['filled_from']})
+                elif inspection['sha256'] in owners:
+                    findings.append({'slot': slot, 'problem': 'duplicate', 'of': owners[inspection['sha256']]})
+                else:
+                    hash_value = int(inspection['dhash'], 16)
+                    near = next((other for other, other_hash in kept_hashes.get(folder, [])
+                                 if hamming(hash_value, other_hash) <= NEAR_DUPLICATE_DISTANCE), None)
+                    if near:
+                        findings.append({'slot': slot, 'problem': 'near-duplicate', 'of': near})
+                    else:
+                        owners[inspection['sha256']] = slot
+                        kept_hashes.setdefault(folder, []).append((slot, hash_value))
+
+            # Files outside the configured slots are reported, never touched
+            unexpected = set(slot for slot in scanned if slot.startswith(f"{folder}/")) - set(expected)
+            for slot in sorted(unexpected, key=lambda slot: (slot_number(slot), slot)):
+                findings.append({'slot': slot, 'problem': 'extra',
+                                 'detail': f"not one of the {asset['images_per_asset']} configured slots"})
+        return findings
+
+    @staticmethod
+    def is_fill(entry: Optional[Dict], inspection: Dict) -> bool:
+        """Whether a slot still holds the stand-in a fill repair linked into it."""
+        return bool(entry and entry.get('source') == 'fill' and entry.get('sha256') == inspection['sha256'])
+
+    def plan(self, scanned: Dict[str, Dict], findings: List[Dict], source: str,
+             problems: Optional[Set[str]] = None) -> Dict:
+        """Turn findings into repair actions for one image source."""
+        problems = set(problems or DEFAULT_PROBLEMS)
+        replaced = {finding['slot'] for finding in findings if finding['problem'] in problems}
+        healthy = [slot for slot, inspection in scanned.items()
+                   if not inspection['problem'] and slot not in replaced]
+        uses = {slot: 0 for slot in healthy}
+
+        actions = []
+        for finding in findings:
+            problem, slot = finding['problem'], finding['slot']
+            if problem not in problems:
+                continue
+            if source == 'fill' and problem in ('duplicate', 'near-duplicate', 'filled'):
+                # A stand-in would just be another duplicate
+                continue
+
+            folder = slot.split('/', 1)[0]
+            asset = self.assets[folder]
+            number = slot_number(slot)
+            action = {'slot': slot, 'problem': problem, 'action': ACTIONS[source]}
+            if scanned.get(slot, {}).get('sha256'):
+                # The repair only counts if these bytes are gone
+                action['replaces'] = scanned[slot]['sha256']
+            if source == 'unsplash':
+                action['query'] = asset['search_terms'][(number - 1) % len(asset['search_terms'])]
+            elif source == 'dalle':
+                action.update(asset=asset['name'], index=number - 1)
+            else:
+                # Prefer the asset's own images, then the least-borrowed image anywhere
+                candidates = [other for other in healthy if other.startswith(f"{folder}/")] or healthy
+                if not candidates:
+                    continue
+                stand_in = min(candidates, key=lambda other: (uses[other], slot_number(other), other))
+                uses[stand_in] += 1
+                action['from'] = stand_in
+            actions.append(action)
+
+        return {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'source': source,
+            'scanned': len(scanned),
+            'findings': findings,
+            'actions': actions,
+        }
+
+    def write_plan(self, plan: Dict, path: Optional[Path] = None) -> Path:
+        path = Path(path or self.base_dir / PLAN_FILE)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(plan, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def quarantine(self, slot: str):
+        """Move a broken file aside so nothing publishes it while it is being replaced."""
+        path = self.base_dir / slot
+        if path.exists():
+            dest = self.base_dir / QUARANTINE_DIR / slot
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(path), str(dest))
+
+    def repair(self, plan: Dict) -> bool:
+        """Run a plan's actions through fetch, generate and fill; record each result in the plan."""
+        actions = plan['actions']
+        if not actions:
+            print("✨ Nothing to repair")
+            return True
+
+        for action in actions:
+            if action['problem'] in ('corrupt', 'truncated'):
+                self.quarantine(action['slot'])
+            (self.base_dir / action['slot']).parent.mkdir(exist_ok=True)
+
+        with REGISTRY.stage('audit', 'repair'):
+            fetches = [action for action in actions if action['action'] == 'fetch']
+            if fetches:
+                from fetch_images import TradingImagesFetcher
+                fetcher = TradingImagesFetcher(journal_name="repair", base_dir=self.base_dir)
+                fetcher.fetch_jobs([(action['query'], self.base_dir / action['slot']) for action in fetches])
+
+            generations = [action for action in actions if action['action'] == 'generate']
+            if generations:
+                from generate_with_dalle import DalleImageGenerator
+                generator = DalleImageGenerator(base_dir=self.base_dir, journal_name="repair-generate")
+                jobs = []
+                for action in generations:
+                    jobs.append((generator.prompt_for(action['asset'], action['index']),
+                                 self.base_dir / action['slot']))
+                generator.run_pipeline(jobs)
+
+            fills = [action for action in actions if action['action'] == 'fill']
+            if fills:
+                # Loaded only now so the fetch and generate steps' records are kept
+                manifest = Manifest(self.base_dir)
+                store = ContentStore(self.base_dir)
+                for action in fills:
+                    # The slot becomes a hard link to the stored object, not a second copy
+                    sha = store.add_slot(action['from'])
+                    store.link_slot(action['slot'], sha)
+                    # Recorded so later audits know this duplicate is intended
+                    manifest.record(action['slot'], sha256=sha, source='fill', filled_from=action['from'])
+                    print(f"  ✅ Linked {action['slot']} → {action['from']} ({sha[:12]})")
+                store.save()
+                manifest.save()
+
+        # Judge every action by what is on disk now, not by what the step reported
+        for action in actions:
+            path = self.base_dir / action['slot']
+            inspection = inspect_image(str(path)) if path.exists() else {'problem': 'missing'}
+            ok = inspection['problem'] is None and inspection['sha256'] != action.get('replaces')
+            action['result'] = 'done' if ok else 'failed'
+            REGISTRY.inc('items', pipeline='audit', action=action['action'], result=action['result'])
+
+        manifest = Manifest(self.base_dir)
+        manifest.sync(list(self.assets), full=True)
+        manifest.save()
+        return all(action['result'] == 'done' for action in actions)
+
+    def print_findings(self, plan: Dict):
+        counts: Dict[str, int] = {}
+        for finding in plan['findings']:
+            counts[finding['problem']] = counts.get(finding['problem'], 0) + 1
+        REGISTRY.log('audit', scanned=plan['scanned'], **counts)
+
+        print(f"\n{'='*60}")
+        print(f"🔬 Scanned {plan['scanned']} images: "
+              + (", ".join(f"{count} {problem}" for problem, count in counts.items()) or "no problems"))
+        for finding in plan['findings']:
+            detail = finding.get('detail') or (f"same as {finding['of']}" if 'of' in finding else "")
+            print(f"  ⚠️  {finding['slot']}: {finding['problem']}{f' ({detail})' if detail else ''}")
+        print(f"🔧 {len(plan['actions'])} repairs planned ({plan['source']})")
+        print(f"{'='*60}")
+
+
+def audit_and_repair(source: str, problems: Optional[Set[str]] = None, dry_run: bool = False,
+                     plan_path: Optional[str] = None) -> bool:
+    """Scan the library, write the repair plan and (unless dry_run) carry it out."""
+    audit = LibraryAudit()
+    scanned = audit.scan()
+    plan = audit.plan(scanned, audit.findings(scanned), source, problems)
+    audit.print_findings(plan)
+    path = audit.write_plan(plan, plan_path)
+    print(f"📄 Repair plan saved to {path}")
+    if dry_run:
+        return True
+
+    ok = audit.repair(plan)
+    audit.write_plan(plan, path)
+    failed = [action for action in plan['actions'] if action.get('result') == 'failed']
+    print(f"\n✨ Repaired {len(plan['actions']) - len(failed)}/{len(plan['actions'])} slots")
+    for action in failed:
+        print(f"  ❌ {action['slot']} ({action['problem']}) still needs attention")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Audit the image library and repair what is broken or missing")
+    parser.add_argument('--source', choices=SOURCES,
+                        help="where replacements come from (default: unsplash when UNSPLASH_ACCESS_KEY "
+                             "is set, else fill from existing images)")
+    parser.add_argument('--problems', help=f"comma-separated subset of {', '.join(PROBLEMS)} to repair")
+    parser.add_argument('--dry-run', action='store_true', help="write the plan without repairing anything")
+    parser.add_argument('--plan', metavar='PATH', help=f"where to write the plan (default: {PLAN_FILE})")
+    parser.add_argument('--apply', metavar='PATH', help="carry out a previously written (or edited) plan")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
+
+    problems = set(args.problems.split(',')) if args.problems else None
+    unknown = (problems or set()) - set(PROBLEMS)
+    if unknown:
+        parser.error(f"unknown problems: {', '.join(sorted(unknown))}")
+
+    try:
+        with instrumented(args, 'audit'):
+            if args.apply:
+                audit = LibraryAudit()
+                with open(args.apply, 'r') as f:
+                    plan = json.load(f)
+                ok = audit.repair(plan)
+                audit.write_plan(plan, Path(args.apply))
+            else:
+                source = args.source or ('unsplash' if os.environ.get('UNSPLASH_ACCESS_KEY') else 'fill')
+                ok = audit_and_repair(source, problems, args.dry_run, args.plan)
+            if not ok:
+                return 1
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
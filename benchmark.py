@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Offline Pipeline Benchmark
+Runs fetch → generate → optimize → upload end to end against local stand-ins for
+Unsplash, Azure OpenAI and Blob Storage, and reports throughput, per-stage p50/p99
+latency and peak RSS as JSON so runs can be compared across commits.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import LatencyHistogram
+from stub_servers import FakeBlobServiceClient, FakeContentSettings, StubServer, StubSettings
+
+DEFAULT_SCALES = [40, 400, 4000]
+IMAGES_PER_ASSET = 5
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """High-water RSS of this process and of its (reaped) worker processes, in MB."""
+    per_mb = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / per_mb, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / per_mb, 1),
+    }
+
+
+def stage_result(items: int, succeeded: int, seconds: float, histogram: LatencyHistogram) -> Dict:
+    return {
+        'items': items,
+        'succeeded': succeeded,
+        'seconds': round(seconds, 3),
+        'throughput_per_s': round(succeeded / seconds, 2) if seconds else 0.0,
+        'p50_ms': round(histogram.percentile(50) * 1000, 1),
+        'p99_ms': round(histogram.percentile(99) * 1000, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def write_bench_config(workspace: Path, images: int, stub_url: str) -> Path:
+    """Copy config.json with synthetic assets and the APIs pointed at the stub."""
+    with open(Path(__file__).parent / "config.json", 'r') as f:
+        config = json.load(f)
+
+    config['assets'] = [
+        {
+            'name': f"asset_{i}",
+            'folder': f"asset-{i}",
+            'search_terms': [f"asset {i} term {j}" for j in range(IMAGES_PER_ASSET)],
+            'images_per_asset': IMAGES_PER_ASSET,
+        }
+        for i in range(max(1, images // IMAGES_PER_ASSET))
+    ]
+    # Tuning (workers, concurrency, variants) stays as configured; quotas are the stub's
+    config['unsplash'].update({'api_url': stub_url, 'rate_limit_per_hour': 10 ** 9})
+    config.setdefault('dalle', {})['requests_per_minute'] = 10 ** 9
+
+    config_path = workspace / "config.json"
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    return config_path
+
+
+def run_scale(images: int, settings: StubSettings, blob_latency: float) -> Dict:
+    """Build a library of `images` images from scratch and time each stage."""
+    workspace = Path(tempfile.mkdtemp(prefix="trading-images-bench-"))
+    stub = StubServer(settings).start()
+    os.environ.update({
+        'AZURE_OPENAI_ENDPOINT': stub.url,
+        'AZURE_OPENAI_API_KEY': 'bench',
+    })
+    stages = {}
+    quiet = io.StringIO()
+
+    try:
+        config_path = write_bench_config(workspace, images, stub.url)
+        with open(config_path, 'r') as f:
+            assets = json.load(f)['assets']
+
+        # Even assets come from Unsplash, odd ones from DALL-E
+        fetch_jobs, generate_jobs = [], []
+        for index, asset in enumerate(assets):
+            (workspace / asset['folder']).mkdir()
+            for i in range(asset['images_per_asset']):
+                image_path = workspace / asset['folder'] / f"{asset['folder']}-{i + 1}.jpg"
+                if index % 2 == 0:
+                    fetch_jobs.append((asset['search_terms'][i], image_path))
+                else:
+                    generate_jobs.append((f"Professional trading chart for {asset['name']}, variant {i}", image_path))
+
+        from fetch_images import TradingImagesFetcher
+        fetcher = TradingImagesFetcher(str(config_path), access_key='bench', base_dir=workspace)
+        started = time.perf_counter()
+        with redirect_stdout(quiet):
+            fetched = fetcher.fetch_jobs(fetch_jobs)
+        stages['fetch'] = stage_result(len(fetch_jobs), fetched, time.perf_counter() - started,
+                                       fetcher.histograms['end_to_end'])
+
+        from generate_with_dalle import DalleImageGenerator
+        generator = DalleImageGenerator(str(config_path), base_dir=workspace)
+        started = time.perf_counter()
+        with redirect_stdout(quiet):
+            generated = generator.run_pipeline(generate_jobs)
+        stages['generate'] = stage_result(len(generate_jobs), generated, time.perf_counter() - started,
+                                          generator.histograms['end_to_end'])
+
+        from optimize_images import ImageOptimizer
+        optimizer = ImageOptimizer(str(config_path), base_dir=workspace)
+        started = time.perf_counter()
+        with redirect_stdout(quiet):
+            optimizer.optimize_all_images()
+        stages['optimize'] = stage_result(fetched + generated, optimizer.histogram.count,
+                                          time.perf_counter() - started, optimizer.histogram)
+
+        from upload_to_azure import AzureBlobUploader
+        blob_client = FakeBlobServiceClient(latency=blob_latency)
+        uploader = AzureBlobUploader(str(config_path), blob_service_client=blob_client, base_dir=workspace,
+                                     content_settings_class=FakeContentSettings)
+        started = time.perf_counter()
+        with redirect_stdout(quiet):
+            uploader.upload_all_images()
+        stages['upload'] = stage_result(uploader.histogram.count, uploader.histogram.count,
+                                        time.perf_counter() - started, uploader.histogram)
+        stages['upload']['bytes'] = blob_client.bytes_uploaded
+    finally:
+        stub.stop()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    total = sum(stage.get('seconds', 0.0) for stage in stages.values())
+    return {
+        'images': images,
+        'seconds': round(total, 3),
+        'images_per_s': round(images / total, 2) if total else 0.0,
+        'api_requests': stub.requests,
+        'stages': stages,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def git_revision() -> Optional[str]:
+    """Short HEAD hash, suffixed with -dirty when the tree has local changes."""
+    try:
+        base_dir = Path(__file__).parent
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=base_dir,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=base_dir,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict):
+    """Print per-stage throughput and p99 changes between two benchmark reports."""
+    print(f"📊 {baseline.get('revision')} → {current.get('revision')}")
+    baseline_runs = {run['images']: run for run in baseline['runs']}
+    for run in current['runs']:
+        before = baseline_runs.get(run['images'])
+        if not before:
+            continue
+        print(f"\n  {run['images']} images: {before['images_per_s']} → {run['images_per_s']} images/s")
+        for name, stage in run['stages'].items():
+            old = before['stages'].get(name, {})
+            if 'throughput_per_s' not in stage or 'throughput_per_s' not in old:
+                continue
+            change = (stage['throughput_per_s'] / old['throughput_per_s'] - 1) * 100 if old['throughput_per_s'] else 0
+            print(f"    {name:<9} {old['throughput_per_s']:>8}/s → {stage['throughput_per_s']:>8}/s "
+                  f"({change:+.0f}%)  p99 {old['p99_ms']}ms → {stage['p99_ms']}ms")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark the image pipeline against local API stubs")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="library sizes to build (default: 40 400 4000)")
+    parser.add_argument('--latency', type=float, default=0.02, help="stub API latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.01, help="random +/- latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of API calls answered 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of API calls answered 429")
+    parser.add_argument('--rate-limit', type=int, default=100000, help="X-Ratelimit-Limit the stub advertises")
+    parser.add_argument('--blob-latency', type=float, default=0.01, help="fake Blob Storage per-call latency")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="print changes against an earlier report")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    settings = StubSettings(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate, rate_limit=args.rate_limit)
+
+    if args.child:
+        # One scale per process so peak RSS isn't inherited from a larger run
+        print(json.dumps(run_scale(args.child, settings, args.blob_latency)))
+        return 0
+
+    try:
+        runs = []
+        for images in args.scales:
+            print(f"⏱️  Benchmarking {images} images...", file=sys.stderr)
+            command = [sys.executable, __file__, '--child', str(images),
+                       '--latency', str(args.latency), '--jitter', str(args.jitter),
+                       '--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+                       '--rate-limit', str(args.rate_limit), '--blob-latency', str(args.blob_latency)]
+            result = subprocess.run(command, capture_output=True, text=True, check=True)
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            print(f"   ✅ {runs[-1]['images_per_s']} images/s", file=sys.stderr)
+
+        report = {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'stub': vars(settings),
+            'runs': runs,
+        }
+
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + "\n")
+            print(f"📄 Report: {args.output}", file=sys.stderr)
+        else:
+            print(output)
+
+        if args.compare:
+            with open(args.compare, 'r') as f:
+                compare(json.load(f), report)
+
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Benchmark run failed:\n{e.stderr}", file=sys.stderr)
+        return 1
+    except Exception as e:
+        print(f"❌ Error: {e}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
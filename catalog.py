@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Sharded URL Catalog
+Writes a small versioned index plus one content-hashed JSON shard per asset, so n8n
+fetches only the asset it needs and can cache each shard forever.
+"""
+
+import os
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from config import load_config
+from image_store import sha256_file
+from manifest import Manifest
+from optimize_images import variant_settings, variant_urls
+
+CATALOG_DIR = "catalog"
+INDEX_FILE = "index.json"
+
+# Content-addressed files (shards, fingerprinted images) never change under a name;
+# the index is revalidated often
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+INDEX_CACHE_CONTROL = "public, max-age=60"
+
+
+def fingerprinted_name(relpath: str, sha256: str) -> str:
+    """Content-addressed publish name: 'btc-usd/btc-usd-3.jpg' -> 'btc-usd/3.<hash8>.jpg'."""
+    path = Path(relpath)
+    stem = path.stem
+    prefix = f"{path.parent.name}-"
+    if stem.startswith(prefix):
+        stem = stem[len(prefix):]
+    return (path.parent / f"{stem}.{sha256[:8]}{path.suffix}").as_posix()
+
+
+def fingerprint_file(base_dir: Path, relpath: str) -> str:
+    """Fingerprinted name of a file on disk (for variants, which the manifest doesn't hash)."""
+    return fingerprinted_name(relpath, sha256_file(Path(base_dir) / relpath))
+
+
+def variant_namer(base_dir: Path, hashes: Optional[Dict[str, str]] = None) -> Callable[[str], str]:
+    """Fingerprinted-name function for variants, using already-known hashes before reading files."""
+    hashes = hashes or {}
+    return lambda relpath: (fingerprinted_name(relpath, hashes[relpath]) if relpath in hashes
+                            else fingerprint_file(base_dir, relpath))
+
+
+def build_url_mapping(base_dir: Path, config: Dict, manifest: Manifest, base_url: str, fingerprint: bool = False,
+                      hashes: Optional[Dict[str, str]] = None, exclude: Optional[Set[str]] = None) -> Dict:
+    """The image-urls.json mapping for one publishing target: asset -> image URLs, plus variants.
+
+    Slots in exclude (e.g. ones whose upload just failed) are left out.
+    """
+    exclude = exclude or set()
+    widths, formats = variant_settings(config)
+    name_for = variant_namer(base_dir, hashes) if fingerprint else None
+
+    mapping = {}
+    for asset in config['assets']:
+        folder = asset['folder']
+        asset_urls = []
+        asset_variants = []
+        for slot, entry in manifest.entries(folder):
+            if slot in exclude:
+                continue
+            asset_urls.append(f"{base_url}/{fingerprinted_name(slot, entry['sha256']) if fingerprint else slot}")
+            asset_variants.append(variant_urls(base_dir, base_url, folder, slot.split('/', 1)[1],
+                                               widths, formats, name_for))
+        mapping[asset['name']] = asset_urls
+
+        # Responsive variants from optimize_images.py, in the same order as the originals
+        if any(asset_variants):
+            mapping.setdefault('variants', {})[asset['name']] = asset_variants
+    return mapping
+
+
+def _canonical(data) -> bytes:
+    """Compact, key-sorted JSON so identical content always hashes the same."""
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_shard(base_dir: Path, config: Dict, manifest: Manifest, asset: Dict, base_url: str,
+                fingerprint: bool = False, hashes: Optional[Dict[str, str]] = None,
+                exclude: Optional[Set[str]] = None) -> Dict:
+    """Return the catalog shard for one asset: its images with URLs, hashes and variants."""
+    exclude = exclude or set()
+    widths, formats = variant_settings(config)
+    folder = asset['folder']
+
+    images = []
+    for slot, entry in manifest.entries(folder):
+        if slot in exclude:
+            continue
+        image_filename = slot.split('/', 1)[1]
+        image = {
+            'slot': slot,
+            'url': f"{base_url}/{fingerprinted_name(slot, entry['sha256']) if fingerprint else slot}",
+            'sha256': entry['sha256'],
+            'width': entry['width'],
+            'height': entry['height'],
+        }
+        name_for = variant_namer(base_dir, hashes) if fingerprint else None
+        variants = variant_urls(base_dir, base_url, folder, image_filename, widths, formats, name_for)
+        if variants:
+            image['variants'] = variants
+        images.append(image)
+
+    return {'asset': asset['name'], 'folder': folder, 'images': images}
+
+
+def catalog_files(index: Dict, name: str) -> List[str]:
+    """Relative paths of the files an index needs published: its shards, then the index itself."""
+    shards = sorted(f"{CATALOG_DIR}/{name}/{entry['shard']}" for entry in index['assets'].values())
+    return shards + [f"{CATALOG_DIR}/{name}/{INDEX_FILE}"]
+
+
+def write_catalog(base_dir: Path, config: Dict, manifest: Manifest, base_url: str,
+                  name: str, fingerprint: bool = False,
+                  hashes: Optional[Dict[str, str]] = None,
+                  exclude: Optional[Set[str]] = None) -> Tuple[Dict, List[str]]:
+    """Write catalog/<name>/ for one publishing target. Returns (index, relpaths written).
+
+    Shards are named by content hash and only written when new; the index version
+    increases only when some shard changed. With fingerprint, image URLs use
+    fingerprinted_name() to match a fingerprinted publish; hashes (relpath -> sha256)
+    saves re-reading variants whose hash the caller already knows; slots in exclude
+    are left out of the shards.
+    """
+    base_dir = Path(base_dir)
+    catalog_dir = base_dir / CATALOG_DIR / name
+    catalog_dir.mkdir(parents=True, exist_ok=True)
+    catalog_url = f"{base_url}/{CATALOG_DIR}/{name}"
+    index_path = catalog_dir / INDEX_FILE
+
+    previous = {}
+    if index_path.exists():
+        with open(index_path, 'r') as f:
+            previous = json.load(f)
+
+    written = []
+    assets = {}
+    for asset in config['assets']:
+        shard = _canonical(build_shard(base_dir, config, manifest, asset, base_url, fingerprint, hashes,
+                                       exclude))
+        digest = hashlib.sha256(shard).hexdigest()
+        shard_name = f"{asset['name']}.{digest[:12]}.json"
+
+        shard_path = catalog_dir / shard_name
+        if not shard_path.exists():
+            _write_atomic(shard_path, shard)
+            written.append(f"{CATALOG_DIR}/{name}/{shard_name}")
+
+        assets[asset['name']] = {
+            'folder': asset['folder'],
+            'aliases': asset.get('aliases', []),
+            'count': len(manifest.entries(asset['folder'])),
+            'shard': shard_name,
+            'url': f"{catalog_url}/{shard_name}",
+            'sha256': digest,
+        }
+
+    etag = hashlib.sha256(_canonical(assets)).hexdigest()[:16]
+    if previous.get('etag') == f'"{etag}"':
+        return previous, written
+
+    index = {
+        'version': previous.get('version', 0) + 1,
+        'etag': f'"{etag}"',
+        'base_url': base_url,
+        'assets': assets,
+    }
+    _write_atomic(index_path, _canonical(index))
+    written.append(f"{CATALOG_DIR}/{name}/{INDEX_FILE}")
+
+    # Keep the previous generation's shards for clients still holding the old index
+    keep = {entry['shard'] for entry in assets.values()}
+    keep.update(entry['shard'] for entry in previous.get('assets', {}).values())
+    for shard_path in catalog_dir.glob("*.json"):
+        if shard_path.name != INDEX_FILE and shard_path.name not in keep:
+            shard_path.unlink()
+
+    return index, written
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Write the sharded URL catalog")
+    parser.add_argument('--base-url', required=True,
+                        help="public URL the library is served from, e.g. https://<account>.z6.web.core.windows.net")
+    parser.add_argument('--name', default='default', help="catalog name, one per publishing target")
+    parser.add_argument('--fingerprint', action='store_true',
+                        help="point at content-hashed names, as published by upload_to_azure.py --fingerprint")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config()
+
+        base_dir = Path(__file__).parent
+        manifest = Manifest(base_dir)
+        manifest.sync([asset['folder'] for asset in config['assets']])
+        manifest.save()
+
+        index, written = write_catalog(base_dir, config, manifest, args.base_url.rstrip('/'), args.name,
+                                       args.fingerprint)
+        print(f"🗂️  Catalog {args.name} v{index['version']} ({len(index['assets'])} assets, "
+              f"{len(written)} files written)")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
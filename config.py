@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Library Configuration
+Loads config.json once per process, checks the settings every script relies on, and
+caches the result so subcommands and helpers share one parsed copy.
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_CONFIG = "config.json"
+
+# The CLI's --config sets this so every script picks up the same file
+CONFIG_ENV = "TRADING_IMAGES_CONFIG"
+
+_cache: Dict[Path, Tuple[int, Dict]] = {}
+_lock = threading.Lock()
+
+
+class ConfigError(ValueError):
+    """config.json is missing, malformed or has invalid settings."""
+
+
+def _positive_int(section: Dict, key: str, where: str, problems: List[str]):
+    value = section.get(key)
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+        problems.append(f"{where}.{key} must be a positive integer, got {value!r}")
+
+
+def validate_config(config: Dict) -> List[str]:
+    """Return a list of problems with a parsed config (empty when it is usable)."""
+    problems = []
+    if not isinstance(config, dict):
+        return ["config must be a JSON object"]
+
+    assets = config.get('assets')
+    if not isinstance(assets, list) or not assets:
+        problems.append("assets must be a non-empty list")
+        assets = []
+
+    seen_names, seen_folders = set(), set()
+    for i, asset in enumerate(assets):
+        where = f"assets[{i}]"
+        if not isinstance(asset, dict):
+            problems.append(f"{where} must be an object")
+            continue
+        for key in ('name', 'folder'):
+            if not isinstance(asset.get(key), str) or not asset.get(key):
+                problems.append(f"{where}.{key} must be a non-empty string")
+        folder = asset.get('folder')
+        if isinstance(folder, str) and ('/' in folder or '\\' in folder or folder.startswith('.')):
+            problems.append(f"{where}.folder must be a plain directory name, got {folder!r}")
+        if asset.get('name') in seen_names:
+            problems.append(f"{where}.name {asset.get('name')!r} is used twice")
+        if folder in seen_folders:
+            problems.append(f"{where}.folder {folder!r} is used twice")
+        seen_names.add(asset.get('name'))
+        seen_folders.add(folder)
+
+        terms = asset.get('search_terms')
+        if not isinstance(terms, list) or not terms or not all(isinstance(term, str) for term in terms):
+            problems.append(f"{where}.search_terms must be a non-empty list of strings")
+        _positive_int(asset, 'images_per_asset', where, problems)
+        if 'images_per_asset' not in asset:
+            problems.append(f"{where}.images_per_asset is required")
+        if not isinstance(asset.get('aliases', []), list):
+            problems.append(f"{where}.aliases must be a list")
+
+    unsplash = config.get('unsplash')
+    if not isinstance(unsplash, dict):
+        problems.append("unsplash section is required")
+    else:
+        for key in ('api_url', 'orientation'):
+            if not isinstance(unsplash.get(key), str):
+                problems.append(f"unsplash.{key} must be a string")
+        for key in ('per_page', 'rate_limit_per_hour', 'max_workers', 'source_width', 'variant_workers'):
+            _positive_int(unsplash, key, 'unsplash', problems)
+        ranking = unsplash.get('ranking', {})
+        _positive_int(ranking, 'thumb_width', 'unsplash.ranking', problems)
+        weights = ranking.get('weights', {})
+        if not isinstance(weights, dict) or not all(
+                isinstance(weight, (int, float)) and weight >= 0 for weight in weights.values()):
+            problems.append("unsplash.ranking.weights must map measures to non-negative numbers")
+
+    for section, keys in (('dalle', ('max_concurrent_generations', 'requests_per_minute', 'download_workers')),
+                          ('serve', ('port', 'cache_mb')),
+                          ('queue', ('lease_seconds', 'max_attempts', 'worker_threads')),
+                          ('verify', ('workers', 'per_host', 'timeout_seconds')),
+                          ('audit', ('workers',)),
+                          ('azure', ('upload_workers', 'max_block_concurrency', 'max_single_put_size'))):
+        if section in config:
+            if not isinstance(config[section], dict):
+                problems.append(f"{section} must be an object")
+                continue
+            for key in keys:
+                _positive_int(config[section], key, section, problems)
+
+    budget = config.get('dalle', {}).get('monthly_budget_usd') if isinstance(config.get('dalle'), dict) else None
+    if budget is not None and (not isinstance(budget, (int, float)) or isinstance(budget, bool) or budget < 0):
+        problems.append(f"dalle.monthly_budget_usd must be a non-negative number, got {budget!r}")
+
+    optimize = config.get('optimize', {})
+    widths = optimize.get('widths', [])
+    if not isinstance(widths, list) or not all(isinstance(width, int) and width > 0 for width in widths):
+        problems.append("optimize.widths must be a list of positive integers")
+    unknown = set(optimize.get('formats', [])) - {'jpeg', 'webp', 'avif'}
+    if unknown:
+        problems.append(f"optimize.formats has unknown formats: {', '.join(sorted(unknown))}")
+
+    method = config.get('verify', {}).get('method') if isinstance(config.get('verify'), dict) else None
+    if method is not None and method not in ('head', 'range'):
+        problems.append(f"verify.method must be 'head' or 'range', got {method!r}")
+
+    publish = config.get('publish', {})
+    if isinstance(publish, dict):
+        unknown = set(publish.get('backends', [])) - {'azure', 'github', 'local', 's3'}
+        if unknown:
+            problems.append(f"publish.backends has unknown backends: {', '.join(sorted(unknown))}")
+        for section in ('local', 's3'):
+            if isinstance(publish.get(section), dict):
+                _positive_int(publish[section], 'workers', f"publish.{section}", problems)
+    else:
+        problems.append("publish must be an object")
+
+    azure = config.get('azure')
+    if isinstance(azure, dict):
+        for key in ('storage_account_name', 'container_name'):
+            if not isinstance(azure.get(key), str):
+                problems.append(f"azure.{key} must be a string")
+
+    return problems
+
+
+def config_path(path: Optional[str] = None) -> Path:
+    """The config file to use: the argument, else $TRADING_IMAGES_CONFIG, else ./config.json."""
+    return Path(path or os.environ.get(CONFIG_ENV) or DEFAULT_CONFIG).resolve()
+
+
+def load_config(path: Optional[str] = None) -> Dict:
+    """Parse and validate the config once; later calls return the cached copy until the file changes.
+
+    Callers share the returned dict and must not modify it.
+    """
+    path = config_path(path)
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        raise ConfigError(f"{path} not found") from None
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"{path} is not valid JSON: {e}") from None
+
+        problems = validate_config(config)
+        if problems:
+            raise ConfigError(f"{path} has invalid settings:\n  - " + "\n  - ".join(problems))
+
+        _cache[path] = (mtime_ns, config)
+        return config
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+DALL-E Scheduler
+Prices every generation from its size and quality, keeps spend within a run budget and a
+monthly cap, paces requests evenly across the deployment's RPM, serves the assets with the
+fewest images first, and defers whatever doesn't fit to a persisted backlog instead of
+failing it.
+"""
+
+import os
+import json
+import math
+import calendar
+import time
+import fcntl
+import heapq
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+from rate_limiter import TokenBucket
+
+# Azure OpenAI DALL-E 3 price per image in USD, by (quality, size)
+PRICES_USD = {
+    ('standard', '1024x1024'): 0.040,
+    ('standard', '1024x1792'): 0.080,
+    ('standard', '1792x1024'): 0.080,
+    ('hd', '1024x1024'): 0.080,
+    ('hd', '1024x1792'): 0.120,
+    ('hd', '1792x1024'): 0.120,
+}
+
+SPEND_FILE = "dalle-spend.json"
+BACKLOG_FILE = "dalle-backlog.jsonl"
+
+# Azure enforces RPM over short windows, so never burst more than a 10-second share
+RPM_WINDOW_SECONDS = 10
+
+# Generations in flight are sized from latency x rate, within these bounds
+DEFAULT_GENERATE_SECONDS = 15.0
+MAX_IN_FLIGHT = 16
+
+
+class GenerationDeferred(Exception):
+    """A generation that was not attempted (or was throttled) and belongs in the backlog."""
+
+    def __init__(self, reason: str, until: Optional[float] = None):
+        super().__init__(f"deferred ({reason})")
+        self.reason = reason
+        # When retrying could succeed (epoch seconds), if known
+        self.until = until
+
+
+def request_cost(options: Dict) -> float:
+    """Price of one image at the requested size and quality."""
+    key = (options.get('quality', 'standard'), options.get('size', '1024x1024'))
+    if key not in PRICES_USD:
+        raise ValueError(f"no DALL-E 3 price for quality={key[0]!r}, size={key[1]!r}")
+    return PRICES_USD[key]
+
+
+class SpendLedger:
+    def __init__(self, base_dir: Path, monthly_budget: Optional[float] = None, run_budget: Optional[float] = None):
+        """Month-to-date spend in dalle-spend.json, shared by every run and worker on this machine.
+
+        In-flight reservations are per process, so concurrent workers can overshoot the
+        monthly cap by at most the requests they have in flight.
+        """
+        self.path = Path(base_dir) / SPEND_FILE
+        self.monthly_budget = monthly_budget
+        self.run_budget = run_budget
+        self.run_spent = 0.0
+        self.reserved = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def month() -> str:
+        return time.strftime('%Y-%m', time.gmtime())
+
+    @staticmethod
+    def resets_at() -> float:
+        """When the monthly cap resets: midnight UTC on the first of next month."""
+        now = time.gmtime()
+        year, month = (now.tm_year + 1, 1) if now.tm_mon == 12 else (now.tm_year, now.tm_mon + 1)
+        return calendar.timegm((year, month, 1, 0, 0, 0))
+
+    def _add(self, amount: float) -> float:
+        """Add to this month's spend on disk (under an exclusive file lock); returns the new total."""
+        with open(self.path.with_suffix('.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'r') as f:
+                    months = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                months = {}
+
+            month = self.month()
+            months[month] = round(months.get(month, 0.0) + amount, 4)
+            if amount:
+                tmp_path = self.path.with_suffix('.tmp')
+                with open(tmp_path, 'w') as f:
+                    json.dump(months, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.path)
+            return months[month]
+
+    def month_spent(self) -> float:
+        return self._add(0.0)
+
+    def remaining(self) -> Optional[float]:
+        """Budget left for new requests (the tighter of run and monthly), or None if uncapped."""
+        with self._lock:
+            limits = []
+            if self.run_budget is not None:
+                limits.append(self.run_budget - self.run_spent - self.reserved)
+            if self.monthly_budget is not None:
+                limits.append(self.monthly_budget - self.month_spent() - self.reserved)
+        return max(0.0, min(limits)) if limits else None
+
+    def reserve(self, cost: float) -> bool:
+        """Set aside the price of a request before sending it. False if it would break a budget."""
+        with self._lock:
+            if self.run_budget is not None and self.run_spent + self.reserved + cost > self.run_budget + 1e-9:
+                return False
+            if self.monthly_budget is not None and \
+                    self.month_spent() + self.reserved + cost > self.monthly_budget + 1e-9:
+                return False
+            self.reserved += cost
+            return True
+
+    def settle(self, cost: float, charged: bool):
+        """Release a reservation, recording the spend if the request produced an image."""
+        with self._lock:
+            self.reserved = max(0.0, self.reserved - cost)
+            if charged and cost:
+                self.run_spent += cost
+                self._add(cost)
+                REGISTRY.inc('dalle_spend_usd', cost)
+
+
+class Backlog:
+    def __init__(self, base_dir: Path):
+        """Deferred generation requests in dalle-backlog.jsonl, one JSON object per line."""
+        self.base_dir = Path(base_dir)
+        self.path = self.base_dir / BACKLOG_FILE
+        self._lock = threading.Lock()
+
+    def defer(self, slot: str, prompt: str, options: Dict, reason: str):
+        entry = {'slot': slot, 'prompt': prompt, 'options': options, 'reason': reason,
+                 'deferred_at': round(time.time(), 3)}
+        with self._lock, open(self.path, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+        REGISTRY.inc('dalle_deferred', reason=reason)
+
+    def entries(self) -> Dict[str, Dict]:
+        """slot -> latest deferred request."""
+        entries = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    entries[entry['slot']] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def prune(self) -> int:
+        """Drop requests whose slot now holds an image (and repeated deferrals of one slot).
+        Returns how many remain."""
+        with self._lock:
+            entries = [entry for entry in self.entries().values()
+                       if not (self.base_dir / entry['slot']).exists()]
+            if not entries:
+                self.path.unlink(missing_ok=True)
+                return 0
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                f.writelines(json.dumps(entry, sort_keys=True) + "\n" for entry in entries)
+            os.replace(tmp_path, self.path)
+        return len(entries)
+
+
+def pacing(requests_per_minute: int) -> Tuple[int, float]:
+    """(capacity, refill period) of a bucket that refills at rpm/60 tokens per second
+    but never holds more than a RPM_WINDOW_SECONDS share of the minute."""
+    burst = max(1, requests_per_minute * RPM_WINDOW_SECONDS // 60)
+    return burst, burst * 60.0 / requests_per_minute
+
+
+def pacing_bucket(requests_per_minute: int, name: str = 'azure_openai') -> TokenBucket:
+    """A bucket that spreads the RPM evenly instead of allowing a full minute's burst."""
+    burst, refill_period = pacing(requests_per_minute)
+    return TokenBucket(burst, refill_period=refill_period, name=name)
+
+
+class DalleScheduler:
+    def __init__(self, base_dir: Path, requests_per_minute: int, monthly_budget: Optional[float] = None,
+                 run_budget: Optional[float] = None, max_minutes: Optional[float] = None):
+        """Admission, ordering and pacing for DALL-E requests."""
+        self.requests_per_minute = requests_per_minute
+        self.max_minutes = max_minutes
+        self.ledger = SpendLedger(base_dir, monthly_budget, run_budget)
+        self.backlog = Backlog(base_dir)
+        self.rate_limiter = pacing_bucket(requests_per_minute)
+
+    def in_flight(self, floor: int, generate_seconds: float = DEFAULT_GENERATE_SECONDS) -> int:
+        """Concurrent generations needed to keep the RPM busy when each takes generate_seconds."""
+        return max(floor, min(MAX_IN_FLIGHT, math.ceil(self.requests_per_minute * generate_seconds / 60)))
+
+    def plan(self, jobs: List[Tuple], existing: Dict[str, int],
+             cost_of: Callable[[Tuple], float]) -> Tuple[List[Tuple[Tuple, float]], List[Tuple[Tuple, str]]]:
+        """Order (prompt, save_path, options) jobs emptiest-asset-first and admit what fits.
+
+        Returns (admitted [(job, reserved cost)], deferred [(job, reason)]). A job costing
+        nothing (a generation already paid for) is always admitted.
+        """
+        by_folder: Dict[str, deque] = {}
+        for job in jobs:
+            by_folder.setdefault(job[1].parent.name, deque()).append(job)
+
+        # Each admitted job raises its asset's count, so assets fill up evenly from the bottom
+        heap = [(existing.get(folder, 0), order, folder) for order, folder in enumerate(by_folder)]
+        heapq.heapify(heap)
+        ordered = []
+        while heap:
+            count, order, folder = heapq.heappop(heap)
+            ordered.append(by_folder[folder].popleft())
+            if by_folder[folder]:
+                heapq.heappush(heap, (count + 1, order, folder))
+
+        window = int(self.requests_per_minute * self.max_minutes) if self.max_minutes else None
+        admitted, deferred = [], []
+        paid_requests = 0
+        for job in ordered:
+            cost = cost_of(job)
+            if not cost:
+                admitted.append((job, 0.0))
+            elif window is not None and paid_requests >= window:
+                deferred.append((job, 'rate'))
+            elif not self.ledger.reserve(cost):
+                deferred.append((job, 'budget'))
+            else:
+                admitted.append((job, cost))
+                paid_requests += 1
+        return admitted, deferred
+
+    def throttled(self):
+        """A 429 outlasted the session's retries: slow the pace by a fifth."""
+        self.rate_limiter.throttle(0.8)
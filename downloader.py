@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Atomic Image Downloads
+Streams an image into a temporary file while hashing and validating it in the same pass,
+and renames it into place only once it is a complete image, so an interrupted run never
+leaves a truncated or corrupt file behind.
+"""
+
+import io
+import os
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from PIL import Image
+
+from image_store import dhash
+from metrics import REGISTRY
+
+PART_SUFFIX = ".part"
+
+# Chunk size for streaming image bodies into memory and onto disk
+IMAGE_BUFFER_SIZE = 256 * 1024
+
+# Slots named .jpg are served as image/jpeg, so other formats are re-encoded into them
+JPEG_SUFFIXES = ('.jpg', '.jpeg')
+REENCODE_QUALITY = 92
+
+_scratch = threading.local()
+
+
+class InvalidImageError(IOError):
+    """A downloaded body is not a complete, decodable image."""
+
+
+class DownloadedImage:
+    def __init__(self, path: Path, size: int, sha256: str, dhash: int, width: int, height: int, format: str):
+        """What download_image_file learned about an image while streaming it."""
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.dhash = dhash
+        self.width = width
+        self.height = height
+        self.format = format
+
+
+def _scratch_buffer(size: int) -> memoryview:
+    """Per-thread reusable read buffer for bodies without a Content-Length."""
+    buffer = getattr(_scratch, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _scratch.buffer = memoryview(bytearray(size))
+    return buffer[:size]
+
+
+def check_markers(body: memoryview) -> str:
+    """Check the container's start and end markers. Returns the format name.
+
+    Catches truncated bodies that still decode (JPEG decoders pad a missing tail)
+    and error pages served with a 200.
+    """
+    head = bytes(body[:12])
+    if head[:3] == b'\xff\xd8\xff':
+        # Some encoders pad after EOI; ignore trailing NULs and whitespace
+        end = len(body)
+        while end > 2 and body[end - 1] in b'\x00\r\n ':
+            end -= 1
+        if bytes(body[end - 2:end]) != b'\xff\xd9':
+            raise InvalidImageError("JPEG is missing its EOI marker (truncated?)")
+        return 'JPEG'
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        if bytes(body[-12:]) != b'\x00\x00\x00\x00IEND\xaeB`\x82':
+            raise InvalidImageError("PNG is missing its IEND chunk (truncated?)")
+        return 'PNG'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        if int.from_bytes(head[4:8], 'little') + 8 != len(body):
+            raise InvalidImageError("WebP length does not match its RIFF header (truncated?)")
+        return 'WEBP'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        # ISO BMFF: the top-level boxes must exactly cover the body
+        offset = 0
+        while offset + 8 <= len(body):
+            box_size = int.from_bytes(body[offset:offset + 4], 'big')
+            if box_size == 1 and offset + 16 <= len(body):
+                box_size = int.from_bytes(body[offset + 8:offset + 16], 'big')
+            elif box_size == 0:
+                box_size = len(body) - offset
+            if box_size < 8:
+                break
+            offset += box_size
+        if offset != len(body):
+            raise InvalidImageError("AVIF boxes do not add up to the body length (truncated?)")
+        return 'AVIF'
+    raise InvalidImageError(f"not a JPEG, PNG, WebP or AVIF image (starts with {head[:8]!r})")
+
+
+def _reencode_jpeg(body: bytearray, tmp_path: Path) -> tuple:
+    """Rewrite tmp_path as a JPEG of the decoded body. Returns (size, sha256)."""
+    with Image.open(io.BytesIO(body)) as image:
+        output = io.BytesIO()
+        image.convert('RGB').save(output, format='JPEG', quality=REENCODE_QUALITY, optimize=True)
+    data = output.getvalue()
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+def download_image_file(session: requests.Session, url: str, save_path: Path,
+                        headers: Optional[Dict[str, str]] = None, min_dimension: int = 1,
+                        buffer_size: int = IMAGE_BUFFER_SIZE) -> DownloadedImage:
+    """Download an image to save_path atomically, hashing and validating it in the same pass.
+
+    The body is read with readinto() into one buffer (sized from Content-Length when
+    the server sends one) while each chunk is written to the temp file and fed to
+    SHA-256. The in-memory copy is then checked for complete start/end markers and
+    decoded at reduced scale for its dimensions and dHash, so nothing is read back
+    from disk. PNG, WebP or AVIF bodies bound for a .jpg slot are re-encoded to JPEG
+    first. The file is renamed into place only if every check passes; otherwise
+    InvalidImageError (or the HTTP/IO error) is raised and nothing is published.
+    """
+    save_path = Path(save_path)
+    tmp_path = save_path.with_name(save_path.name + PART_SUFFIX)
+    digest = hashlib.sha256()
+
+    try:
+        with session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            raw = response.raw
+            raw.decode_content = True
+
+            # Without Content-Encoding the body length is known up front
+            expected = response.headers.get('Content-Length')
+            if expected and not response.headers.get('Content-Encoding'):
+                # Read straight into the final buffer, no intermediate copies
+                body = bytearray(int(expected))
+                view = memoryview(body)
+                next_chunk = lambda offset: view[offset:offset + buffer_size]
+            else:
+                expected = None
+                body = bytearray()
+                next_chunk = lambda offset: _scratch_buffer(buffer_size)
+
+            written = 0
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = next_chunk(written)
+                    n = raw.readinto(chunk) if chunk else 0
+                    if not n:
+                        break
+                    data = chunk[:n]
+                    if expected is None:
+                        body.extend(data)
+                    f.write(data)
+                    digest.update(data)
+                    written += n
+                f.flush()
+                os.fsync(f.fileno())
+
+            if expected is not None:
+                view.release()
+                if written != len(body):
+                    raise IOError(f"truncated download: got {written} of {expected} bytes")
+
+        with memoryview(body) as body_view:
+            image_format = check_markers(body_view)
+        try:
+            with Image.open(io.BytesIO(body)) as image:
+                width, height = image.size
+                # Decode at 1/8 scale: enough for the dHash, and still walks the whole
+                # entropy-coded stream, so corrupt data fails here
+                image.draft('L', (64, 64))
+                image.load()
+                hash_value = dhash(image)
+        except (OSError, SyntaxError, ValueError) as e:
+            raise InvalidImageError(f"image does not decode: {e}") from e
+        if min(width, height) < min_dimension:
+            raise InvalidImageError(f"image is {width}x{height}, smaller than {min_dimension}px")
+
+        if image_format != 'JPEG' and save_path.suffix.lower() in JPEG_SUFFIXES:
+            written, sha256 = _reencode_jpeg(body, tmp_path)
+            REGISTRY.inc('reencoded_downloads', source_format=image_format)
+            image_format = 'JPEG'
+        else:
+            sha256 = digest.hexdigest()
+
+        os.replace(tmp_path, save_path)
+        REGISTRY.inc('bytes_downloaded', written, host=urlsplit(url).hostname or 'unknown')
+        return DownloadedImage(save_path, written, sha256, hash_value, width, height, image_format)
+    except InvalidImageError:
+        REGISTRY.inc('invalid_downloads', host=urlsplit(url).hostname or 'unknown')
+        raise
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
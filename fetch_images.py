@@ -6,28 +6,113 @@ Fetches high-quality trading images from Unsplash API and organizes them for n8n
 
 import os
 import json
-import requests
-from pathlib import Path
-from typing import Dict, List
+import argparse
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from catalog import write_catalog
+from config import load_config
+from downloader import DownloadedImage, download_image_file
+from http_client import get_session
+from image_store import ContentStore, dhash
+from job_journal import JobJournal
+from manifest import Manifest
+from metrics import REGISTRY, add_instrumentation_args, instrumented, print_histograms
+from optimize_images import avif_supported, variant_relpath, variant_settings, variant_urls
+from rate_limiter import TokenBucket
+from search_cache import SearchCache
+
+# imgix output formats for our variant formats (pjpg = progressive JPEG, like optimize_images.py)
+IMGIX_FORMATS = {
+    'jpeg': 'pjpg',
+    'webp': 'webp',
+    'avif': 'avif',
+}
+
+
+def imgix_url(url: str, **params) -> str:
+    """Add or override imgix rendering parameters (w, q, fm, fit, ...) on an Unsplash image URL."""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({name: str(value) for name, value in params.items()})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
 
 class TradingImagesFetcher:
-    def __init__(self, config_path: str = "config.json"):
+    def __init__(self, config_path: Optional[str] = None, access_key: Optional[str] = None,
+                 resume: bool = False, journal_name: str = "fetch", base_dir: Optional[Path] = None):
         """Initialize the fetcher with configuration."""
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+        self.config = load_config(config_path)
 
-        self.unsplash_api_key = os.environ.get('UNSPLASH_ACCESS_KEY')
+        self.unsplash_api_key = access_key or os.environ.get('UNSPLASH_ACCESS_KEY')
         if not self.unsplash_api_key:
             raise ValueError("Please set UNSPLASH_ACCESS_KEY environment variable")
 
-        self.base_dir = Path(__file__).parent
+        self.base_dir = Path(base_dir or Path(__file__).parent)
         self.headers = {
             'Authorization': f'Client-ID {self.unsplash_api_key}'
         }
+        self.session = get_session()
+
+        # Unsplash allows 50 API requests per hour on the free tier; every search
+        # and download-tracking ping draws from this shared bucket.
+        unsplash_config = self.config['unsplash']
+        self.max_workers = unsplash_config.get('max_workers', 4)
+        self.rate_limiter = TokenBucket(unsplash_config.get('rate_limit_per_hour', 50), name='unsplash')
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # Unsplash serves through imgix, so the source image and every variant are
+        # rendered to size by the CDN instead of downloading full size and re-encoding
+        optimize_config = self.config.get('optimize', {})
+        self.source_width = unsplash_config.get('source_width', 1600)
+        self.source_quality = unsplash_config.get('source_quality', 85)
+        self.cdn_variants = unsplash_config.get('cdn_variants', True)
+        self.variant_workers = unsplash_config.get('variant_workers', 8)
+        self.widths, self.formats = variant_settings(self.config)
+        if 'avif' in self.formats and not avif_supported():
+            self.formats = [fmt for fmt in self.formats if fmt != 'avif']
+        self.qualities = {
+            'jpeg': optimize_config.get('jpeg_quality', 82),
+            'webp': optimize_config.get('webp_quality', 80),
+            'avif': optimize_config.get('avif_quality', 60),
+        }
+        self._variant_pool: Optional[ThreadPoolExecutor] = None
+
+        # Rank the whole search page by thumbnail quality instead of taking the first result
+        ranking_config = unsplash_config.get('ranking', {})
+        self.ranker = None
+        if ranking_config.get('enabled', True):
+            from ranking import THUMB_SIZE, CandidateRanker
+            self.ranker = CandidateRanker(unsplash_config['orientation'], ranking_config.get('weights'))
+            self.thumb_width = ranking_config.get('thumb_width', THUMB_SIZE[0] * 2)
+        self.histograms = {
+            stage: REGISTRY.histogram('stage_seconds', pipeline='fetch', stage=stage)
+            for stage in ('search', 'rank', 'download', 'end_to_end')
+        }
 
-    def fetch_image(self, search_term: str, page: int = 1) -> Dict:
-        """Fetch a single image from Unsplash based on search term."""
+        # Search pages are cached on disk and shared between slots, so reruns and
+        # alternates don't spend hourly quota on answers we already have
+        self.search_cache = SearchCache(
+            self.base_dir,
+            ttl=unsplash_config.get('cache_ttl_hours', 24) * 3600,
+            max_entries=unsplash_config.get('cache_max_entries', 500),
+        )
+        self._claimed_photos = set()
+        self._claim_lock = threading.Lock()
+
+        # Content-addressed index used to avoid fetching the same photo twice
+        self.store = ContentStore(self.base_dir)
+        self.manifest = Manifest(self.base_dir)
+
+        # Write-ahead journal of searches and downloads, replayed by --resume
+        self.journal = JobJournal(self.base_dir, journal_name, resume=resume)
+
+    def search(self, search_term: str, page: int = 1) -> List[Dict]:
+        """Return one page of search results, served from the cache while fresh."""
         url = f"{self.config['unsplash']['api_url']}/search/photos"
         params = {
             'query': search_term,
@@ -36,37 +121,287 @@ class TradingImagesFetcher:
             'orientation': self.config['unsplash']['orientation']
         }
 
-        response = requests.get(url, headers=self.headers, params=params)
-        response.raise_for_status()
+        def request() -> Dict:
+            self.rate_limiter.acquire()
+            response = self.session.get(url, headers=self.headers, params=params)
+            self.rate_limiter.update_from_headers(response.headers)
+            response.raise_for_status()
+            return response.json()
+
+        data = self.search_cache.get_or_fetch(SearchCache.make_key(**params), request)
+        return data.get('results', [])
 
-        data = response.json()
-        if data['total'] > 0:
-            return data['results'][0]
+    def fetch_image(self, search_term: str, page: int = 1) -> Dict:
+        """Fetch a single image from Unsplash based on search term."""
+        results = self.search(search_term, page)
+        if results:
+            return results[0]
         return None
 
-    def download_image(self, image_data: Dict, save_path: Path) -> bool:
-        """Download image from Unsplash and save to disk."""
-        try:
-            # Use regular quality (not raw) to save bandwidth
-            image_url = image_data['urls']['regular']
+    def claim_photo(self, photo_id: Optional[str]) -> bool:
+        """Reserve a photo for one slot of this run. Returns False if another slot has it."""
+        with self._claim_lock:
+            if photo_id in self._claimed_photos:
+                return False
+            self._claimed_photos.add(photo_id)
+            return True
 
-            # Download image
-            response = requests.get(image_url, stream=True)
+    def choose_image(self, search_term: str, folder: Optional[str] = None) -> Optional[Dict]:
+        """Pick the best result on the (cached) page that isn't already in the library or claimed."""
+        if self.ranker:
+            return self.choose_ranked(search_term, folder)
+
+        for candidate in self.search(search_term, page=1):
+            if not self.claim_photo(candidate.get('id')):
+                continue
+
+            if not self.find_duplicate(candidate):
+                return candidate
+        return None
+
+    def thumbnail_url(self, image_data: Dict) -> Optional[str]:
+        """Small CDN rendering used for ranking: the raw photo at thumb_width, else Unsplash's thumb."""
+        raw_url = image_data.get('urls', {}).get('raw')
+        if raw_url:
+            return imgix_url(raw_url, w=self.thumb_width, fit='max', q=70, fm='jpg')
+        return image_data.get('urls', {}).get('thumb')
+
+    def download_thumbnail(self, image_data: Dict) -> Optional[bytes]:
+        url = self.thumbnail_url(image_data)
+        if not url:
+            return None
+        try:
+            response = self.session.get(url)
             response.raise_for_status()
+            return response.content
+        except Exception as e:
+            print(f"Error downloading thumbnail: {e}")
+            return None
+
+    def choose_ranked(self, search_term: str, folder: Optional[str]) -> Optional[Dict]:
+        """Score every unclaimed candidate's thumbnail and claim the best one still available."""
+        candidates = [
+            candidate for candidate in self.search(search_term, page=1)
+            if candidate.get('id') not in self._claimed_photos and not self.store.slot_for_photo(candidate.get('id'))
+        ]
+        if not candidates:
+            return None
+
+        with self.histograms['rank'].time():
+            # Thumbnails share the variant pool: both are short CDN requests
+            if self._variant_pool:
+                thumbnails = list(self._variant_pool.map(self.download_thumbnail, candidates))
+            else:
+                thumbnails = [self.download_thumbnail(candidate) for candidate in candidates]
+            ranked = self.ranker.rank(candidates, thumbnails, list(self.store.slot_hashes().values()),
+                                      list(self.store.slot_hashes(folder).values()) if folder else [])
+        REGISTRY.inc('ranked_candidates', len(candidates), pipeline='fetch')
+
+        for choice in ranked:
+            if self.claim_photo(choice.candidate.get('id')):
+                return {**choice.candidate, 'score': round(choice.score, 3), 'scores': choice.components}
+        return None
+
+    def source_url(self, image_data: Dict) -> str:
+        """URL of the library-sized source image: the raw photo rendered to source_width by imgix."""
+        raw_url = image_data['urls'].get('raw')
+        if not raw_url:
+            return image_data['urls']['regular']
+        return imgix_url(raw_url, w=self.source_width, fit='max', q=self.source_quality, fm='jpg')
+
+    def variant_jobs(self, image_data: Dict, slot: str) -> List[Tuple[str, str, int]]:
+        """(url, relpath, width) of each variant imgix can render for this photo, without upscaling."""
+        raw_url = image_data['urls'].get('raw')
+        if not raw_url or not self.cdn_variants:
+            return []
+
+        # fit=max never upscales, so widths beyond both the photo and our source are skipped
+        max_width = min(image_data.get('width') or self.source_width, self.source_width)
+        folder, image_filename = slot.split('/', 1)
+        return [
+            (imgix_url(raw_url, w=width, fit='max', q=self.qualities[fmt], fm=IMGIX_FORMATS[fmt]),
+             variant_relpath(folder, image_filename, width, fmt), width)
+            for width in self.widths if width <= max_width
+            for fmt in self.formats
+        ]
+
+    def download_variant(self, url: str, relpath: str, width: int) -> bool:
+        """Download one CDN-rendered variant; a wrong-sized result is discarded."""
+        variant_path = self.base_dir / relpath
+        variant_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            downloaded = download_image_file(self.session, url, variant_path)
+        except Exception as e:
+            print(f"Error downloading variant {relpath}: {e}")
+            return False
+        if downloaded.width != width:
+            variant_path.unlink()
+            print(f"Variant {relpath} came back {downloaded.width}px wide, expected {width}px")
+            return False
+        return True
 
-            # Save image
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+    def download_variants(self, image_data: Dict, slot: str) -> List[str]:
+        """Fetch every variant in parallel. Returns the relpaths saved; optimize_images.py fills any gaps."""
+        jobs = self.variant_jobs(image_data, slot)
+        if not jobs:
+            return []
+
+        if self._variant_pool:
+            futures = [(self._variant_pool.submit(self.download_variant, *job), job[1]) for job in jobs]
+            return [relpath for future, relpath in futures if future.result()]
+        return [relpath for url, relpath, width in jobs if self.download_variant(url, relpath, width)]
+
+    def download_image(self, image_data: Dict, save_path: Path) -> Optional[DownloadedImage]:
+        """Download image from Unsplash and save to disk. Returns None on failure."""
+        try:
+            # Rendered to the library's size by the CDN, not the full-size original
+            image_url = self.source_url(image_data)
+
+            # Hashed and validated while streaming; only a complete image is renamed into place
+            downloaded = download_image_file(self.session, image_url, save_path)
 
             # Trigger download tracking for Unsplash (required by API guidelines)
             if 'links' in image_data and 'download_location' in image_data['links']:
-                requests.get(image_data['links']['download_location'], headers=self.headers)
+                download_location = image_data['links']['download_location']
+                if self._executor:
+                    self._executor.submit(self.track_download, download_location)
+                else:
+                    self.track_download(download_location)
 
-            return True
+            return downloaded
         except Exception as e:
             print(f"Error downloading image: {e}")
-            return False
+            return None
+
+    def track_download(self, download_location: str):
+        """Ping Unsplash's download endpoint (counts against the API quota)."""
+        try:
+            self.rate_limiter.acquire()
+            response = self.session.get(download_location, headers=self.headers)
+            self.rate_limiter.update_from_headers(response.headers)
+        except Exception as e:
+            print(f"Error tracking download: {e}")
+
+    def fetch_slot(self, search_term: str, image_path: Path) -> Tuple[bool, str]:
+        """Search and download one image slot. Returns (success, status message)."""
+        slot = f"{image_path.parent.name}/{image_path.name}"
+        started = time.perf_counter()
+
+        # A search finished before an interruption is replayed from the journal
+        searched = self.journal.result(slot, 'search')
+        if searched:
+            image_data = searched['image']
+            with self._claim_lock:
+                self._claimed_photos.add(image_data.get('id'))
+        else:
+            self.journal.record(slot, 'search', 'running', query=search_term)
+            with self.histograms['search'].time():
+                image_data = self.choose_image(search_term, image_path.parent.name)
+            if not image_data:
+                self.journal.record(slot, 'search', 'failed')
+                return False, "❌ No unused results found"
+            self.journal.record(slot, 'search', 'done', image={
+                key: image_data[key] for key in ('id', 'width', 'height', 'urls', 'links', 'score', 'scores')
+                if key in image_data
+            })
+
+        self.journal.record(slot, 'download', 'running', url=self.source_url(image_data))
+        with self.histograms['download'].time():
+            downloaded = self.download_image(image_data, image_path)
+        if downloaded:
+            self.histograms['end_to_end'].observe(time.perf_counter() - started)
+            self.journal.record(slot, 'download', 'done')
+            self.store.add_slot(slot, photo_id=image_data.get('id'), sha=downloaded.sha256,
+                                hash_value=downloaded.dhash)
+            self.manifest.record(slot, sha256=downloaded.sha256, dimensions=(downloaded.width, downloaded.height),
+                                 source='unsplash', query=search_term, photo_id=image_data.get('id'),
+                                 score=image_data.get('score'))
+            variants = self.download_variants(image_data, slot)
+            if variants:
+                self.manifest.set_variants(slot, variants)
+            return True, f"✅ Downloaded: {image_path.name}"
+
+        self.journal.record(slot, 'download', 'failed')
+        return False, "❌ Failed to download"
+
+    def find_duplicate(self, image_data: Dict) -> Optional[str]:
+        """Return the slot already holding this photo (same id or near-identical thumbnail)."""
+        photo_id = image_data.get('id')
+        if photo_id:
+            slot = self.store.slot_for_photo(photo_id)
+            if slot:
+                return slot
+
+        # Compare the ~200px thumbnail's perceptual hash before paying for the full download
+        thumb_url = image_data.get('urls', {}).get('thumb')
+        if not thumb_url:
+            return None
+
+        try:
+            response = self.session.get(thumb_url)
+            response.raise_for_status()
+            matches = self.store.near_duplicates(dhash(response.content))
+        except Exception as e:
+            print(f"Error checking for duplicates: {e}")
+            return None
+
+        return matches[0][0] if matches else None
+
+    def fetch_jobs(self, jobs: List[Tuple[str, Path]]) -> int:
+        """Run (search_term, save_path) jobs concurrently. Returns the number downloaded."""
+        if not jobs:
+            return 0
+
+        downloaded = 0
+        print(f"\n⚡ Fetching {len(jobs)} images with {self.max_workers} workers...")
+
+        with REGISTRY.stage('fetch', 'images'), ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=self.variant_workers) as variant_pool:
+            self._executor = executor
+            self._variant_pool = variant_pool
+            try:
+                futures = {}
+                for search_term, image_path in jobs:
+                    slot = f"{image_path.parent.name}/{image_path.name}"
+                    self.journal.queue(slot, query=search_term)
+                    futures[executor.submit(self.fetch_slot, search_term, image_path)] = (search_term, slot)
+
+                for future in as_completed(futures):
+                    search_term, slot = futures[future]
+                    try:
+                        success, message = future.result()
+                    except Exception as e:
+                        success, message = False, f"❌ Error: {e}"
+
+                    self.journal.finish(slot, success)
+                    REGISTRY.inc('items', pipeline='fetch', result='ok' if success else 'failed')
+                    REGISTRY.log('item', pipeline='fetch', slot=slot, query=search_term, ok=bool(success),
+                                 message=message)
+                    print(f"  🔍 {search_term} → {message}")
+                    downloaded += success
+            finally:
+                self._executor = None
+                self._variant_pool = None
+                self.store.save()
+                self.manifest.save()
+
+        print(f"🗂️  Search cache: {self.search_cache.hits} hits, {self.search_cache.misses} API calls")
+        if self.rate_limiter.total_wait:
+            print(f"⏳ Waited {self.rate_limiter.total_wait:.1f}s for the Unsplash rate limit")
+        print_histograms(list(self.histograms.values()))
+
+        return downloaded
+
+    def resume_jobs(self) -> int:
+        """Replay only the jobs the journal shows as unfinished."""
+        jobs = [
+            (spec['query'], self.base_dir / slot)
+            for slot, spec in sorted(self.journal.unfinished().items())
+        ]
+        print(f"⏯️  Resuming {len(jobs)} unfinished jobs from {self.journal.path.name}")
+        for _, image_path in jobs:
+            image_path.parent.mkdir(exist_ok=True)
+        return self.fetch_jobs(jobs)
 
     def fetch_all_images(self):
         """Fetch all images for all assets."""
@@ -75,6 +410,9 @@ class TradingImagesFetcher:
         print(f"🎯 Images per asset: {self.config['assets'][0]['images_per_asset']}")
 
         total_images = 0
+        jobs = []
+
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
 
         for asset in self.config['assets']:
             asset_name = asset['name']
@@ -90,38 +428,22 @@ class TradingImagesFetcher:
             asset_folder = self.base_dir / folder
             asset_folder.mkdir(exist_ok=True)
 
-            # Fetch images using different search terms
-            for i, search_term in enumerate(search_terms[:images_per_asset]):
+            # Fetch images using different search terms; extra slots reuse the
+            # cached result pages and take the next unused photo
+            for i in range(images_per_asset):
+                search_term = search_terms[i % len(search_terms)]
                 image_filename = f"{folder}-{i+1}.jpg"
                 image_path = asset_folder / image_filename
 
                 # Skip if image already exists
-                if image_path.exists():
+                if self.manifest.get(f"{folder}/{image_filename}"):
                     print(f"  ✓ Skipped: {image_filename} (already exists)")
                     total_images += 1
                     continue
 
-                print(f"  🔍 Searching: {search_term}...", end=" ")
-
-                try:
-                    # Fetch image data
-                    image_data = self.fetch_image(search_term, page=1)
+                jobs.append((search_term, image_path))
 
-                    if image_data:
-                        # Download image
-                        if self.download_image(image_data, image_path):
-                            print(f"✅ Downloaded: {image_filename}")
-                            total_images += 1
-                        else:
-                            print(f"❌ Failed to download")
-                    else:
-                        print(f"❌ No results found")
-
-                    # Rate limiting: Unsplash allows 50 requests per hour
-                    time.sleep(1)  # Be nice to the API
-
-                except Exception as e:
-                    print(f"❌ Error: {e}")
+        total_images += self.fetch_jobs(jobs)
 
         print(f"\n{'='*60}")
         print(f"✨ Complete! Downloaded {total_images} images")
@@ -131,21 +453,34 @@ class TradingImagesFetcher:
         """Generate URL mapping for n8n integration."""
         url_mapping = {}
 
+        widths, formats = variant_settings(self.config)
         base_url = f"https://{storage_account_name}.z6.web.core.windows.net"
 
+        # List the files that actually exist, not an assumed 1..N numbering
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
+
         for asset in self.config['assets']:
             asset_name = asset['name']
             folder = asset['folder']
-            images_per_asset = asset['images_per_asset']
 
             asset_urls = []
-            for i in range(1, images_per_asset + 1):
-                image_filename = f"{folder}-{i}.jpg"
+            asset_variants = []
+            for slot, _ in self.manifest.entries(folder):
+                image_filename = slot.split('/', 1)[1]
                 url = f"{base_url}/{folder}/{image_filename}"
                 asset_urls.append(url)
+                asset_variants.append(
+                    variant_urls(self.base_dir, base_url, folder, image_filename, widths, formats)
+                )
 
             url_mapping[asset_name] = asset_urls
 
+            # Responsive variants from optimize_images.py, in the same order as the originals
+            if any(asset_variants):
+                url_mapping.setdefault('variants', {})[asset_name] = asset_variants
+
+        self.manifest.save()
+
         # Save to JSON file
         output_path = self.base_dir / 'image-urls.json'
         with open(output_path, 'w') as f:
@@ -154,16 +489,29 @@ class TradingImagesFetcher:
         print(f"\n📄 Generated: image-urls.json")
         print(f"🔗 URLs ready for n8n integration!")
 
+        index, _ = write_catalog(self.base_dir, self.config, self.manifest, base_url, 'azure')
+        print(f"🗂️  Catalog v{index['version']}: catalog/azure/index.json")
+
         return url_mapping
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     """Main entry point."""
-    try:
-        fetcher = TradingImagesFetcher()
+    parser = argparse.ArgumentParser(description="Fetch trading images from Unsplash")
+    parser.add_argument('--resume', action='store_true',
+                        help="replay only the unfinished jobs of an interrupted run")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
 
-        # Fetch all images
-        fetcher.fetch_all_images()
+    try:
+        with instrumented(args, 'fetch'):
+            fetcher = TradingImagesFetcher(resume=args.resume)
+
+            if args.resume:
+                fetcher.resume_jobs()
+            else:
+                # Fetch all images
+                fetcher.fetch_all_images()
 
         # Generate URL mapping (you'll update storage account name after Azure setup)
         print("\n" + "="*60)
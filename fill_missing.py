@@ -1,39 +1,23 @@
 #!/usr/bin/env python3
-"""Fill missing image slots by duplicating existing similar images."""
+"""Fill missing image slots by referencing existing similar images in the content store."""
 
-import shutil
-from pathlib import Path
+import argparse
+from typing import List, Optional
 
-# Map of what to copy to fill missing slots
-duplicates = {
-    "eur-usd/eur-usd-2.jpg": "eur-usd/eur-usd-1.jpg",  # Duplicate EUR/USD image
-    "xrp/xrp-4.jpg": "xrp/xrp-1.jpg",  # Duplicate XRP image
-    "usd-cad/usd-cad-1.jpg": "eur-usd/eur-usd-1.jpg",  # Use forex image
-    "usd-cad/usd-cad-3.jpg": "eur-usd/eur-usd-3.jpg",  # Use forex image
-    "usd-cad/usd-cad-4.jpg": "eur-usd/eur-usd-4.jpg",  # Use forex image
-    "usd-cad/usd-cad-5.jpg": "eur-usd/eur-usd-5.jpg",  # Use forex image
-    "gbp-usd/gbp-usd-1.jpg": "eur-usd/eur-usd-1.jpg",  # Use forex image
-    "gbp-usd/gbp-usd-2.jpg": "eur-usd/eur-usd-3.jpg",  # Use forex image
-    "gbp-usd/gbp-usd-3.jpg": "eur-usd/eur-usd-4.jpg",  # Use forex image
-    "gbp-usd/gbp-usd-4.jpg": "eur-usd/eur-usd-5.jpg",  # Use forex image
-    "gbp-usd/gbp-usd-5.jpg": "eur-usd/eur-usd-1.jpg",  # Use forex image
-    "aud/aud-1.jpg": "eur-usd/eur-usd-1.jpg",  # Use forex image
-    "aud/aud-2.jpg": "eur-usd/eur-usd-3.jpg",  # Use forex image
-    "aud/aud-3.jpg": "eur-usd/eur-usd-4.jpg",  # Use forex image
-    "aud/aud-4.jpg": "eur-usd/eur-usd-5.jpg",  # Use forex image
-    "aud/aud-5.jpg": "eur-usd/eur-usd-1.jpg",  # Use forex image
-}
+from audit_library import audit_and_repair
 
-print("📋 Filling missing image slots...")
-filled = 0
 
-for dest, src in duplicates.items():
-    dest_path = Path(dest)
-    src_path = Path(src)
-    
-    if not dest_path.exists() and src_path.exists():
-        shutil.copy2(src_path, dest_path)
-        print(f"  ✅ Created {dest}")
-        filled += 1
+def main(argv: Optional[List[str]] = None):
+    """Link each missing or broken slot to a stand-in chosen by the library audit."""
+    parser = argparse.ArgumentParser(description="Fill missing image slots from similar existing images")
+    parser.add_argument('--dry-run', action='store_true', help="write the repair plan without linking anything")
+    args = parser.parse_args(argv)
 
-print(f"\n✨ Filled {filled} missing slots!")
+    print("📋 Filling missing image slots...")
+    if not audit_and_repair('fill', {'missing', 'corrupt', 'truncated'}, args.dry_run):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
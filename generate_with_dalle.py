@@ -6,16 +6,39 @@ Generates custom AI images using Azure OpenAI DALL-E 3.
 
 import os
 import json
-import requests
+import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Tuple
 import time
 
+import requests
+
+from config import load_config
+from dalle_scheduler import DEFAULT_GENERATE_SECONDS, DalleScheduler, GenerationDeferred, request_cost
+from downloader import DownloadedImage, download_image_file
+from http_client import get_session
+from image_store import ContentStore
+from job_journal import JobJournal
+from manifest import Manifest, slot_number
+from metrics import REGISTRY, add_instrumentation_args, instrumented, print_histograms
+
+# Azure OpenAI image URLs expire after 24 hours; regenerate rather than download older ones
+IMAGE_URL_TTL = 23 * 3600
+
+DEFAULT_OPTIONS = {
+    "size": "1024x1024",
+    "quality": "standard",
+    "style": "natural",  # or "vivid" for more hyper-real images
+}
+
+
 class DalleImageGenerator:
-    def __init__(self, config_path: str = "config.json"):
+    def __init__(self, config_path: Optional[str] = None, resume: bool = False,
+                 base_dir: Optional[Path] = None, budget: Optional[float] = None,
+                 max_minutes: Optional[float] = None, journal_name: str = "generate"):
         """Initialize DALL-E generator with configuration."""
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+        self.config = load_config(config_path)
 
         # Azure OpenAI credentials
         self.azure_endpoint = os.environ.get('AZURE_OPENAI_ENDPOINT')
@@ -29,7 +52,35 @@ class DalleImageGenerator:
                 "Example: export AZURE_OPENAI_API_KEY='your-api-key'"
             )
 
-        self.base_dir = Path(__file__).parent
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.session = get_session()
+
+        # Pipeline limits: keep them within the deployment's RPM quota
+        dalle_config = self.config.get('dalle', {})
+        self.max_concurrent = dalle_config.get('max_concurrent_generations', 2)
+        self.download_workers = dalle_config.get('download_workers', 4)
+
+        # Prices each request, holds spend under the run budget and monthly cap, and paces
+        # requests evenly across the deployment's RPM; what doesn't fit goes to the backlog
+        self.scheduler = DalleScheduler(self.base_dir, dalle_config.get('requests_per_minute', 6),
+                                        monthly_budget=dalle_config.get('monthly_budget_usd'),
+                                        run_budget=budget, max_minutes=max_minutes)
+        self.rate_limiter = self.scheduler.rate_limiter
+        self.histograms = {
+            stage: REGISTRY.histogram('stage_seconds', pipeline='generate', stage=stage)
+            for stage in ('generate', 'download', 'end_to_end')
+        }
+        self._download_pool: Optional[ThreadPoolExecutor] = None
+
+        # Per-slot outcome of the current run: status, stage latencies, errors
+        self.outcomes: Dict[str, Dict] = {}
+
+        # Content-addressed index used to flag near-duplicate generations
+        self.store = ContentStore(self.base_dir)
+        self.manifest = Manifest(self.base_dir)
+
+        # Write-ahead journal of generations and downloads, replayed by --resume
+        self.journal = JobJournal(self.base_dir, journal_name, resume=resume)
 
         # DALL-E 3 prompts for each asset type
         self.prompts = {
@@ -91,7 +142,8 @@ class DalleImageGenerator:
             ]
         }
 
-    def generate_image(self, prompt: str, size: str = "1024x1024", quality: str = "standard") -> str:
+    def generate_image(self, prompt: str, size: str = "1024x1024", quality: str = "standard",
+                       style: str = "natural") -> str:
         """Generate a single image using DALL-E 3."""
         api_version = "2024-02-01"
         url = f"{self.azure_endpoint}/openai/deployments/{self.deployment_name}/images/generations?api-version={api_version}"
@@ -105,11 +157,11 @@ class DalleImageGenerator:
             "prompt": prompt,
             "size": size,
             "quality": quality,
-            "style": "natural",  # or "vivid" for more hyper-real images
+            "style": style,
             "n": 1
         }
 
-        response = requests.post(url, headers=headers, json=data)
+        response = self.session.post(url, headers=headers, json=data)
         response.raise_for_status()
 
         result = response.json()
@@ -117,92 +169,381 @@ class DalleImageGenerator:
 
         return image_url
 
-    def download_image(self, image_url: str, save_path: Path) -> bool:
-        """Download generated image from URL."""
+    def download_image(self, image_url: str, save_path: Path, attempts: int = 3) -> Optional[DownloadedImage]:
+        """Download generated image from URL. Returns None on failure."""
+        # The generation is already paid for, so also retry failures the session's
+        # status-based retries can't see (e.g. a connection dropped mid-body, or a
+        # body that isn't a complete image).
+        for attempt in range(1, attempts + 1):
+            try:
+                # Hashed and validated while streaming; only a complete image is renamed into place
+                return download_image_file(self.session, image_url, save_path)
+            except Exception as e:
+                print(f"❌ Error downloading image (attempt {attempt}/{attempts}): {e}")
+                if attempt < attempts:
+                    time.sleep(2 ** attempt)
+
+        return None
+
+    def _download_job(self, prompt: str, image_url: str, image_path: Path, started: float) -> bool:
+        """Download a finished generation (runs on the download pool)."""
+        slot = f"{image_path.parent.name}/{image_path.name}"
+
+        self.journal.record(slot, 'download', 'running')
+        download_started = time.perf_counter()
+        downloaded = self.download_image(image_url, image_path)
+        success = downloaded is not None
+        finished = time.perf_counter()
+        self.histograms['download'].observe(finished - download_started)
+        self.histograms['end_to_end'].observe(finished - started)
+        self.outcomes[slot].update({
+            'download_seconds': round(finished - download_started, 3),
+            'latency_seconds': round(finished - started, 3),
+        })
+        self.journal.record(slot, 'download', 'done' if success else 'failed')
+
+        if success:
+            self.store.add_slot(slot, sha=downloaded.sha256, hash_value=downloaded.dhash)
+            self.manifest.record(slot, sha256=downloaded.sha256, dimensions=(downloaded.width, downloaded.height),
+                                 source='dalle', prompt=prompt)
+            for other, distance in self.store.near_duplicates(downloaded.dhash):
+                if other != slot:
+                    print(f"  ⚠️  {slot} looks like {other} (distance {distance})")
+        return success
+
+    def job_cost(self, job: Tuple) -> float:
+        """Price of a (prompt, save_path[, options]) job; nothing if its generation is already paid for."""
+        prompt, image_path, *rest = job
+        generated = self.journal.result(f"{image_path.parent.name}/{image_path.name}", 'generate')
+        if generated and time.time() - generated['ts'] < IMAGE_URL_TTL:
+            return 0.0
+        return request_cost({**DEFAULT_OPTIONS, **(rest[0] if rest else {})})
+
+    def _generate_job(self, prompt: str, image_path: Path, options: Dict, cost: float = 0.0) -> Future:
+        """Generate one image and hand its URL to the download pool."""
+        slot = f"{image_path.parent.name}/{image_path.name}"
+        started = time.perf_counter()
+        self.outcomes[slot] = {}
+
+        # A paid generation that finished before an interruption is not repeated
+        generated = self.journal.result(slot, 'generate')
+        if generated and time.time() - generated['ts'] < IMAGE_URL_TTL:
+            image_url = generated['url']
+        else:
+            self.rate_limiter.acquire()
+            self.journal.record(slot, 'generate', 'running')
+            generate_started = time.perf_counter()
+            request_options = {**DEFAULT_OPTIONS, **options}
+            try:
+                image_url = self.generate_image(prompt, **request_options)
+            except requests.HTTPError as e:
+                # Failed requests aren't billed; a 429 means we're over quota, so wait it out
+                self.scheduler.ledger.settle(cost, charged=False)
+                self.journal.record(slot, 'generate', 'failed')
+                if e.response is not None and e.response.status_code == 429:
+                    self.scheduler.throttled()
+                    raise GenerationDeferred('throttled') from e
+                raise
+            except Exception:
+                self.scheduler.ledger.settle(cost, charged=False)
+                raise
+            self.scheduler.ledger.settle(cost, charged=True)
+            elapsed = time.perf_counter() - generate_started
+            REGISTRY.inc('dalle_generations', size=request_options['size'], quality=request_options['quality'])
+            self.histograms['generate'].observe(elapsed)
+            self.outcomes[slot]['generate_seconds'] = round(elapsed, 3)
+            self.journal.record(slot, 'generate', 'done', url=image_url)
+
+        return self._download_pool.submit(self._download_job, prompt, image_url, image_path, started)
+
+    def run_pipeline(self, jobs: List[Tuple], on_result: Optional[Callable[[str, Dict], None]] = None) -> int:
+        """Generate (prompt, save_path[, options]) jobs with overlapped downloads. Returns images saved.
+
+        on_result(slot, outcome) is called as each job finishes, successful or not.
+        """
+        if not jobs:
+            return 0
+
+        # Emptiest assets first; jobs over budget or beyond the run's time window are deferred
+        folders = {image_path.parent.name for _, image_path, *_ in jobs}
+        existing = {folder: len(self.manifest.entries(folder)) for folder in folders}
+        admitted, deferred = self.scheduler.plan(jobs, existing, self.job_cost)
+
+        # Enough generations in flight to use the whole RPM at the observed generation latency
+        in_flight = self.scheduler.in_flight(self.max_concurrent,
+                                             self.histograms['generate'].percentile(50) or DEFAULT_GENERATE_SECONDS)
+        in_flight = min(in_flight, max(1, len(admitted)))
+        print(f"\n⚡ Generating {len(admitted)} images "
+              f"({in_flight} in flight, {self.download_workers} download workers)...")
+
+        def defer(job: Tuple, reason: str):
+            prompt, image_path, *rest = job
+            slot = f"{image_path.parent.name}/{image_path.name}"
+            self.scheduler.backlog.defer(slot, prompt, rest[0] if rest else {}, reason)
+            finish(slot, 'deferred', reason)
+            print(f"  ⏸️  Deferred {image_path.name} ({reason})")
+
+        def finish(slot: str, status: str, error: Optional[str] = None):
+            self.journal.finish(slot, status == 'saved')
+            outcome = self.outcomes.setdefault(slot, {})
+            outcome['status'] = status
+            if error:
+                outcome['error'] = error
+            REGISTRY.inc('items', pipeline='generate', result='ok' if status == 'saved' else status)
+            REGISTRY.log('item', pipeline='generate', slot=slot, **outcome)
+            if on_result:
+                on_result(slot, outcome)
+
+        saved = 0
+        with REGISTRY.stage('generate', 'images'), \
+                ThreadPoolExecutor(max_workers=self.download_workers) as download_pool, \
+                ThreadPoolExecutor(max_workers=in_flight) as generate_pool:
+            self._download_pool = download_pool
+            try:
+                for job, reason in deferred:
+                    defer(job, reason)
+
+                generate_futures = {}
+                for job, cost in admitted:
+                    prompt, image_path, *rest = job
+                    options = rest[0] if rest else {}
+                    slot = f"{image_path.parent.name}/{image_path.name}"
+                    self.journal.queue(slot, prompt=prompt, options=options)
+                    future = generate_pool.submit(self._generate_job, prompt, image_path, options, cost)
+                    generate_futures[future] = (slot, image_path, job)
+
+                # One loop over both stages, so each job is finished (journal, on_result)
+                # as soon as its download lands rather than after the last generation
+                pending = dict(generate_futures)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        slot, image_path, job = pending.pop(future)
+                        if future in generate_futures:
+                            try:
+                                pending[future.result()] = (slot, image_path, job)
+                                print(f"  🎨 Generated: {image_path.name}")
+                            except GenerationDeferred as e:
+                                defer(job, e.reason)
+                            except Exception as e:
+                                finish(slot, 'failed', str(e))
+                                print(f"  ❌ Error generating {image_path.name}: {e}")
+                        elif future.result():
+                            finish(slot, 'saved')
+                            print(f"  ✅ Saved: {image_path.name}")
+                            saved += 1
+                        else:
+                            finish(slot, 'failed', 'download failed')
+                            print(f"  ❌ Failed to download {image_path.name}")
+            finally:
+                self._download_pool = None
+                self.store.save()
+                self.manifest.save()
+
+        return saved
+
+    def resume_jobs(self) -> int:
+        """Replay only the jobs the journal shows as unfinished.
+
+        Slots already on disk were saved before the interruption and are only marked
+        done; generations whose URL is still live are downloaded, not paid for again.
+        """
+        jobs = []
+        for slot, spec in sorted(self.journal.unfinished().items()):
+            image_path = self.base_dir / slot
+            if image_path.exists():
+                self.journal.finish(slot, True)
+                continue
+            image_path.parent.mkdir(exist_ok=True)
+            jobs.append((spec['prompt'], image_path, spec.get('options', {})))
+
+        paid = sum(1 for job in jobs if not self.job_cost(job))
+        print(f"⏯️  Resuming {len(jobs)} unfinished jobs from {self.journal.path.name} "
+              f"({paid} already generated, downloading only)")
+
+        saved = self.run_pipeline(jobs)
+        self.print_spend()
+        print_histograms(list(self.histograms.values()))
+        return saved
+
+    def generate_backlog(self) -> int:
+        """Retry the requests earlier runs deferred; any that still don't fit are deferred again."""
+        # Entries stay on disk until their image is saved; re-deferrals append a newer entry
+        entries = self.scheduler.backlog.entries().values()
+        jobs = []
+        for entry in entries:
+            image_path = self.base_dir / entry['slot']
+            if image_path.exists():
+                continue  # Filled some other way since it was deferred
+            image_path.parent.mkdir(exist_ok=True)
+            jobs.append((entry['prompt'], image_path, entry.get('options', {})))
+
+        print(f"📥 {len(jobs)} deferred requests in the backlog")
         try:
-            response = requests.get(image_url, stream=True)
-            response.raise_for_status()
+            saved = self.run_pipeline(jobs)
+        finally:
+            self.scheduler.backlog.prune()
+        self.print_spend()
+        print_histograms(list(self.histograms.values()))
+        return saved
+
+    def print_spend(self):
+        """This run's spend and the month-to-date total against the configured budgets."""
+        ledger = self.scheduler.ledger
+        print(f"💰 Spent this run: ${ledger.run_spent:.2f} USD "
+              f"(month to date: ${ledger.month_spent():.2f}"
+              + (f" of ${ledger.monthly_budget:.2f}" if ledger.monthly_budget is not None else "") + ")")
+        backlog = len(self.scheduler.backlog.entries())
+        if backlog:
+            print(f"⏸️  {backlog} requests deferred to {self.scheduler.backlog.path.name} "
+                  f"(run with --backlog to retry them)")
+
+    def generate_batch(self, input_path: Path, output_path: Path) -> int:
+        """Generate every prompt in a JSONL file, streaming one JSONL result per image."""
+        folders = {asset['name']: asset['folder'] for asset in self.config['assets']}
+        folders.update({folder: folder for folder in folders.values()})
+        self.manifest.sync(list(set(folders.values())))
+
+        # New images take the numbers after the highest existing (or deferred) slot in each folder
+        backlog_slots = list(self.scheduler.backlog.entries())
+        next_number = {
+            folder: max([slot_number(slot) for slot, _ in self.manifest.entries(folder)]
+                        + [slot_number(slot) for slot in backlog_slots if slot.startswith(f"{folder}/")],
+                        default=0) + 1
+            for folder in set(folders.values())
+        }
+
+        jobs = []
+        requests_by_slot = {}
+        with open(input_path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                folder = folders.get(request.get('asset'))
+                if not folder or not request.get('prompt'):
+                    print(f"  ⚠️  Line {line_number}: needs a known 'asset' and a 'prompt', skipped")
+                    continue
 
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+                options = {key: request[key] for key in DEFAULT_OPTIONS if key in request}
+                (self.base_dir / folder).mkdir(exist_ok=True)
 
-            return True
-        except Exception as e:
-            print(f"❌ Error downloading image: {e}")
-            return False
+                for _ in range(request.get('n', 1)):
+                    image_path = self.base_dir / folder / f"{folder}-{next_number[folder]}.jpg"
+                    next_number[folder] += 1
+                    slot = f"{folder}/{image_path.name}"
+                    requests_by_slot[slot] = {'id': request.get('id', f"line-{line_number}"),
+                                              'asset': request['asset'], 'prompt': request['prompt'],
+                                              **options}
+                    jobs.append((request['prompt'], image_path, options))
+
+        print(f"📥 Loaded {len(jobs)} generation requests from {input_path}")
+
+        with open(output_path, 'a') as out:
+            def write_result(slot: str, outcome: Dict):
+                result = {**requests_by_slot[slot], **outcome}
+                if outcome.get('status') == 'saved':
+                    result['path'] = slot
+                out.write(json.dumps(result, sort_keys=True) + "\n")
+                out.flush()
+
+            saved = self.run_pipeline(jobs, on_result=write_result)
+
+        print(f"\n{'='*60}")
+        print(f"✨ Batch Complete! Saved {saved}/{len(jobs)} images")
+        print(f"📄 Results: {output_path}")
+        print(f"{'='*60}")
+        self.print_spend()
+        print_histograms(list(self.histograms.values()))
+        return saved
+
+    def prompt_for(self, asset_name: str, index: int) -> str:
+        """Prompt for an asset's index-th slot; extra slots cycle through its prompts like search terms."""
+        prompts = self.prompts.get(asset_name)
+        if not prompts:
+            return f"Professional financial chart for {asset_name}, modern trading interface, high quality digital art"
+        return prompts[index % len(prompts)]
 
     def generate_all_images(self):
         """Generate all images using DALL-E 3."""
         print("🎨 Starting DALL-E 3 image generation...")
         print(f"🤖 Azure OpenAI Endpoint: {self.azure_endpoint}")
         print(f"📊 Total assets: {len(self.config['assets'])}")
-        print(f"🎯 Images per asset: 5")
+        print(f"🎯 Images per asset: {self.config['assets'][0]['images_per_asset']}")
 
         total_generated = 0
-        total_cost_estimate = 0.0
+        jobs = []
+
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
 
         for asset in self.config['assets']:
             asset_name = asset['name']
             folder = asset['folder']
-            images_per_asset = 5
+            images_per_asset = asset['images_per_asset']
 
             print(f"\n{'='*60}")
-            print(f"🎨 Generating: {asset_name.upper()}")
+            print(f"🎨 Queuing: {asset_name.upper()}")
             print(f"{'='*60}")
 
             # Create folder if it doesn't exist
             asset_folder = self.base_dir / folder
             asset_folder.mkdir(exist_ok=True)
 
-            # Get prompts for this asset
-            prompts = self.prompts.get(asset_name, [])
-
-            # Generate images
-            for i, prompt in enumerate(prompts[:images_per_asset]):
+            for i in range(images_per_asset):
+                prompt = self.prompt_for(asset_name, i)
                 image_filename = f"{folder}-{i+1}.jpg"
                 image_path = asset_folder / image_filename
 
                 # Skip if image already exists
-                if image_path.exists():
+                if self.manifest.get(f"{folder}/{image_filename}"):
                     print(f"  ✓ Skipped: {image_filename} (already exists)")
                     total_generated += 1
                     continue
 
-                print(f"  🎨 Generating {i+1}/5...", end=" ")
-
-                try:
-                    # Generate image
-                    image_url = self.generate_image(prompt, size="1024x1024", quality="standard")
-
-                    # Download image
-                    if self.download_image(image_url, image_path):
-                        print(f"✅ Generated: {image_filename}")
-                        total_generated += 1
-                        total_cost_estimate += 0.04  # Approximate cost per image
-                    else:
-                        print(f"❌ Failed to download")
+                jobs.append((prompt, image_path))
 
-                    # Rate limiting: Be respectful with API calls
-                    time.sleep(2)
-
-                except Exception as e:
-                    print(f"❌ Error: {e}")
+        newly_generated = self.run_pipeline(jobs)
+        total_generated += newly_generated
 
         print(f"\n{'='*60}")
         print(f"✨ Generation Complete!")
         print(f"🎨 Generated: {total_generated} images")
-        print(f"💰 Estimated Cost: ${total_cost_estimate:.2f} USD")
+        self.print_spend()
         print(f"{'='*60}")
+        print_histograms(list(self.histograms.values()))
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     """Main entry point."""
-    try:
-        generator = DalleImageGenerator()
+    parser = argparse.ArgumentParser(description="Generate trading images with DALL-E 3")
+    parser.add_argument('--resume', action='store_true',
+                        help="replay only the unfinished jobs of an interrupted run")
+    parser.add_argument('--batch', metavar='PROMPTS_JSONL',
+                        help="generate the prompts in a JSONL file instead of the built-in set")
+    parser.add_argument('--output', metavar='RESULTS_JSONL', default='dalle-results.jsonl',
+                        help="where --batch appends one JSON result per image")
+    parser.add_argument('--backlog', action='store_true',
+                        help="retry the requests earlier runs deferred for budget or quota")
+    parser.add_argument('--budget', type=float, metavar='USD',
+                        help="spend at most this much in this run (dalle.monthly_budget_usd caps the month)")
+    parser.add_argument('--max-minutes', type=float, metavar='MINUTES',
+                        help="defer requests that won't fit in this many minutes at the deployment's RPM")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
 
-        # Generate all images
-        generator.generate_all_images()
+    try:
+        with instrumented(args, 'generate'):
+            generator = DalleImageGenerator(resume=args.resume, budget=args.budget, max_minutes=args.max_minutes)
+
+            if args.resume:
+                generator.resume_jobs()
+            elif args.backlog:
+                generator.generate_backlog()
+            elif args.batch:
+                generator.generate_batch(Path(args.batch), Path(args.output))
+            else:
+                # Generate all images
+                generator.generate_all_images()
 
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP Client
+Pooled keep-alive sessions with timeouts and jittered retry/backoff for every network script.
+"""
+
+import random
+import threading
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import REGISTRY
+
+# (connect, read) timeouts in seconds. DALL-E generations can take a while to respond.
+DEFAULT_TIMEOUT: Tuple[float, float] = (5.0, 120.0)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """urllib3 Retry with equal-jitter exponential backoff (Retry-After still wins)."""
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return 0
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        # A 429 is refused before any work is done, so even a non-idempotent POST is safe
+        # to resend; a 5xx or read timeout on a POST may already have been acted on (and billed)
+        if status_code == 429 and self.status_forcelist and 429 in self.status_forcelist:
+            return bool(self.total)
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        reason = str(response.status) if response is not None else type(error).__name__
+        REGISTRY.inc('http_retries', host=getattr(_pool, 'host', None) or 'unknown', reason=reason)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to requests that don't set one."""
+
+    def __init__(self, *args, timeout: Tuple[float, float] = DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def record_response(response: requests.Response, *args, **kwargs):
+    """Session hook: per-host latency (time to response headers) and status counts."""
+    host = urlsplit(response.url).hostname or 'unknown'
+    REGISTRY.histogram('http_request_seconds', host=host).observe(response.elapsed.total_seconds())
+    REGISTRY.inc('http_requests', host=host, status=response.status_code)
+
+
+def create_session(retries: int = 5,
+                   backoff_factor: float = 1.0,
+                   pool_maxsize: int = 16,
+                   timeout: Tuple[float, float] = DEFAULT_TIMEOUT) -> requests.Session:
+    """Create a session that pools connections per host and retries 429/5xx responses.
+
+    Idempotent requests retry on 429, 5xx, connect and read errors; POSTs only on 429
+    and connect errors (where nothing reached the server).
+    """
+    retry = JitteredRetry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        max_retries=retry,
+        pool_connections=pool_maxsize,
+        pool_maxsize=pool_maxsize,
+        timeout=timeout,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(record_response)
+    return session
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide shared session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Trading Image Server
+Small asyncio HTTP service that resolves asset aliases (BTC, XAU, cable, ...) and serves
+an existing image per post key, with strong ETags, Range requests and an in-memory LRU.
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from email.utils import formatdate
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from config import load_config
+from manifest import Manifest
+from optimize_images import content_type
+
+DEFAULT_PORT = 8080
+DEFAULT_CACHE_MB = 64
+
+# Same key -> same image, but the library can change, so clients revalidate after this
+IMAGE_MAX_AGE = 300
+
+REASONS = {
+    200: 'OK',
+    206: 'Partial Content',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    416: 'Range Not Satisfiable',
+}
+
+# Leading bytes of the formats a slot can hold; DALL-E images arrive as PNG
+MAGIC_TYPES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'RIFF', 'image/webp'),
+    (b'GIF8', 'image/gif'),
+]
+
+_ALIAS_RE = re.compile(r'[^a-z0-9]')
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def normalize_alias(name: str) -> str:
+    """Canonical form of an asset name: 'BTC/USD', 'btc_usd' and 'btc-usd' all become 'btcusd'."""
+    return _ALIAS_RE.sub('', name.lower())
+
+
+def build_alias_index(assets: List[Dict]) -> Dict[str, str]:
+    """Map every normalized name, folder and alias of the configured assets to its folder."""
+    index = {}
+    for asset in assets:
+        for name in [asset['name'], asset['folder'], *asset.get('aliases', [])]:
+            index[normalize_alias(name)] = asset['folder']
+    return index
+
+
+def choose_slot(slots: List[str], key: str) -> str:
+    """Pick a slot for a key by rendezvous hashing.
+
+    The same key always gets the same image, and adding an image to a folder only
+    moves the keys that now land on the new image.
+    """
+    return max(slots, key=lambda slot: hashlib.sha256(f"{key}\0{slot}".encode('utf-8')).digest())
+
+
+def sniff_content_type(head: bytes, path: Path) -> str:
+    """Content-Type from a file's first bytes, falling back to its extension."""
+    if head[8:12] in (b'avif', b'avis') and head[4:8] == b'ftyp':
+        return 'image/avif'
+    for magic, mime in MAGIC_TYPES:
+        if head.startswith(magic) and (mime != 'image/webp' or head[8:12] == b'WEBP'):
+            return mime
+    return content_type(path)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=' range into an inclusive (start, end).
+
+    Returns None when the whole file should be sent (no header, multiple or malformed
+    ranges); raises ValueError when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.group(0) == 'bytes=-':
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start > end:
+            raise ValueError(header)
+    else:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError(header)
+        start, end = max(size - suffix, 0), size - 1
+    return start, end
+
+
+class ByteLRU:
+    def __init__(self, max_bytes: int):
+        """Least-recently-used cache of file contents, bounded by total size."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: 'OrderedDict[str, bytes]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._items.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        if key in self._items or len(data) > self.max_bytes:
+            return
+        self._items[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class ImageServer:
+    def __init__(self, config_path: Optional[str] = None, base_dir: Optional[Path] = None):
+        """Load asset definitions and the manifest, and precompile the alias index."""
+        self.config = load_config(config_path)
+
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.manifest = Manifest(self.base_dir)
+        self.folders = [asset['folder'] for asset in self.config['assets']]
+        self.aliases = build_alias_index(self.config['assets'])
+
+        serve_config = self.config.get('serve', {})
+        self.host = serve_config.get('host', '0.0.0.0')
+        self.port = serve_config.get('port', DEFAULT_PORT)
+        self.refresh_seconds = serve_config.get('refresh_seconds', 30)
+        self.cache = ByteLRU(serve_config.get('cache_mb', DEFAULT_CACHE_MB) * 1024 * 1024)
+        # Larger files skip the cache and go straight from disk with sendfile
+        self.max_cached_object = serve_config.get('max_cached_object_kb', 2048) * 1024
+
+        # folder -> [(slot, sha256)] of images that exist on disk
+        self.slots: Dict[str, List[Tuple[str, str]]] = {}
+        self.refresh()
+
+    def refresh(self):
+        """Resync the manifest (only changed folders are rescanned) and rebuild the slot lists."""
+        self.manifest.sync(self.folders)
+        self.slots = {
+            folder: [(slot, entry['sha256']) for slot, entry in self.manifest.entries(folder)]
+            for folder in self.folders
+        }
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"⚠️  Library refresh failed: {e}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve HTTP/1.1 requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._send(writer, 400, {}, b'', close=True)
+                    break
+
+                close = version != 'HTTP/1.1' or headers.get('connection', '').lower() == 'close'
+                await self.respond(method, target, headers, writer, close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method: str, target: str, headers: Dict[str, str],
+                      writer: asyncio.StreamWriter, close: bool):
+        """Route one request."""
+        url = urlsplit(target)
+        if method not in ('GET', 'HEAD'):
+            await self._send_json(writer, 405, {'error': 'method not allowed'}, close, {'Allow': 'GET, HEAD'})
+        elif url.path == '/image':
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            await self.serve_image(method, params, headers, writer, close)
+        elif url.path == '/healthz':
+            images = sum(len(slots) for slots in self.slots.values())
+            await self._send_json(writer, 200, {
+                'status': 'ok',
+                'images': images,
+                'cache': {'bytes': self.cache.size, 'hits': self.cache.hits, 'misses': self.cache.misses},
+            }, close)
+        else:
+            await self._send_json(writer, 404, {'error': 'not found'}, close)
+
+    async def serve_image(self, method: str, params: Dict[str, str], headers: Dict[str, str],
+                          writer: asyncio.StreamWriter, close: bool):
+        """GET /image?asset=<alias>&key=<post-id>"""
+        folder = self.aliases.get(normalize_alias(params.get('asset', '')))
+        if not folder:
+            await self._send_json(writer, 404, {'error': f"unknown asset {params.get('asset')!r}"}, close)
+            return
+
+        slots = dict(self.slots.get(folder, []))
+        if not slots:
+            await self._send_json(writer, 404, {'error': f"no images for {folder}"}, close)
+            return
+
+        slot = choose_slot(sorted(slots), params.get('key', ''))
+        sha = slots[slot]
+        etag = f'"{sha}"'
+        response_headers = {
+            'ETag': etag,
+            'Cache-Control': f'public, max-age={IMAGE_MAX_AGE}',
+            'Accept-Ranges': 'bytes',
+            'Content-Location': f'/{slot}',
+        }
+
+        if_none_match = headers.get('if-none-match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in
+                              [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]):
+            await self._send(writer, 304, response_headers, b'', close)
+            return
+
+        data = self.cache.get(sha)
+        file = None
+        try:
+            if data is None:
+                # Opening, stat and the sniffing read are disk I/O too; keep them off the loop
+                file, size, head = await asyncio.to_thread(self._open, self.base_dir / slot)
+            else:
+                size, head = len(data), data[:16]
+        except FileNotFoundError:
+            # Deleted since the last refresh
+            await asyncio.to_thread(self.refresh)
+            await self._send_json(writer, 404, {'error': f"{slot} is missing"}, close)
+            return
+
+        try:
+            if file is not None and size <= self.max_cached_object:
+                data = await asyncio.to_thread(file.read)
+                self.cache.put(sha, data)
+                file.close()
+                file = None
+            response_headers['Content-Type'] = sniff_content_type(head, Path(slot))
+
+            status = 200
+            start, end = 0, size - 1
+            if headers.get('if-range', etag) == etag:
+                try:
+                    byte_range = parse_range(headers.get('range'), size)
+                except ValueError:
+                    response_headers['Content-Range'] = f'bytes */{size}'
+                    await self._send(writer, 416, response_headers, b'', close)
+                    return
+                if byte_range:
+                    status = 206
+                    start, end = byte_range
+                    response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+            length = end - start + 1
+            if method == 'HEAD':
+                await self._send(writer, status, response_headers, b'', close, content_length=length)
+            elif file is None:
+                await self._send(writer, status, response_headers, data[start:end + 1], close)
+            else:
+                await self._send(writer, status, response_headers, b'', close, content_length=length)
+                await asyncio.get_running_loop().sendfile(writer.transport, file, start, length)
+        finally:
+            if file is not None:
+                file.close()
+
+    @staticmethod
+    def _open(path: Path) -> Tuple[BinaryIO, int, bytes]:
+        """Open an image for reading; returns (file, size, first bytes)."""
+        file = open(path, 'rb')
+        try:
+            return file, os.fstat(file.fileno()).st_size, os.pread(file.fileno(), 16, 0)
+        except BaseException:
+            file.close()
+            raise
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, headers: Dict[str, str],
+                    body: bytes, close: bool, content_length: Optional[int] = None):
+        """Write a response head (and body, unless the caller streams it)."""
+        head = [f"HTTP/1.1 {status} {REASONS[status]}",
+                f"Date: {formatdate(usegmt=True)}",
+                f"Content-Length: {len(body) if content_length is None else content_length}"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        if close:
+            head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict, close: bool,
+                         headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode('utf-8')
+        await self._send(writer, status, {'Content-Type': 'application/json', **(headers or {})}, body, close)
+
+    async def serve_forever(self):
+        """Listen on the configured host/port until cancelled."""
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        refresher = asyncio.create_task(self._refresh_loop())
+        images = sum(len(slots) for slots in self.slots.values())
+        print(f"🖼️  Serving {images} images on http://{self.host}:{self.port}/image?asset=<alias>&key=<id>")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Serve trading images by asset alias")
+    parser.add_argument('--host', help="address to bind (default: serve.host or 0.0.0.0)")
+    parser.add_argument('--port', type=int, help=f"port to listen on (default: serve.port or {DEFAULT_PORT})")
+    args = parser.parse_args(argv)
+
+    try:
+        started = time.perf_counter()
+        server = ImageServer()
+        server.host = args.host or server.host
+        server.port = args.port or server.port
+        print(f"📒 Library loaded in {time.perf_counter() - started:.2f}s")
+        asyncio.run(server.serve_forever())
+
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
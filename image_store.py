@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Image Store
+Keeps each unique image once (keyed by SHA-256), tracks which asset slots reference it,
+and indexes perceptual hashes (dHash) to flag near-duplicates.
+"""
+
+import io
+import os
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from config import load_config
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+STORE_DIR = ".image-store"
+
+# Max Hamming distance between 64-bit dHashes to call two images near-duplicates
+NEAR_DUPLICATE_DISTANCE = 6
+
+
+def sha256_file(path: Path) -> str:
+    """Return the hex SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(source: Union[Path, bytes, "Image.Image"], hash_size: int = 8) -> int:
+    """Compute a 64-bit difference hash from a path, encoded bytes or a PIL image."""
+    from PIL import Image
+
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        # Let the JPEG decoder downscale while decoding; we only need a thumbnail
+        image.draft('L', (hash_size * 8, hash_size * 8))
+
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = gray.tobytes()
+
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+class ContentStore:
+    def __init__(self, base_dir: Path):
+        """Open (or create) the store under base_dir/.image-store."""
+        self.base_dir = Path(base_dir)
+        self.store_dir = self.base_dir / STORE_DIR
+        self.objects_dir = self.store_dir / "objects"
+        self.index_path = self.store_dir / "index.json"
+        self._lock = threading.RLock()
+
+        # slots: "folder/file.jpg" -> sha256
+        # objects: sha256 -> {"dhash": hex, "size": bytes, "photo_id": unsplash id or None}
+        self.slots: Dict[str, str] = {}
+        self.objects: Dict[str, Dict] = {}
+
+        if self.index_path.exists():
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            self.slots = index.get('slots', {})
+            self.objects = index.get('objects', {})
+
+    def save(self):
+        """Write the index atomically."""
+        with self._lock:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump({'slots': self.slots, 'objects': self.objects}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+
+    def object_path(self, sha: str) -> Path:
+        """Path of the stored object for a SHA-256."""
+        return self.objects_dir / sha[:2] / f"{sha}.jpg"
+
+    def add_file(self, path: Path, photo_id: Optional[str] = None, sha: Optional[str] = None,
+                 hash_value: Optional[int] = None) -> str:
+        """Store a file's content (once) and return its SHA-256.
+
+        sha and hash_value may be passed when the caller already computed them
+        (e.g. while downloading), so the file isn't read again.
+        """
+        sha = sha or sha256_file(path)
+        with self._lock:
+            object_path = self.object_path(sha)
+            if not object_path.exists():
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                self._link_or_copy(path, object_path)
+
+            entry = self.objects.setdefault(sha, {'size': path.stat().st_size})
+            if 'dhash' not in entry:
+                entry['dhash'] = f"{dhash(path) if hash_value is None else hash_value:016x}"
+            if photo_id:
+                entry['photo_id'] = photo_id
+        return sha
+
+    def add_slot(self, slot: str, photo_id: Optional[str] = None, sha: Optional[str] = None,
+                 hash_value: Optional[int] = None) -> str:
+        """Register an existing slot file (relative to base_dir) as a reference."""
+        sha = self.add_file(self.base_dir / slot, photo_id=photo_id, sha=sha, hash_value=hash_value)
+        with self._lock:
+            self.slots[slot] = sha
+        return sha
+
+    def link_slot(self, slot: str, sha: str):
+        """Materialize a slot as a hard link to a stored object (copy if links are unsupported)."""
+        slot_path = self.base_dir / slot
+        slot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = slot_path.with_suffix(slot_path.suffix + '.tmp')
+        if tmp_path.exists():
+            tmp_path.unlink()
+        self._link_or_copy(self.object_path(sha), tmp_path)
+        os.replace(tmp_path, slot_path)
+        with self._lock:
+            self.slots[slot] = sha
+
+    @staticmethod
+    def _link_or_copy(source: Path, dest: Path):
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copy2(source, dest)
+
+    def slot_for_photo(self, photo_id: str) -> Optional[str]:
+        """Return a slot that already holds this Unsplash photo, if any."""
+        with self._lock:
+            shas = {sha for sha, entry in self.objects.items() if entry.get('photo_id') == photo_id}
+            for slot, sha in self.slots.items():
+                if sha in shas:
+                    return slot
+        return None
+
+    def near_duplicates(self, hash_value: int, max_distance: int = NEAR_DUPLICATE_DISTANCE) -> List[Tuple[str, int]]:
+        """Return (slot, distance) pairs whose image is perceptually close to hash_value."""
+        with self._lock:
+            close = {
+                sha: hamming(hash_value, int(entry['dhash'], 16))
+                for sha, entry in self.objects.items()
+                if 'dhash' in entry
+            }
+            matches = [(slot, close[sha]) for slot, sha in self.slots.items()
+                       if close.get(sha, max_distance + 1) <= max_distance]
+        return sorted(matches, key=lambda match: match[1])
+
+    def slot_hashes(self, folder: Optional[str] = None) -> Dict[str, int]:
+        """Return slot -> dHash for every indexed slot, or only the slots in one folder."""
+        with self._lock:
+            return {
+                slot: int(self.objects[sha]['dhash'], 16)
+                for slot, sha in self.slots.items()
+                if (folder is None or slot.startswith(f"{folder}/")) and 'dhash' in self.objects.get(sha, {})
+            }
+
+    def references(self) -> Dict[str, List[str]]:
+        """Return sha256 -> slots referencing it."""
+        with self._lock:
+            refs: Dict[str, List[str]] = {}
+            for slot, sha in sorted(self.slots.items()):
+                refs.setdefault(sha, []).append(slot)
+        return refs
+
+
+def index_library(config_path: Optional[str] = None):
+    """Index every slot, hard-link byte-identical copies and report near-duplicates."""
+    config = load_config(config_path)
+
+    base_dir = Path(__file__).parent
+    store = ContentStore(base_dir)
+
+    print("🗃️  Indexing image library...")
+    for asset in config['assets']:
+        folder = asset['folder']
+        asset_folder = base_dir / folder
+        if not asset_folder.is_dir():
+            continue
+        for image_path in sorted(asset_folder.glob("*.jpg")):
+            store.add_slot(f"{folder}/{image_path.name}")
+
+    # Collapse byte-identical slots onto one stored object
+    shared = 0
+    for sha, slots in store.references().items():
+        if len(slots) > 1:
+            print(f"  ♻️  {len(slots)} slots share {sha[:12]}: {', '.join(slots)}")
+            for slot in slots:
+                store.link_slot(slot, sha)
+            shared += len(slots) - 1
+
+    near = 0
+    refs = store.references()
+    seen = set()
+    for sha, slots in refs.items():
+        for slot, distance in store.near_duplicates(int(store.objects[sha]['dhash'], 16)):
+            pair = tuple(sorted((slots[0], slot)))
+            if store.slots[slot] != sha and pair not in seen:
+                seen.add(pair)
+                near += 1
+                print(f"  ⚠️  Near-duplicate: {pair[0]} ~ {pair[1]} (distance {distance})")
+
+    store.save()
+
+    print(f"\n{'='*60}")
+    print(f"✨ Indexed {len(store.slots)} slots → {len(refs)} unique images")
+    print(f"♻️  Byte-identical copies linked: {shared}")
+    print(f"⚠️  Near-duplicate pairs: {near}")
+    print(f"{'='*60}")
+
+
+def main():
+    """Main entry point."""
+    try:
+        index_library()
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
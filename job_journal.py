@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Write-Ahead Job Journal
+Append-only JSON-lines log of every unit of work (search, download, generate, upload)
+so an interrupted run can resume exactly where it stopped.
+"""
+
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+JOURNAL_DIR = ".journal"
+
+
+class JobJournal:
+    def __init__(self, base_dir: Path, name: str, resume: bool = False):
+        """Open .journal/<name>.jsonl; replay it when resuming, otherwise start a fresh one."""
+        self.path = Path(base_dir) / JOURNAL_DIR / f"{name}.jsonl"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+        # (job_id, stage) -> latest {"state": ..., **data}
+        self.stages: Dict[tuple, Dict] = {}
+
+        if resume and self.path.exists():
+            intact = 0
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Torn final line from a crash; everything before it is intact
+                    if not line.endswith(b"\n"):
+                        break
+                    self.stages[(entry.pop('job'), entry.pop('stage'))] = entry
+                    intact += len(line)
+            self._file = open(self.path, 'a')
+            # Drop the torn tail, or new records would be glued onto it and lost on the next replay
+            self._file.truncate(intact)
+        else:
+            self._file = open(self.path, 'w')
+
+    def record(self, job_id: str, stage: str, state: str, **data):
+        """Append a state change and flush it to disk before the work continues."""
+        entry = {'state': state, 'ts': round(time.time(), 3), **data}
+        line = json.dumps({'job': job_id, 'stage': stage, **entry}, sort_keys=True)
+
+        with self._lock:
+            self.stages[(job_id, stage)] = entry
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def queue(self, job_id: str, **spec):
+        """Record a job and the parameters needed to replay it."""
+        self.record(job_id, 'spec', 'queued', **spec)
+
+    def finish(self, job_id: str, success: bool):
+        """Mark a whole job as done (or failed, so --resume retries it)."""
+        self.record(job_id, 'job', 'done' if success else 'failed')
+
+    def result(self, job_id: str, stage: str) -> Optional[Dict]:
+        """Return the data of a stage whose latest state is 'done', else None."""
+        with self._lock:
+            entry = self.stages.get((job_id, stage))
+        if entry and entry['state'] == 'done':
+            return entry
+        return None
+
+    def unfinished(self) -> Dict[str, Dict]:
+        """Return job_id -> spec for every queued job that never finished successfully."""
+        with self._lock:
+            return {
+                job_id: spec
+                for (job_id, stage), spec in self.stages.items()
+                if stage == 'spec'
+                and self.stages.get((job_id, 'job'), {}).get('state') != 'done'
+            }
+
+    def close(self):
+        """Close the journal file."""
+        with self._lock:
+            self._file.close()
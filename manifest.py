@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Image Library Manifest
+A persistent JSON index of every image (source, query, hash, dimensions, variants,
+upload state) so scripts update only what changed instead of probing the whole library.
+"""
+
+import os
+import re
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import load_config
+from image_store import sha256_file
+
+MANIFEST_FILE = "manifest.json"
+
+_NUMBER_RE = re.compile(r'-(\d+)\.jpg$')
+
+
+def slot_number(slot: str) -> int:
+    """Return the image number of a slot such as 'gold/gold-7.jpg' (0 if unnumbered)."""
+    match = _NUMBER_RE.search(slot)
+    return int(match.group(1)) if match else 0
+
+
+class Manifest:
+    def __init__(self, base_dir: Path):
+        """Load the manifest from base_dir/manifest.json (empty if it doesn't exist yet)."""
+        self.base_dir = Path(base_dir)
+        self.path = self.base_dir / MANIFEST_FILE
+        self._lock = threading.RLock()
+
+        # images: "folder/file.jpg" -> record; folders: folder -> directory mtime_ns
+        self.images: Dict[str, Dict] = {}
+        self.folders: Dict[str, int] = {}
+
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.images = data.get('images', {})
+            self.folders = data.get('folders', {})
+
+    def save(self):
+        """Write the manifest atomically."""
+        with self._lock:
+            tmp_path = self.path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': 1, 'folders': self.folders, 'images': self.images},
+                          f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def get(self, slot: str) -> Optional[Dict]:
+        """Return the record for a slot, or None."""
+        with self._lock:
+            return self.images.get(slot)
+
+    def entries(self, folder: str) -> List[Tuple[str, Dict]]:
+        """Return (slot, record) pairs for a folder, ordered by image number."""
+        prefix = f"{folder}/"
+        with self._lock:
+            items = [(slot, entry) for slot, entry in self.images.items() if slot.startswith(prefix)]
+        return sorted(items, key=lambda item: (slot_number(item[0]), item[0]))
+
+    def record(self, slot: str, sha256: Optional[str] = None, dimensions: Optional[Tuple[int, int]] = None,
+               **fields) -> Dict:
+        """Add or refresh a slot from disk, merging extra fields (source, query, photo_id, ...).
+
+        Pass sha256 and dimensions when they are already known (e.g. from the download)
+        to skip reading the file again.
+        """
+        path = self.base_dir / slot
+        stat = path.stat()
+
+        with self._lock:
+            entry = self.images.get(slot, {})
+            changed = entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns
+
+        if changed:
+            sha = sha256 or sha256_file(path)
+            if dimensions:
+                width, height = dimensions
+            else:
+                from PIL import Image
+
+                with Image.open(path) as image:
+                    width, height = image.size
+
+            with self._lock:
+                if entry.get('sha256') != sha:
+                    # New content: previous uploads and variants no longer apply
+                    entry['uploads'] = {}
+                    entry['variants'] = []
+                entry.update({
+                    'sha256': sha,
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'width': width,
+                    'height': height,
+                })
+
+        with self._lock:
+            entry.setdefault('source', 'unknown')
+            entry.setdefault('uploads', {})
+            entry.setdefault('variants', [])
+            entry.update({key: value for key, value in fields.items() if value is not None})
+            self.images[slot] = entry
+            return entry
+
+    def remove(self, slot: str):
+        """Forget a slot."""
+        with self._lock:
+            self.images.pop(slot, None)
+
+    def sync(self, folders: List[str], full: bool = False) -> Tuple[int, int]:
+        """Reconcile with disk, rescanning only folders whose mtime changed. Returns (updated, removed).
+
+        A file overwritten in place doesn't touch its folder's mtime; full=True stats
+        every file (still only rehashing those whose size or mtime changed).
+        """
+        updated = removed = 0
+
+        for folder in folders:
+            folder_path = self.base_dir / folder
+            if not folder_path.is_dir():
+                for slot, _ in self.entries(folder):
+                    self.remove(slot)
+                    removed += 1
+                continue
+
+            mtime_ns = folder_path.stat().st_mtime_ns
+            if not full and self.folders.get(folder) == mtime_ns:
+                continue
+
+            on_disk = set()
+            for image_path in folder_path.glob("*.jpg"):
+                slot = f"{folder}/{image_path.name}"
+                on_disk.add(slot)
+                before = self.get(slot)
+                before = dict(before) if before else None
+                if before != self.record(slot):
+                    updated += 1
+
+            for slot, _ in self.entries(folder):
+                if slot not in on_disk:
+                    self.remove(slot)
+                    removed += 1
+
+            with self._lock:
+                self.folders[folder] = mtime_ns
+
+        return updated, removed
+
+    def set_variants(self, slot: str, relpaths: List[str]):
+        """Record a slot's variant files; new variants make the slot due for re-publishing."""
+        with self._lock:
+            entry = self.images[slot]
+            if sorted(relpaths) != sorted(entry['variants']):
+                entry['variants'] = sorted(relpaths)
+                entry['uploads'] = {}
+
+    def mark_uploaded(self, slot: str, backend: str):
+        """Record that the slot's current content is published on a backend."""
+        with self._lock:
+            entry = self.images[slot]
+            entry['uploads'][backend] = entry['sha256']
+
+    def is_uploaded(self, slot: str, backend: str) -> bool:
+        """Whether the slot's current content is already published on a backend."""
+        with self._lock:
+            entry = self.images.get(slot)
+            return bool(entry) and entry['uploads'].get(backend) == entry['sha256']
+
+
+def main():
+    """Rebuild the manifest from disk and print a summary."""
+    try:
+        config = load_config()
+
+        manifest = Manifest(Path(__file__).parent)
+        updated, removed = manifest.sync([asset['folder'] for asset in config['assets']])
+        manifest.save()
+
+        print(f"📒 Manifest: {len(manifest.images)} images ({updated} updated, {removed} removed)")
+        for asset in config['assets']:
+            entries = manifest.entries(asset['folder'])
+            print(f"  📁 {asset['folder']}: {len(entries)}/{asset['images_per_asset']} images")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
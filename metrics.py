@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Pipeline Metrics
+Thread-safe latency histograms, counters and gauges shared by every script, exported as
+a Prometheus textfile and structured JSON-lines logs, with optional per-stage cProfile.
+"""
+
+import os
+import json
+import math
+import time
+import cProfile
+import argparse
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket is +Inf.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+class LatencyHistogram:
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Create an empty histogram with the given bucket upper bounds."""
+        self.name = name
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.samples: List[float] = []
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """Record one duration."""
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+            self.samples.append(seconds)
+            self.total += seconds
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Context manager that observes the duration of its body."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    @property
+    def count(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, p: float) -> float:
+        """Return the p-th percentile (0-100) of the observed durations."""
+        with self._lock:
+            if not self.samples:
+                return 0.0
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        """Return count, sum and common percentiles."""
+        return {
+            'count': self.count,
+            'sum': round(self.total, 4),
+            'p50': round(self.percentile(50), 4),
+            'p90': round(self.percentile(90), 4),
+            'p99': round(self.percentile(99), 4),
+            'max': round(self.percentile(100), 4),
+        }
+
+    def render(self, width: int = 30) -> str:
+        """Render the histogram as text bars."""
+        lines = [f"⏱️  {self.name}: n={self.count} p50={self.percentile(50):.2f}s "
+                 f"p90={self.percentile(90):.2f}s max={self.percentile(100):.2f}s"]
+        peak = max(self.counts) or 1
+        for bound, count in zip(self.buckets, self.counts):
+            if not count:
+                continue
+            label = "+Inf" if bound == math.inf else f"≤{bound:g}s"
+            bar = "█" * max(1, round(count / peak * width))
+            lines.append(f"   {label:>7} {bar} {count}")
+        return "\n".join(lines)
+
+
+def print_histograms(histograms: Sequence[LatencyHistogram]):
+    """Print every non-empty histogram."""
+    for histogram in histograms:
+        if histogram.count:
+            print(histogram.render())
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = list(labels) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _ThreadProfiler:
+    """cProfile for a stage, covering the calling thread and any thread started during it."""
+
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self.threads: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, *args):
+        # Runs as the first profile event in a new thread; swap in a real profiler
+        profile = cProfile.Profile()
+        with self._lock:
+            self.threads.append(profile)
+        profile.enable()
+
+    def start(self):
+        threading.setprofile(self._start_thread)
+        self.main.enable()
+
+    def stop(self, path: Path):
+        import pstats
+
+        threading.setprofile(None)
+        self.main.disable()
+        stats = pstats.Stats(self.main)
+        for profile in self.threads:
+            stats.add(profile)
+        stats.dump_stats(str(path))
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "trading_images"):
+        """Process-wide metrics; names are exported as <prefix>_<name>."""
+        self.prefix = prefix
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], LatencyHistogram] = {}
+        self.profile_dir: Optional[Path] = None
+        self._log_file = None
+        self._profiled_stages: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """Add to a counter (exported with a _total suffix)."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge."""
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        """Return the histogram for name+labels, creating it on first use."""
+        key = (name, _labels(labels))
+        with self._lock:
+            if key not in self.histograms:
+                display = labels.get('stage') or labels.get('host') or name
+                self.histograms[key] = LatencyHistogram(str(display))
+            return self.histograms[key]
+
+    def configure(self, log_path: Optional[str] = None, profile_dir: Optional[str] = None):
+        """Start JSON-lines logging and/or per-stage profiling."""
+        if log_path:
+            self._log_file = open(log_path, 'a')
+        if profile_dir:
+            self.profile_dir = Path(profile_dir)
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+
+    def log(self, event: str, **fields):
+        """Append one structured event to the JSON-lines log, if one is configured."""
+        if self._log_file is None:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, sort_keys=True, default=str)
+        with self._lock:
+            self._log_file.write(line + "\n")
+            self._log_file.flush()
+
+    @contextmanager
+    def stage(self, pipeline: str, stage: str, profile: bool = True) -> Iterator[None]:
+        """Time (and, with --profile, cProfile) one stage of a pipeline. Stages don't nest profiles."""
+        profiler = None
+        if profile and self.profile_dir:
+            profiler = _ThreadProfiler()
+            profiler.start()
+
+        self.log('stage_start', pipeline=pipeline, stage=stage)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            yield
+            status = 'ok'
+        finally:
+            seconds = time.perf_counter() - started
+            self.set('stage_last_duration_seconds', seconds, pipeline=pipeline, stage=stage)
+            self.set('stage_last_success', float(status == 'ok'), pipeline=pipeline, stage=stage)
+            self.set('stage_last_end_timestamp_seconds', time.time(), pipeline=pipeline, stage=stage)
+            self.log('stage_end', pipeline=pipeline, stage=stage, status=status, seconds=round(seconds, 3))
+
+            if profiler:
+                with self._lock:
+                    name = f"{pipeline}-{stage}"
+                    runs = self._profiled_stages[name] = self._profiled_stages.get(name, 0) + 1
+                path = self.profile_dir / (f"{name}.prof" if runs == 1 else f"{name}-{runs}.prof")
+                profiler.stop(path)
+                self.log('profile_written', pipeline=pipeline, stage=stage, path=str(path))
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        declared = set()
+
+        def declare(name: str, kind: str):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            declare(metric, 'counter')
+            lines.append(f"{metric}{_format_labels(labels)} {float(value)!r}")
+
+        for (name, labels), value in gauges:
+            metric = f"{self.prefix}_{name}"
+            declare(metric, 'gauge')
+            lines.append(f"{metric}{_format_labels(labels)} {float(value)!r}")
+
+        for (name, labels), histogram in histograms:
+            metric = f"{self.prefix}_{name}"
+            declare(metric, 'histogram')
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total = histogram.total
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                lines.append(f"{metric}_bucket{_format_labels(labels, {'le': le})} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {float(total)!r}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Write a .prom file atomically, as node-exporter's textfile collector requires."""
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+
+REGISTRY = MetricsRegistry()
+
+
+def add_instrumentation_args(parser: argparse.ArgumentParser):
+    """Add the --metrics-file / --log-json / --profile options shared by every script."""
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--metrics-file', metavar='PATH',
+                       help="write Prometheus metrics here (e.g. node-exporter's textfile directory, *.prom)")
+    group.add_argument('--log-json', metavar='PATH', help="append structured JSON-lines events to PATH")
+    group.add_argument('--profile', metavar='DIR', help="write a cProfile .prof file per stage into DIR")
+
+
+@contextmanager
+def instrumented(args: argparse.Namespace, pipeline: str) -> Iterator[None]:
+    """Configure instrumentation from parsed args for one script run and export on exit."""
+    REGISTRY.configure(log_path=args.log_json, profile_dir=args.profile)
+    try:
+        with REGISTRY.stage(pipeline, 'run', profile=False):
+            yield
+    finally:
+        if args.metrics_file:
+            REGISTRY.write_textfile(args.metrics_file)
+        REGISTRY.close()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Image Optimizer for Trading Assets
+Builds responsive, progressive JPEG/WebP (and optional AVIF) variants before publishing.
+"""
+
+import os
+import time
+import argparse
+import mimetypes
+from concurrent.futures import as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import load_config
+from manifest import Manifest
+from metrics import REGISTRY, add_instrumentation_args, instrumented, print_histograms
+
+VARIANTS_DIR = "optimized"
+
+FORMAT_EXTENSIONS = {
+    'jpeg': '.jpg',
+    'webp': '.webp',
+    'avif': '.avif',
+}
+
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+}
+
+
+def content_type(path: Path) -> str:
+    """Content-Type to publish a file with."""
+    return CONTENT_TYPES.get(path.suffix) or mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+
+DEFAULT_WIDTHS = [320, 640, 1280]
+DEFAULT_FORMATS = ['jpeg', 'webp']
+
+
+def variant_settings(config: Dict) -> Tuple[List[int], List[str]]:
+    """Return the configured (widths, formats) for variants."""
+    optimize_config = config.get('optimize', {})
+    return (optimize_config.get('widths', DEFAULT_WIDTHS),
+            optimize_config.get('formats', DEFAULT_FORMATS))
+
+
+def variant_relpath(folder: str, image_filename: str, width: int, fmt: str) -> str:
+    """Relative path (and blob name) of one variant, e.g. optimized/gold/gold-3-640.webp."""
+    stem = Path(image_filename).stem
+    return f"{VARIANTS_DIR}/{folder}/{stem}-{width}{FORMAT_EXTENSIONS[fmt]}"
+
+
+def variant_urls(base_dir: Path, base_url: str, folder: str, image_filename: str,
+                 widths: Sequence[int], formats: Sequence[str],
+                 name_for: Optional[Callable[[str], str]] = None) -> Dict[str, Dict[str, str]]:
+    """Return {format: {width: url}} for the variants of one image that exist on disk.
+
+    name_for maps a variant's relative path to its published name (e.g. fingerprinted).
+    """
+    urls: Dict[str, Dict[str, str]] = {}
+    for fmt in formats:
+        for width in widths:
+            relpath = variant_relpath(folder, image_filename, width, fmt)
+            if (base_dir / relpath).exists():
+                name = name_for(relpath) if name_for else relpath
+                urls.setdefault(fmt, {})[str(width)] = f"{base_url}/{name}"
+    return urls
+
+
+def _pil_image():
+    """Import Pillow on first use, so commands that only map URLs start without it."""
+    from PIL import Image
+    try:
+        import pillow_avif  # noqa: F401  (registers AVIF support on older Pillow)
+    except ImportError:
+        pass
+    return Image
+
+
+def avif_supported() -> bool:
+    """Check whether the installed Pillow can encode AVIF."""
+    Image = _pil_image()
+    Image.init()
+    return 'AVIF' in Image.SAVE
+
+
+def optimize_image(source: str, folder: str, base_dir: str, widths: Sequence[int],
+                   formats: Sequence[str], qualities: Dict[str, int]) -> List[str]:
+    """Write every missing or stale variant of one image. Runs in a worker process."""
+    Image = _pil_image()
+
+    source_path = Path(source)
+    source_mtime = source_path.stat().st_mtime
+    written = []
+
+    with Image.open(source_path) as original:
+        # Converting drops EXIF/XMP; variants are saved without metadata
+        image = original.convert('RGB')
+
+    for width in widths:
+        if width > image.width:
+            continue  # Never upscale
+
+        resized = None
+        for fmt in formats:
+            output_path = Path(base_dir) / variant_relpath(folder, source_path.name, width, fmt)
+            if output_path.exists() and output_path.stat().st_mtime >= source_mtime:
+                continue
+
+            if resized is None:
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.Resampling.LANCZOS)
+
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = output_path.with_suffix(output_path.suffix + '.tmp')
+
+            if fmt == 'jpeg':
+                resized.save(tmp_path, format='JPEG', quality=qualities['jpeg'],
+                             optimize=True, progressive=True)
+            elif fmt == 'webp':
+                resized.save(tmp_path, format='WEBP', quality=qualities['webp'], method=6)
+            elif fmt == 'avif':
+                resized.save(tmp_path, format='AVIF', quality=qualities['avif'])
+
+            os.replace(tmp_path, output_path)
+            written.append(output_path.name)
+
+    return written
+
+
+def _optimize_timed(*args) -> Tuple[List[str], float]:
+    """Run optimize_image and also return its duration inside the worker (queueing excluded)."""
+    started = time.perf_counter()
+    written = optimize_image(*args)
+    return written, time.perf_counter() - started
+
+
+class ImageOptimizer:
+    def __init__(self, config_path: Optional[str] = None, base_dir: Optional[Path] = None):
+        """Initialize the optimizer with configuration."""
+        self.config = load_config(config_path)
+
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.histogram = REGISTRY.histogram('stage_seconds', pipeline='optimize', stage='optimize')
+        self.manifest = Manifest(self.base_dir)
+
+        optimize_config = self.config.get('optimize', {})
+        self.widths, self.formats = variant_settings(self.config)
+        self.qualities = {
+            'jpeg': optimize_config.get('jpeg_quality', 82),
+            'webp': optimize_config.get('webp_quality', 80),
+            'avif': optimize_config.get('avif_quality', 60),
+        }
+        self.workers = optimize_config.get('workers') or os.cpu_count()
+
+        if 'avif' in self.formats and not avif_supported():
+            print("⚠️  AVIF requested but not supported by this Pillow build, skipping AVIF")
+            self.formats = [fmt for fmt in self.formats if fmt != 'avif']
+
+    def optimize_all_images(self):
+        """Build variants for every image across all CPU cores."""
+        print("🗜️  Starting image optimization...")
+        print(f"📐 Widths: {', '.join(str(w) for w in self.widths)}")
+        print(f"🖼️  Formats: {', '.join(self.formats)}")
+        print(f"⚙️  Workers: {self.workers}")
+
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
+
+        jobs = []
+        for asset in self.config['assets']:
+            folder = asset['folder']
+            for slot, _ in self.manifest.entries(folder):
+                jobs.append((self.base_dir / slot, folder))
+
+        total_written = 0
+        total_failed = 0
+
+        from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing
+
+        with REGISTRY.stage('optimize', 'variants'), ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(_optimize_timed, str(source), folder, str(self.base_dir),
+                                self.widths, self.formats, self.qualities): source
+                for source, folder in jobs
+            }
+
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    written, seconds = future.result()
+                except Exception as e:
+                    print(f"  ❌ {source.name}: {e}")
+                    REGISTRY.inc('items', pipeline='optimize', result='failed')
+                    REGISTRY.log('item', pipeline='optimize', slot=f"{source.parent.name}/{source.name}",
+                                 ok=False, error=str(e))
+                    total_failed += 1
+                    continue
+
+                self.histogram.observe(seconds)
+                REGISTRY.inc('items', pipeline='optimize', result='ok')
+                REGISTRY.inc('variants_written', len(written))
+                REGISTRY.log('item', pipeline='optimize', slot=f"{source.parent.name}/{source.name}",
+                             ok=True, variants=len(written), seconds=round(seconds, 3))
+                if written:
+                    print(f"  ✅ {source.name}: {len(written)} variants")
+                    total_written += len(written)
+                else:
+                    print(f"  ✓ {source.name}: up to date")
+
+                folder = source.parent.name
+                relpaths = [
+                    variant_relpath(folder, source.name, width, fmt)
+                    for width in self.widths for fmt in self.formats
+                ]
+                self.manifest.set_variants(
+                    f"{folder}/{source.name}",
+                    [relpath for relpath in relpaths if (self.base_dir / relpath).exists()]
+                )
+
+        self.manifest.save()
+
+        print(f"\n{'='*60}")
+        print(f"✨ Optimization Complete!")
+        print(f"🖼️  Variants written: {total_written}")
+        print(f"❌ Failed: {total_failed}")
+        print(f"{'='*60}")
+        print_histograms([self.histogram])
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Build responsive variants of the trading images")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        with instrumented(args, 'optimize'):
+            optimizer = ImageOptimizer()
+            optimizer.optimize_all_images()
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Multi-Backend Publisher
+Reads each changed file once and fans its bytes out to every configured backend (Azure
+Blob, git, a local directory, S3-compatible storage such as MinIO) concurrently, then
+writes each backend's URL mapping and catalog in the same pass.
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from catalog import (IMMUTABLE_CACHE_CONTROL, INDEX_CACHE_CONTROL, INDEX_FILE, build_url_mapping, catalog_files,
+                     fingerprinted_name, write_catalog)
+from config import load_config
+from manifest import Manifest
+from metrics import REGISTRY, add_instrumentation_args, instrumented
+from optimize_images import content_type
+
+BACKENDS = ('azure', 'github', 'local', 's3')
+
+# Files read but not yet on every backend; bounds memory on large publishes
+MAX_FILES_IN_FLIGHT = 64
+
+
+class Backend:
+    """A publishing target: stores bytes under a name and serves them from base_url."""
+
+    name = ""
+
+    def __init__(self, base_url: str, fingerprint: bool = False, workers: int = 8):
+        self.base_url = base_url.rstrip('/')
+        self.fingerprint = fingerprint
+        self.workers = workers
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if fingerprint else None
+
+    @property
+    def key(self) -> str:
+        """Name the manifest records uploads under."""
+        return f"{self.name}-fingerprinted" if self.fingerprint else self.name
+
+    def publish_name(self, relpath: str, sha256: str) -> str:
+        return fingerprinted_name(relpath, sha256) if self.fingerprint else relpath
+
+    def start(self):
+        """Prepare the target (create the container, bucket or directory)."""
+
+    def put(self, relpath: str, name: str, data: bytes, md5: bytes, cache_control: Optional[str]) -> bool:
+        raise NotImplementedError
+
+    def discard(self, relpaths: set):
+        """Forget files put for slots that failed elsewhere, so they are not made visible."""
+
+    def finish(self, slots: List[str]) -> bool:
+        """Make everything put so far visible (e.g. commit and push). Returns success."""
+        return True
+
+
+class AzureBackend(Backend):
+    name = "azure"
+
+    def __init__(self, uploader):
+        """Publish through an AzureBlobUploader (its container, fingerprinting and block settings)."""
+        super().__init__(uploader.base_url, uploader.fingerprint, uploader.upload_workers)
+        self.uploader = uploader
+
+    @property
+    def key(self) -> str:
+        return self.uploader.backend
+
+    def start(self):
+        self.uploader.create_container_if_not_exists()
+
+    def put(self, relpath: str, name: str, data: bytes, md5: bytes, cache_control: Optional[str]) -> bool:
+        return self.uploader.upload_image(self.uploader.base_dir / relpath, name, md5, cache_control, data=data)
+
+
+class GitBackend(Backend):
+    name = "github"
+
+    def __init__(self, uploader):
+        """Write blobs into the repository as files arrive; one commit and push at the end."""
+        super().__init__(uploader.base_url, workers=4)
+        self.uploader = uploader
+        self.blobs: Dict[str, str] = {}
+        self.sources: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def put(self, relpath: str, name: str, data: bytes, md5: bytes, cache_control: Optional[str]) -> bool:
+        blob = self.uploader.write_blob(data)
+        with self._lock:
+            self.blobs[name] = blob
+            self.sources[name] = relpath
+        return True
+
+    def discard(self, relpaths: set):
+        with self._lock:
+            for name in [name for name, relpath in self.sources.items() if relpath in relpaths]:
+                del self.blobs[name]
+                del self.sources[name]
+
+    def finish(self, slots: List[str]) -> bool:
+        # The repository's image-urls.json is this backend's mapping, whatever the primary backend is
+        mapping = self.uploader.base_dir / f"image-urls.{self.name}.json"
+        blobs = dict(self.blobs)
+        if mapping.exists():
+            blobs['image-urls.json'] = self.uploader.write_blob(mapping.read_bytes())
+        with REGISTRY.stage('publish', 'git'):
+            return self.uploader.commit_and_push(blobs=blobs, slots=slots)
+
+
+class LocalBackend(Backend):
+    name = "local"
+
+    def __init__(self, root: Path, base_url: str, fingerprint: bool = False, workers: int = 4):
+        """Copy the library into a directory served by any static web server."""
+        super().__init__(base_url, fingerprint, workers)
+        self.root = Path(root)
+
+    def start(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def put(self, relpath: str, name: str, data: bytes, md5: bytes, cache_control: Optional[str]) -> bool:
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return True
+
+
+class S3Backend(Backend):
+    name = "s3"
+
+    def __init__(self, bucket: str, base_url: str, endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, fingerprint: bool = False, workers: int = 8, client=None):
+        """Publish to an S3-compatible bucket (AWS S3, MinIO, R2, ...). Credentials come from the
+        usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY environment or profile."""
+        super().__init__(base_url, fingerprint, workers)
+        self.bucket = bucket
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+
+    def start(self):
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except Exception:
+            self.client.create_bucket(Bucket=self.bucket)
+
+    def put(self, relpath: str, name: str, data: bytes, md5: bytes, cache_control: Optional[str]) -> bool:
+        extra = {'CacheControl': cache_control} if cache_control else {}
+        self.client.put_object(Bucket=self.bucket, Key=name, Body=data, ContentType=content_type(Path(name)),
+                               ContentMD5=base64.b64encode(md5).decode('ascii'), **extra)
+        return True
+
+
+class BackendStats:
+    def __init__(self):
+        """Files, bytes and time one backend spent on this publish."""
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished - self.started) if self.started is not None else 0.0
+
+    def summary(self) -> Dict:
+        seconds = self.seconds
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'failed': self.failed,
+            'seconds': round(seconds, 3),
+            'files_per_s': round(self.files / seconds, 2) if seconds else 0.0,
+            'mb_per_s': round(self.bytes / seconds / 1e6, 2) if seconds else 0.0,
+        }
+
+
+def create_backend(name: str, config: Dict, base_dir: Path, fingerprint: Optional[bool] = None) -> Backend:
+    """Build a backend from config.json's publish section (and the azure section for Azure)."""
+    settings = config.get('publish', {}).get(name, {})
+    if name == 'azure':
+        from upload_to_azure import AzureBlobUploader
+        return AzureBackend(AzureBlobUploader(fingerprint=fingerprint, base_dir=base_dir))
+    if name == 'github':
+        from upload_to_github import GitHubUploader
+        return GitBackend(GitHubUploader(base_dir=base_dir))
+    if fingerprint is None:
+        fingerprint = settings.get('fingerprint', False)
+    if name == 'local':
+        root = Path(settings.get('root', 'public'))
+        root = root if root.is_absolute() else base_dir / root
+        return LocalBackend(root, settings.get('base_url', root.resolve().as_uri()), fingerprint,
+                            settings.get('workers', 4))
+    if name == 's3':
+        if not settings.get('bucket') or not settings.get('base_url'):
+            raise ValueError("publish.s3 needs a bucket and a base_url in config.json")
+        return S3Backend(settings['bucket'], settings['base_url'], settings.get('endpoint_url'),
+                         settings.get('region'), fingerprint, settings.get('workers', 8))
+    raise ValueError(f"unknown publish backend {name!r} (choose from {', '.join(BACKENDS)})")
+
+
+class Publisher:
+    def __init__(self, backends: List[Backend], config_path: Optional[str] = None, base_dir: Optional[Path] = None):
+        """Publish the library to several backends at once."""
+        self.config = load_config(config_path)
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.backends = backends
+        self.manifest = Manifest(self.base_dir)
+        self.stats = {backend.name: BackendStats() for backend in backends}
+        self.histograms = {
+            backend.name: REGISTRY.histogram('stage_seconds', pipeline='publish', stage=backend.name)
+            for backend in backends
+        }
+        self._stats_lock = threading.Lock()
+
+        # relpath -> sha256 of every file read this run, so fingerprinted names never re-read it
+        self.hashes: Dict[str, str] = {}
+
+    def pending(self, force: bool = False) -> Tuple[List[Tuple[str, Optional[str], str]], Dict[str, List[str]]]:
+        """Files any backend still needs, as (relpath, owning slot, slot sha256), and the slots each backend needs."""
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
+
+        slots_for = {backend.name: [] for backend in self.backends}
+        files = {}
+        for asset in self.config['assets']:
+            for slot, entry in self.manifest.entries(asset['folder']):
+                needed_by = [backend for backend in self.backends
+                             if force or not self.manifest.is_uploaded(slot, backend.key)]
+                if not needed_by:
+                    continue
+                for backend in needed_by:
+                    slots_for[backend.name].append(slot)
+                files[slot] = (slot, slot, entry['sha256'])
+                for relpath in entry['variants']:
+                    files.setdefault(relpath, (relpath, slot, None))
+        return list(files.values()), slots_for
+
+    def _put(self, backend: Backend, relpath: str, name: str, data: bytes, md5: bytes,
+             cache_control: Optional[str]) -> bool:
+        stats = self.stats[backend.name]
+        started = time.perf_counter()
+        with self._stats_lock:
+            if stats.started is None:
+                stats.started = started
+        try:
+            success = backend.put(relpath, name, data, md5, cache_control)
+        except Exception as e:
+            print(f"❌ {backend.name}: error publishing {name}: {e}")
+            success = False
+        finished = time.perf_counter()
+        self.histograms[backend.name].observe(finished - started)
+
+        with self._stats_lock:
+            stats.finished = finished
+            stats.busy_seconds += finished - started
+            if success:
+                stats.files += 1
+                stats.bytes += len(data)
+            else:
+                stats.failed += 1
+        REGISTRY.inc('items', pipeline='publish', backend=backend.name, result='ok' if success else 'failed')
+        return success
+
+    def fan_out(self, files: List[Tuple[str, Optional[str], str]], slots_for: Dict[str, List[str]],
+                pools: Dict[str, ThreadPoolExecutor]) -> Dict[str, set]:
+        """Read each file once and put it on every backend that needs it. Returns backend -> failed slots."""
+        wanted = {name: set(slots) for name, slots in slots_for.items()}
+        failed_slots = {name: set() for name in wanted}
+        in_flight = threading.BoundedSemaphore(MAX_FILES_IN_FLIGHT)
+        futures: List[Tuple[Future, str, Optional[str]]] = []
+
+        for relpath, slot, sha256 in files:
+            targets = [backend for backend in self.backends if slot in wanted[backend.name]]
+            in_flight.acquire()
+            try:
+                with open(self.base_dir / relpath, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                in_flight.release()
+                print(f"❌ Could not read {relpath}: {e}")
+                for backend in targets:
+                    failed_slots[backend.name].add(slot)
+                continue
+
+            md5 = hashlib.md5(data).digest()
+            sha256 = sha256 or hashlib.sha256(data).hexdigest()
+            self.hashes[relpath] = sha256
+
+            # The bytes are released once every backend has them
+            remaining = [len(targets)]
+            remaining_lock = threading.Lock()
+
+            def release(_future, remaining=remaining, remaining_lock=remaining_lock):
+                with remaining_lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        in_flight.release()
+
+            for backend in targets:
+                future = pools[backend.name].submit(self._put, backend, relpath,
+                                                    backend.publish_name(relpath, sha256),
+                                                    data, md5, backend.cache_control)
+                future.add_done_callback(release)
+                futures.append((future, backend.name, slot))
+
+        for future, name, slot in futures:
+            if not future.result():
+                failed_slots[name].add(slot)
+        return failed_slots
+
+    def _put_file(self, backend: Backend, relpath: str, cache_control: Optional[str]) -> bool:
+        data = (self.base_dir / relpath).read_bytes()
+        return self._put(backend, relpath, relpath, data, hashlib.md5(data).digest(), cache_control)
+
+    def publish_catalogs(self, pools: Dict[str, ThreadPoolExecutor], failed_slots: Dict[str, Set[str]]) -> bool:
+        """Write every backend's URL mapping and catalog, and put the catalog on the backend.
+
+        Slots that failed to reach a backend in this run are left out of its mapping and catalog.
+        """
+        shards = []
+        for backend in self.backends:
+            failed = failed_slots.get(backend.name, set())
+            mapping = build_url_mapping(self.base_dir, self.config, self.manifest, backend.base_url,
+                                        backend.fingerprint, self.hashes, exclude=failed)
+            with open(self.base_dir / f"image-urls.{backend.name}.json", 'w') as f:
+                json.dump(mapping, f, indent=2)
+
+            index, _ = write_catalog(self.base_dir, self.config, self.manifest, backend.base_url, backend.name,
+                                     backend.fingerprint, self.hashes, exclude=failed)
+            files = catalog_files(index, backend.name)
+            futures = [pools[backend.name].submit(self._put_file, backend, relpath, IMMUTABLE_CACHE_CONTROL)
+                       for relpath in files[:-1]]
+            shards.append((backend, files[-1], futures))
+
+        # Shards go first so an index never points at a missing shard
+        indexes = []
+        for backend, index_relpath, futures in shards:
+            if all([future.result() for future in futures]):
+                indexes.append(pools[backend.name].submit(self._put_file, backend, index_relpath,
+                                                          INDEX_CACHE_CONTROL))
+            else:
+                print(f"❌ {backend.name}: catalog shards failed; index left at the previous version")
+                indexes.append(None)
+        return all(future is not None and future.result() for future in indexes)
+
+    def publish(self, force: bool = False) -> bool:
+        """Publish changed images to every backend, then their catalogs. Returns True if all succeeded."""
+        for backend in self.backends:
+            backend.start()
+
+        files, slots_for = self.pending(force)
+        total_bytes = sum((self.base_dir / relpath).stat().st_size for relpath, _, _ in files
+                          if (self.base_dir / relpath).exists())
+        print(f"📤 Publishing {len(files)} files ({total_bytes / 1e6:.1f} MB) to "
+              + ", ".join(f"{backend.name} ({len(slots_for[backend.name])} images)" for backend in self.backends))
+
+        pools = {backend.name: ThreadPoolExecutor(max_workers=backend.workers) for backend in self.backends}
+        try:
+            with REGISTRY.stage('publish', 'files'):
+                failed_slots = self.fan_out(files, slots_for, pools)
+            with REGISTRY.stage('publish', 'catalogs'):
+                ok = self.publish_catalogs(pools, failed_slots)
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+
+        for backend in self.backends:
+            published = [slot for slot in slots_for[backend.name] if slot not in failed_slots[backend.name]]
+            backend.discard({relpath for relpath, slot, _ in files if slot in failed_slots[backend.name]})
+            if not backend.finish(published):
+                print(f"❌ {backend.name}: publish failed")
+                ok = False
+                continue
+            for slot in published:
+                self.manifest.mark_uploaded(slot, backend.key)
+            ok = ok and not failed_slots[backend.name]
+        self.manifest.save()
+
+        # The first backend's mapping stays at image-urls.json for existing n8n workflows
+        primary = self.base_dir / f"image-urls.{self.backends[0].name}.json"
+        (self.base_dir / 'image-urls.json').write_bytes(primary.read_bytes())
+
+        self.print_stats()
+        return ok
+
+    def print_stats(self):
+        print(f"\n{'='*60}")
+        print("📊 Per-backend throughput")
+        for backend in self.backends:
+            summary = self.stats[backend.name].summary()
+            REGISTRY.set('publish_bytes_per_second', summary['mb_per_s'] * 1e6, backend=backend.name)
+            REGISTRY.log('publish', backend=backend.name, **summary)
+            print(f"  {backend.name:<7} {summary['files']:>5} files  {summary['bytes'] / 1e6:>8.1f} MB  "
+                  f"{summary['seconds']:>7.2f}s  {summary['files_per_s']:>7.1f} files/s  "
+                  f"{summary['mb_per_s']:>6.1f} MB/s  {summary['failed']} failed")
+            print(f"          🔗 {backend.base_url}/catalog/{backend.name}/{INDEX_FILE}  "
+                  f"📄 image-urls.{backend.name}.json")
+        print(f"{'='*60}")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Publish the image library to several backends at once")
+    parser.add_argument('--backends', help=f"comma-separated subset of {', '.join(BACKENDS)} "
+                                           "(default: publish.backends in config.json)")
+    parser.add_argument('--fingerprint', action='store_true', default=None,
+                        help="publish under content-hashed names with immutable Cache-Control")
+    parser.add_argument('--force', action='store_true', help="republish every image, not just changed ones")
+    parser.add_argument('--verify', action='store_true', help="check every published URL afterwards")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        with instrumented(args, 'publish'):
+            config = load_config()
+            base_dir = Path(__file__).parent
+            names = args.backends.split(',') if args.backends else config.get('publish', {}).get('backends', ['azure'])
+            backends = [create_backend(name.strip(), config, base_dir, args.fingerprint) for name in names]
+            if not Publisher(backends, base_dir=base_dir).publish(force=args.force):
+                return 1
+
+            if args.verify:
+                from verify_urls import UrlVerifier, catalog_urls
+                verifier = UrlVerifier(base_dir=base_dir)
+                urls = [url for backend in backends for url in catalog_urls(base_dir, backend.name)]
+                if any(result['problems'] for result in verifier.verify(urls)):
+                    return 1
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
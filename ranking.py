@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Candidate Ranking
+Scores a page of search candidates from their thumbnails in one NumPy batch (sharpness,
+exposure, contrast, colorfulness, aspect ratio and distance from the asset's existing
+images), so each slot gets the best photo on the page instead of the first one.
+"""
+
+import io
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from image_store import NEAR_DUPLICATE_DISTANCE, dhash
+
+# Every thumbnail is scored at this (width, height), so one batch is one array
+THUMB_SIZE = (96, 64)
+
+DEFAULT_WEIGHTS = {
+    'sharpness': 0.30,
+    'exposure': 0.20,
+    'contrast': 0.15,
+    'colorfulness': 0.10,
+    'aspect': 0.10,
+    'novelty': 0.15,
+}
+
+# Where each raw measure scores 0.5 (sharpness, colorfulness) or 1.0 (contrast, novelty)
+SHARPNESS_MIDPOINT = 0.01    # Laplacian variance of 0..1 luma at THUMB_SIZE
+COLORFULNESS_MIDPOINT = 0.15  # Hasler–Süsstrunk colorfulness of 0..1 RGB
+CONTRAST_TARGET = 0.22        # luma standard deviation
+NOVELTY_DISTANCE = 24         # dHash bits from the closest image already in the folder
+ASPECT_FALLOFF = 2.0          # score = exp(-falloff * |log(aspect / target)|)
+
+ORIENTATION_ASPECTS = {
+    'landscape': 3 / 2,
+    'portrait': 2 / 3,
+    'squarish': 1.0,
+}
+
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class RankedCandidate:
+    def __init__(self, candidate: Dict, score: float, components: Dict[str, float], dhash: int):
+        """One search result with its overall score and the per-measure scores behind it."""
+        self.candidate = candidate
+        self.score = score
+        self.components = components
+        self.dhash = dhash
+
+
+def decode_thumbnail(body: bytes) -> Tuple[np.ndarray, int]:
+    """Decode a thumbnail to a THUMB_SIZE RGB uint8 array, plus its dHash."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(body)) as image:
+        # Let the JPEG decoder downscale while decoding; we only need THUMB_SIZE
+        image.draft('RGB', (THUMB_SIZE[0] * 2, THUMB_SIZE[1] * 2))
+        image = image.convert('RGB')
+    return np.asarray(image.resize(THUMB_SIZE, Image.Resampling.BILINEAR)), dhash(image)
+
+
+def hash_array(hashes: Sequence[int]) -> np.ndarray:
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def min_distances(hashes: np.ndarray, library: np.ndarray) -> np.ndarray:
+    """Hamming distance from each hash to its closest hash in `library` (64 when it is empty)."""
+    if not len(library):
+        return np.full(len(hashes), 64, dtype=np.int64)
+    xor = (hashes[:, None] ^ library[None, :]).view(np.uint8)  # (N, M * 8)
+    bits = np.unpackbits(xor, axis=1).reshape(len(hashes), len(library), 64)
+    return bits.sum(axis=2, dtype=np.int64).min(axis=1)
+
+
+def score_batch(pixels: np.ndarray, aspects: np.ndarray, novelty_bits: np.ndarray,
+                target_aspect: float, weights: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """Score N thumbnails at once. pixels is (N, H, W, 3) uint8; every result is in 0..1."""
+    rgb = pixels.astype(np.float32) / 255
+    luma = rgb @ LUMA
+
+    # Sharpness: variance of the 4-neighbour Laplacian
+    laplacian = (luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1] + luma[:, 1:-1, :-2] + luma[:, 1:-1, 2:]
+                 - 4 * luma[:, 1:-1, 1:-1])
+    sharpness = laplacian.var(axis=(1, 2))
+
+    # Exposure: mean brightness near mid-grey, discounted by clipped shadows and highlights
+    mean = luma.mean(axis=(1, 2))
+    clipped = ((luma < 0.02) | (luma > 0.98)).mean(axis=(1, 2))
+    exposure = np.clip(1 - 2 * np.abs(mean - 0.5), 0, 1) * (1 - clipped)
+
+    # Colorfulness (Hasler & Süsstrunk) on opponent channels
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    rg, yb = r - g, (r + g) / 2 - b
+    colorfulness = (np.hypot(rg.std(axis=(1, 2)), yb.std(axis=(1, 2)))
+                    + 0.3 * np.hypot(rg.mean(axis=(1, 2)), yb.mean(axis=(1, 2))))
+
+    scores = {
+        'sharpness': sharpness / (sharpness + SHARPNESS_MIDPOINT),
+        'exposure': exposure,
+        'contrast': np.clip(luma.std(axis=(1, 2)) / CONTRAST_TARGET, 0, 1),
+        'colorfulness': colorfulness / (colorfulness + COLORFULNESS_MIDPOINT),
+        'aspect': np.exp(-ASPECT_FALLOFF * np.abs(np.log(aspects / target_aspect))),
+        'novelty': np.clip(novelty_bits / NOVELTY_DISTANCE, 0, 1),
+    }
+    total = sum(weights.get(name, 0.0) for name in scores) or 1.0
+    scores['score'] = sum(weights.get(name, 0.0) * value for name, value in scores.items()) / total
+    return scores
+
+
+class CandidateRanker:
+    def __init__(self, orientation: str = 'landscape', weights: Optional[Dict[str, float]] = None):
+        """Rank search candidates by thumbnail quality, aiming for the configured orientation."""
+        self.target_aspect = ORIENTATION_ASPECTS.get(orientation, ORIENTATION_ASPECTS['landscape'])
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+
+    def rank(self, candidates: List[Dict], thumbnails: List[Optional[bytes]],
+             library_hashes: Sequence[int], folder_hashes: Sequence[int]) -> List[RankedCandidate]:
+        """Best candidate first. Undecodable thumbnails and near-duplicates of the library are dropped."""
+        decoded = []
+        for candidate, body in zip(candidates, thumbnails):
+            if body is None:
+                continue
+            try:
+                pixels, hash_value = decode_thumbnail(body)
+            except Exception:
+                continue
+            decoded.append((candidate, pixels, hash_value))
+        if not decoded:
+            return []
+
+        hashes = hash_array([hash_value for _, _, hash_value in decoded])
+        distinct = min_distances(hashes, hash_array(library_hashes)) > NEAR_DUPLICATE_DISTANCE
+        if not distinct.any():
+            return []
+        decoded = [item for item, keep in zip(decoded, distinct) if keep]
+        hashes = hashes[distinct]
+
+        # Search results carry the full-size dimensions; thumbnails are all stretched to THUMB_SIZE
+        aspects = np.array([(candidate.get('width') or 3) / (candidate.get('height') or 2)
+                            for candidate, _, _ in decoded], dtype=np.float32)
+        scores = score_batch(np.stack([pixels for _, pixels, _ in decoded]), aspects,
+                             min_distances(hashes, hash_array(folder_hashes)), self.target_aspect, self.weights)
+
+        ranked = [
+            RankedCandidate(candidate, float(scores['score'][i]),
+                            {name: round(float(values[i]), 3) for name, values in scores.items() if name != 'score'},
+                            hash_value)
+            for i, (candidate, _, hash_value) in enumerate(decoded)
+        ]
+        return sorted(ranked, key=lambda ranked_candidate: ranked_candidate.score, reverse=True)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Token Bucket Rate Limiter
+Shares an API quota (e.g. Unsplash's 50 requests/hour) between concurrent workers.
+"""
+
+import threading
+import time
+from typing import Mapping, Optional
+
+from metrics import REGISTRY
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, refill_period: float = 3600.0, name: str = "default"):
+        """Create a full bucket that refills `capacity` tokens every `refill_period` seconds."""
+        self.name = name
+        self.capacity = float(capacity)
+        self.refill_period = refill_period
+        self.rate = self.capacity / refill_period
+        self.tokens = self.capacity
+        self.total_wait = 0.0
+
+        self._updated_at = time.monotonic()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        """Add the tokens earned since the last update (caller holds the lock)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Block until `tokens` are available and take them. Returns seconds waited.
+
+        Raises ValueError if `tokens` is more than the bucket can ever hold.
+        """
+        waited = 0.0
+        with self._condition:
+            while True:
+                # Checked every pass: update_from_headers can shrink the capacity while we wait
+                if tokens > self.capacity:
+                    raise ValueError(f"{self.name}: cannot take {tokens} tokens from a bucket of {self.capacity:g}")
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    self.total_wait += waited
+                    if waited:
+                        REGISTRY.inc('rate_limit_wait_seconds', waited, limiter=self.name)
+                    return waited
+
+                delay = (tokens - self.tokens) / self.rate
+                started = time.monotonic()
+                self._condition.wait(timeout=delay)
+                waited += time.monotonic() - started
+
+    def throttle(self, factor: float):
+        """Scale the refill rate down after the server pushed back (e.g. a 429 that outlasted retries)."""
+        with self._condition:
+            self._refill()
+            self.rate *= factor
+            self.refill_period = self.capacity / self.rate
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> Optional[int]:
+        """Adapt to the server's view of the quota (X-Ratelimit-Limit / -Remaining)."""
+        remaining = headers.get('X-Ratelimit-Remaining')
+        if remaining is None:
+            return None
+
+        try:
+            remaining = int(remaining)
+        except ValueError:
+            return None
+
+        with self._condition:
+            self._refill()
+
+            limit = headers.get('X-Ratelimit-Limit')
+            if limit and limit.isdigit() and float(limit) != self.capacity:
+                self.capacity = float(limit)
+                self.rate = self.capacity / self.refill_period
+
+            # The server counts every client sharing the key, so never believe we
+            # have more tokens than it says are left.
+            self.tokens = min(self.tokens, float(remaining))
+            self._condition.notify_all()
+
+        return remaining
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Search Result Cache
+On-disk cache of API search responses with a TTL and size-bounded LRU eviction,
+so reruns and retries don't spend rate-limited requests relearning the same answer.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from metrics import REGISTRY
+
+CACHE_DIR = ".cache/search"
+
+
+class SearchCache:
+    def __init__(self, base_dir: Path, ttl: float = 24 * 3600, max_entries: int = 500):
+        """Cache entries under base_dir/.cache/search for `ttl` seconds, keeping at most `max_entries`."""
+        self.cache_dir = Path(base_dir) / CACHE_DIR
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def make_key(**params) -> str:
+        """Stable key for a set of request parameters (query, page, orientation, per_page)."""
+        canonical = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a fresh cached response, or None. A hit refreshes the entry's LRU position."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        if time.time() - entry['fetched_at'] > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+
+        try:
+            os.utime(path)  # mtime doubles as last-used time for LRU eviction
+        except FileNotFoundError:
+            pass  # Evicted by another process since we read it; the response is still good
+        return entry['response']
+
+    def put(self, key: str, response: Dict):
+        """Store a response and evict the least recently used entries beyond max_entries."""
+        path = self._path(key)
+        # A unique temp name, so processes storing the same key never write into one file
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{key}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'fetched_at': time.time(), 'response': response}, f)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for path in self.cache_dir.glob("*.json"):
+                try:
+                    entries.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    # Evicted by another process since the glob
+                    continue
+            excess = len(entries) - self.max_entries
+            if excess <= 0:
+                return
+            entries.sort()
+            for _, path in entries[:excess]:
+                path.unlink(missing_ok=True)
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Dict]) -> Dict:
+        """Return the cached response or call fetch() once, even with concurrent callers."""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            response = self.get(key)
+            with self._lock:
+                if response is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            REGISTRY.inc('search_cache_lookups', result='hit' if response is not None else 'miss')
+            if response is not None:
+                return response
+
+            response = fetch()
+            self.put(key, response)
+            return response
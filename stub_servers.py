@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Local API Stand-ins
+Offline stubs for the Unsplash and Azure OpenAI image APIs (HTTP, with configurable
+latency, rate-limit headers and 429/5xx injection) and an in-process fake of the
+Azure Blob Storage client, for benchmarking the pipeline without network access.
+"""
+
+import io
+import json
+import time
+import random
+import hashlib
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+
+# imgix fm values -> (Pillow format, Content-Type)
+IMGIX_FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg'),
+    'pjpg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'avif': ('AVIF', 'image/avif'),
+}
+
+
+@lru_cache(maxsize=256)
+def synthetic_image(seed: str, width: int = 1080, fmt: str = 'JPEG', quality: int = 85) -> bytes:
+    """A distinct, deterministic 3:2 image per seed (unique dHash, so no false near-duplicates)."""
+    rng = random.Random(hashlib.sha256(seed.encode('utf-8')).digest())
+    tiles = Image.new('RGB', (12, 8))
+    tiles.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(12 * 8)])
+    image = tiles.resize((width, width * 2 // 3), Image.Resampling.BILINEAR)
+    output = io.BytesIO()
+    image.save(output, format=fmt, quality=quality)
+    return output.getvalue()
+
+
+class StubSettings:
+    def __init__(self, latency: float = 0.02, jitter: float = 0.01, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, rate_limit: int = 100000):
+        """Behaviour of one stub server.
+
+        latency/jitter: seconds added to every request; error_rate/throttle_rate: fraction
+        of API calls answered with 503/429; rate_limit: X-Ratelimit-Limit advertised.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    @property
+    def settings(self) -> StubSettings:
+        return self.server.settings
+
+    def _base_url(self) -> str:
+        return f"http://{self.headers.get('Host')}"
+
+    def _delay(self):
+        self.server.count_request()
+        time.sleep(max(0.0, self.settings.latency + random.uniform(-1, 1) * self.settings.jitter))
+
+    def _inject_fault(self) -> bool:
+        """Answer with a 429 or 503 for a configured fraction of API calls."""
+        roll = random.random()
+        if roll < self.settings.throttle_rate:
+            self._send(429, b'{"errors": ["Rate Limit Exceeded"]}', 'application/json', {'Retry-After': '0'})
+            return True
+        if roll < self.settings.throttle_rate + self.settings.error_rate:
+            self._send(503, b'{"errors": ["Service Unavailable"]}', 'application/json')
+            return True
+        return False
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Ratelimit-Limit', str(self.settings.rate_limit))
+        self.send_header('X-Ratelimit-Remaining', str(self.settings.rate_limit))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload: Dict):
+        self._send(200, json.dumps(payload).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        self._delay()
+        url = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        parts = url.path.strip('/').split('/')
+
+        if url.path == '/search/photos':
+            # Unsplash search: per_page distinct photos per (query, page)
+            if self._inject_fault():
+                return
+            per_page = int(params.get('per_page', 10))
+            results = []
+            for i in range(per_page):
+                key = f"{params.get('query')}|{params.get('page', 1)}|{i}"
+                photo_id = hashlib.sha1(key.encode('utf-8')).hexdigest()[:11]
+                results.append({
+                    'id': photo_id,
+                    'width': 6000,
+                    'height': 4000,
+                    'urls': {
+                        'raw': f"{self._base_url()}/photos/{photo_id}.jpg?ixid=stub&ixlib=rb-4.0.3",
+                        'regular': f"{self._base_url()}/photos/{photo_id}.jpg?w=1080",
+                        'thumb': f"{self._base_url()}/photos/{photo_id}.jpg?w=200",
+                    },
+                    'links': {'download_location': f"{self._base_url()}/photos/{photo_id}/download"},
+                })
+            self._send_json({'total': 10000, 'total_pages': 1000, 'results': results})
+        elif len(parts) == 3 and parts[0] == 'photos' and parts[2] == 'download':
+            if self._inject_fault():
+                return
+            self._send_json({'url': f"{self._base_url()}/photos/{parts[1]}.jpg"})
+        elif len(parts) == 2 and parts[0] in ('photos', 'generated') and parts[1].endswith('.jpg'):
+            # imgix-style rendering: w (capped at the stored size for fit=max), q and fm
+            width = min(int(params.get('w', 1024)), 6000 if params.get('fit') == 'max' else 10 ** 6)
+            fmt, content_type = IMGIX_FORMATS.get(params.get('fm', 'jpg'), IMGIX_FORMATS['jpg'])
+            body = synthetic_image(parts[1], width, fmt, int(params.get('q', 85)))
+            self._send(200, body, content_type)
+        else:
+            self._send(404, b'{}', 'application/json')
+
+    def do_POST(self):
+        self._delay()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urlsplit(self.path)
+
+        if url.path.endswith('/images/generations'):
+            # Azure OpenAI DALL-E 3: one image URL per request
+            if self._inject_fault():
+                return
+            image_id = hashlib.sha1(body + str(time.time_ns()).encode('utf-8')).hexdigest()[:16]
+            self._send_json({
+                'created': int(time.time()),
+                'data': [{'url': f"{self._base_url()}/generated/{image_id}.jpg?w=1024",
+                          'revised_prompt': json.loads(body or b'{}').get('prompt')}],
+            })
+        else:
+            self._send(404, b'{}', 'application/json')
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings: Optional[StubSettings] = None, host: str = '127.0.0.1', port: int = 0):
+        """Bind (port 0 picks a free one); call start() to serve in the background."""
+        super().__init__((host, port), StubHandler)
+        self.settings = settings or StubSettings()
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    def start(self) -> 'StubServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeContentSettings(SimpleNamespace):
+    """Stand-in for azure.storage.blob.ContentSettings."""
+
+
+class FakeBlobServiceClient:
+    def __init__(self, latency: float = 0.01, bandwidth: float = 100e6):
+        """In-memory stand-in for azure.storage.blob.BlobServiceClient.
+
+        Every call sleeps `latency` seconds, and uploads also sleep for their size
+        at `bandwidth` bytes per second.
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.containers: Dict[str, Dict[str, SimpleNamespace]] = {}
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    def get_container_client(self, container: str) -> 'FakeContainerClient':
+        return FakeContainerClient(self, container)
+
+    def get_blob_client(self, container: str, blob: str) -> 'FakeBlobClient':
+        return FakeBlobClient(self, container, blob)
+
+
+class FakeContainerClient:
+    def __init__(self, service: FakeBlobServiceClient, name: str):
+        self.service = service
+        self.name = name
+
+    def exists(self) -> bool:
+        time.sleep(self.service.latency)
+        return self.name in self.service.containers
+
+    def create_container(self):
+        time.sleep(self.service.latency)
+        with self.service._lock:
+            self.service.containers.setdefault(self.name, {})
+
+    def list_blobs(self, name_starts_with: Optional[str] = None):
+        time.sleep(self.service.latency)
+        with self.service._lock:
+            blobs = list(self.service.containers.get(self.name, {}).values())
+        return [blob for blob in blobs if not name_starts_with or blob.name.startswith(name_starts_with)]
+
+
+class FakeBlobClient:
+    def __init__(self, service: FakeBlobServiceClient, container: str, blob: str):
+        self.service = service
+        self.container = container
+        self.blob = blob
+        self.url = f"https://fake.blob.core.windows.net/{container}/{blob}"
+
+    def upload_blob(self, data, overwrite: bool = False, content_settings=None, max_concurrency: int = 1):
+        payload = data.read() if hasattr(data, 'read') else bytes(data)
+        time.sleep(self.service.latency + len(payload) / self.service.bandwidth)
+        settings = content_settings or SimpleNamespace(content_md5=None)
+        if settings.content_md5 is None:
+            settings.content_md5 = hashlib.md5(payload).digest()
+        with self.service._lock:
+            container = self.service.containers.setdefault(self.container, {})
+            if self.blob in container and not overwrite:
+                raise ValueError(f"Blob {self.blob} already exists")
+            container[self.blob] = SimpleNamespace(name=self.blob, size=len(payload),
+                                                   content_settings=settings, data=payload)
+            self.service.bytes_uploaded += len(payload)
+
+    def start_copy_from_url(self, source_url: str):
+        time.sleep(self.service.latency)
+        source_name = source_url.split(f"/{self.container}/", 1)[1]
+        with self.service._lock:
+            container = self.service.containers[self.container]
+            source = container[source_name]
+            container[self.blob] = SimpleNamespace(name=self.blob, size=source.size,
+                                                   content_settings=source.content_settings, data=source.data)
+        return {'copy_id': hashlib.sha1(source_url.encode('utf-8')).hexdigest(), 'copy_status': 'success'}
+
+    def get_blob_properties(self):
+        time.sleep(self.service.latency)
+        with self.service._lock:
+            blob = self.service.containers[self.container][self.blob]
+        return SimpleNamespace(name=blob.name, size=blob.size, content_settings=blob.content_settings,
+                               copy=SimpleNamespace(status='success'))
+
+    def abort_copy(self, copy_id: str):
+        time.sleep(self.service.latency)
+
+
+def main():
+    """Run the HTTP stubs in the foreground for manual testing."""
+    server = StubServer(port=8765).start()
+    print(f"🧪 Stub APIs at {server.url} (Unsplash: /search/photos, OpenAI: /openai/deployments/<name>/images/generations)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
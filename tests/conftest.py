@@ -0,0 +1,51 @@
+"""Shared fixtures: a throwaway library workspace and a one-response HTTP server."""
+
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmark import write_bench_config  # noqa: E402
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A library directory with its own config.json (5 images per asset, 2 assets)."""
+    config_path = write_bench_config(tmp_path, 10, 'http://127.0.0.1:9')
+    monkeypatch.setenv('TRADING_IMAGES_CONFIG', str(config_path))
+    return tmp_path
+
+
+@pytest.fixture
+def body_server():
+    """serve(body, content_length=None) -> URL that answers every GET with exactly those bytes.
+
+    A content_length larger than the body imitates a connection dropped mid-download.
+    """
+    servers = []
+
+    def serve(body: bytes, content_length=None) -> str:
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body) if content_length is None else content_length))
+                self.end_headers()
+                self.wfile.write(body)
+                self.close_connection = True
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/image.jpg"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
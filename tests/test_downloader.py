@@ -0,0 +1,71 @@
+import hashlib
+
+import pytest
+import requests
+
+from downloader import InvalidImageError, check_markers, download_image_file
+from stub_servers import StubServer, StubSettings, synthetic_image
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = StubServer(StubSettings(latency=0, jitter=0)).start()
+    yield server
+    server.stop()
+
+
+def test_a_complete_image_is_saved_with_its_hash(stub, tmp_path):
+    save_path = tmp_path / "gold-1.jpg"
+    downloaded = download_image_file(requests.Session(), f"{stub.url}/photos/abc.jpg?w=640", save_path)
+
+    data = save_path.read_bytes()
+    assert downloaded.format == "JPEG"
+    assert (downloaded.width, downloaded.height) == (640, 426)
+    assert downloaded.size == len(data)
+    assert downloaded.sha256 == hashlib.sha256(data).hexdigest()
+    assert not (tmp_path / "gold-1.jpg.part").exists()
+
+
+def test_a_body_shorter_than_its_content_length_is_rejected(body_server, tmp_path):
+    body = synthetic_image("short")
+    url = body_server(body[:len(body) // 2], content_length=len(body))
+
+    with pytest.raises(Exception):
+        download_image_file(requests.Session(), url, tmp_path / "gold-1.jpg")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_a_jpeg_without_its_end_marker_is_rejected(body_server, tmp_path):
+    body = synthetic_image("cut")
+    url = body_server(body[:-1000])
+
+    with pytest.raises(InvalidImageError, match="EOI"):
+        download_image_file(requests.Session(), url, tmp_path / "gold-1.jpg")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_an_error_page_served_with_200_is_rejected(body_server, tmp_path):
+    url = body_server(b"<html>rate limited</html>")
+
+    with pytest.raises(InvalidImageError):
+        download_image_file(requests.Session(), url, tmp_path / "gold-1.jpg")
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("fmt,error", [("PNG", "IEND"), ("WEBP", "RIFF")])
+def test_truncated_png_and_webp_are_detected(fmt, error):
+    body = synthetic_image("formats", 320, fmt)
+    assert check_markers(memoryview(body)) == fmt
+    with pytest.raises(InvalidImageError, match=error):
+        check_markers(memoryview(body[:-20]))
+
+
+def test_png_bound_for_a_jpg_slot_is_stored_as_jpeg(body_server, tmp_path):
+    url = body_server(synthetic_image("dalle", 320, "PNG"))
+    save_path = tmp_path / "gold-1.jpg"
+    downloaded = download_image_file(requests.Session(), url, save_path)
+
+    data = save_path.read_bytes()
+    assert downloaded.format == "JPEG"
+    assert data[:3] == b"\xff\xd8\xff"
+    assert downloaded.sha256 == hashlib.sha256(data).hexdigest()
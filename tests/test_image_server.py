@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+import pytest
+import requests
+
+from image_server import ImageServer
+from stub_servers import synthetic_image
+
+
+@pytest.fixture(params=["cache", "sendfile"])
+def served(request, workspace):
+    """(base URL, image bytes) for a server holding one image in asset-0, from the LRU or via sendfile."""
+    (workspace / "asset-0").mkdir()
+    data = synthetic_image("served", 640)
+    (workspace / "asset-0" / "asset-0-1.jpg").write_bytes(data)
+
+    server = ImageServer(base_dir=workspace)
+    if request.param == "sendfile":
+        server.max_cached_object = 0
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    listener = asyncio.run_coroutine_threadsafe(
+        asyncio.start_server(server.handle_connection, '127.0.0.1', 0), loop).result()
+    port = listener.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}/image?asset=asset_0&key=post-1", data
+
+    listener.close()
+    asyncio.run_coroutine_threadsafe(listener.wait_closed(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_get_returns_the_image_with_its_etag(served):
+    url, data = served
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    assert response.headers['Content-Location'] == '/asset-0/asset-0-1.jpg'
+    assert response.headers['ETag'].startswith('"')
+
+
+def test_matching_if_none_match_is_not_modified(served):
+    url, _ = served
+    etag = requests.head(url).headers['ETag']
+
+    response = requests.get(url, headers={'If-None-Match': f'W/{etag}, "other"'})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert requests.get(url, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize("header,start,end", [("bytes=0-9", 0, 9), ("bytes=100-", 100, None), ("bytes=-50", -50, None)])
+def test_range_returns_partial_content(served, header, start, end):
+    url, data = served
+    response = requests.get(url, headers={'Range': header})
+    expected = data[start:None if end is None else end + 1]
+
+    assert response.status_code == 206
+    assert response.content == expected
+    first = start % len(data)
+    assert response.headers['Content-Range'] == f"bytes {first}-{first + len(expected) - 1}/{len(data)}"
+
+
+def test_unsatisfiable_range_is_416(served):
+    url, data = served
+    response = requests.get(url, headers={'Range': f"bytes={len(data)}-"})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f"bytes */{len(data)}"
+
+
+def test_stale_if_range_sends_the_whole_image(served):
+    url, data = served
+    response = requests.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.content == data
+
+
+def test_content_type_follows_the_bytes(workspace):
+    (workspace / "asset-0").mkdir()
+    (workspace / "asset-0" / "asset-0-1.jpg").write_bytes(synthetic_image("png", 320, "PNG"))
+    server = ImageServer(base_dir=workspace)
+
+    async def fetch():
+        listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b"HEAD /image?asset=asset_0&key=x HTTP/1.1\r\nConnection: close\r\n\r\n")
+        head = (await reader.read()).decode('latin-1')
+        writer.close()
+        listener.close()
+        return head
+
+    assert "Content-Type: image/png" in asyncio.run(fetch())
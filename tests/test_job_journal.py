@@ -0,0 +1,64 @@
+from job_journal import JobJournal
+
+
+def test_resume_replays_the_latest_state_of_each_stage(tmp_path):
+    journal = JobJournal(tmp_path, "fetch")
+    journal.queue("gold/gold-1.jpg", query="gold bars")
+    journal.queue("gold/gold-2.jpg", query="gold chart")
+    journal.record("gold/gold-1.jpg", "search", "running")
+    journal.record("gold/gold-1.jpg", "search", "done", photo_id="abc")
+    journal.finish("gold/gold-2.jpg", True)
+    journal.close()
+
+    resumed = JobJournal(tmp_path, "fetch", resume=True)
+    assert resumed.result("gold/gold-1.jpg", "search")["photo_id"] == "abc"
+    assert resumed.result("gold/gold-2.jpg", "search") is None
+    unfinished = resumed.unfinished()
+    assert list(unfinished) == ["gold/gold-1.jpg"]
+    assert unfinished["gold/gold-1.jpg"]["query"] == "gold bars"
+
+
+def test_failed_jobs_and_running_stages_are_replayed(tmp_path):
+    journal = JobJournal(tmp_path, "generate")
+    journal.queue("xrp/xrp-1.jpg", prompt="p")
+    journal.record("xrp/xrp-1.jpg", "generate", "running")
+    journal.finish("xrp/xrp-1.jpg", False)
+    journal.close()
+
+    resumed = JobJournal(tmp_path, "generate", resume=True)
+    assert "xrp/xrp-1.jpg" in resumed.unfinished()
+    assert resumed.result("xrp/xrp-1.jpg", "generate") is None
+
+
+def test_torn_final_line_keeps_everything_before_it(tmp_path):
+    journal = JobJournal(tmp_path, "fetch")
+    journal.queue("gold/gold-1.jpg", query="gold")
+    journal.close()
+    with open(journal.path, "a") as f:
+        f.write('{"job": "gold/gold-1.jpg", "stage": "job", "sta')
+
+    resumed = JobJournal(tmp_path, "fetch", resume=True)
+    assert list(resumed.unfinished()) == ["gold/gold-1.jpg"]
+
+    # New records are appended after the replayed ones
+    resumed.finish("gold/gold-1.jpg", True)
+    resumed.close()
+    assert JobJournal(tmp_path, "fetch", resume=True).unfinished() == {}
+
+
+def test_a_fresh_run_starts_an_empty_journal(tmp_path):
+    journal = JobJournal(tmp_path, "fetch")
+    journal.queue("gold/gold-1.jpg", query="gold")
+    journal.close()
+
+    JobJournal(tmp_path, "fetch").close()
+    assert JobJournal(tmp_path, "fetch", resume=True).unfinished() == {}
+
+
+def test_journals_with_different_names_are_independent(tmp_path):
+    generate = JobJournal(tmp_path, "generate")
+    generate.queue("gold/gold-1.jpg", prompt="p")
+    generate.close()
+
+    JobJournal(tmp_path, "queue-w1-generate").close()
+    assert list(JobJournal(tmp_path, "generate", resume=True).unfinished()) == ["gold/gold-1.jpg"]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from ranking import min_distances
+
+
+def hashes(*values):
+    return np.array(values, dtype=np.uint64)
+
+
+def test_distance_to_an_empty_library_is_the_maximum():
+    assert min_distances(hashes(0, 2 ** 64 - 1), hashes()).tolist() == [64, 64]
+
+
+def test_identical_hashes_are_zero_apart():
+    assert min_distances(hashes(0xDEADBEEF), hashes(0xDEADBEEF)).tolist() == [0]
+
+
+def test_counts_differing_bits_including_the_top_one():
+    assert min_distances(hashes(0b1011, 2 ** 63), hashes(0)).tolist() == [3, 1]
+    assert min_distances(hashes(0), hashes(2 ** 64 - 1)).tolist() == [64]
+
+
+def test_takes_the_closest_hash_in_the_library():
+    library = hashes(0xFF, 0x0F, 0xF0F0)
+    assert min_distances(hashes(0x07, 0xF0F1), library).tolist() == [1, 1]
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from work_queue import SQLiteQueue
+
+LEASE = 0.3
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SQLiteQueue(tmp_path / "work.db", lease_seconds=LEASE, max_attempts=2)
+    queue.enqueue("fetch", "gold/gold-1.jpg", {"slot": "gold/gold-1.jpg"})
+    return queue
+
+
+def test_a_leased_task_is_not_claimed_twice(queue):
+    assert queue.claim("w1", ["fetch"])["key"] == "gold/gold-1.jpg"
+    assert queue.claim("w2", ["fetch"]) is None
+    assert queue.pending(["fetch"]) == 1
+
+
+def test_an_expired_lease_is_claimed_by_another_worker(queue):
+    first = queue.claim("w1", ["fetch"])
+    queue.checkpoint(first, "w1", {"url": "https://example.com/a.jpg"})
+    time.sleep(LEASE * 1.5)
+
+    second = queue.claim("w2", ["fetch"])
+    assert second["id"] == first["id"]
+    assert second["attempts"] == 2
+    assert second["checkpoint"] == {"url": "https://example.com/a.jpg"}
+
+    # The first worker lost its lease, so its result is refused
+    assert not queue.complete(first, "w1", {})
+    assert queue.complete(second, "w2", {})
+    assert queue.stats() == {"fetch": {"done": 1}}
+
+
+def test_heartbeats_keep_a_lease_alive(queue):
+    queue.claim("w1", ["fetch"])
+    for _ in range(4):
+        time.sleep(LEASE / 2)
+        assert queue.heartbeat("w1") == 1
+        assert queue.claim("w2", ["fetch"]) is None
+
+
+def test_a_task_out_of_attempts_goes_dead(queue):
+    queue.claim("w1", ["fetch"])
+    time.sleep(LEASE * 1.5)
+    queue.claim("w2", ["fetch"])
+    time.sleep(LEASE * 1.5)
+
+    assert queue.claim("w3", ["fetch"]) is None
+    assert queue.stats() == {"fetch": {"dead": 1}}
+    assert queue.retry_dead() == 1
+    assert queue.claim("w3", ["fetch"])["attempts"] == 1
+
+
+def test_a_failure_backs_off_before_the_retry(queue):
+    task = queue.claim("w1", ["fetch"])
+    assert queue.fail(task, "w1", "boom") == "queued"
+    assert queue.claim("w2", ["fetch"]) is None
+    assert queue.pending(["fetch"]) == 1
+
+
+def test_a_deferred_task_uses_no_attempt_and_is_not_pending(queue):
+    task = queue.claim("w1", ["fetch"])
+    assert queue.defer(task, "w1", time.time() + LEASE, "deferred (budget)")
+    assert queue.pending(["fetch"]) == 0
+    assert queue.claim("w2", ["fetch"]) is None
+
+    time.sleep(LEASE * 1.5)
+    assert queue.claim("w2", ["fetch"])["attempts"] == 1
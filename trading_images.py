@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Trading Images CLI
+One entry point for every pipeline step. Each subcommand imports its script (and the
+SDKs behind it) only when it runs, so cron and n8n Execute Command invocations start fast.
+
+    trading-images [--config PATH] <command> [options]
+"""
+
+import os
+import sys
+import argparse
+import importlib
+from typing import List, Optional
+
+# command → (module, help); every module exposes main(argv) returning an exit code
+COMMANDS = {
+    'fetch': ('fetch_images', "download images from Unsplash"),
+    'generate': ('generate_with_dalle', "generate images for empty slots with DALL-E"),
+    'fill': ('fill_missing', "fill missing slots from similar existing images"),
+    'optimize': ('optimize_images', "write responsive JPEG/WebP/AVIF variants"),
+    'upload': (None, "publish the library (azure | github)"),
+    'publish': ('publisher', "publish to every configured backend in one pass"),
+    'verify': ('verify_urls', "check that every published URL resolves"),
+    'audit': ('audit_library', "find broken, duplicate and missing images and repair them"),
+    'catalog': ('catalog', "write the versioned image catalog"),
+    'serve': ('image_server', "serve the library over HTTP"),
+    'bench': ('benchmark', "benchmark the pipeline against local API stubs"),
+    'queue': ('work_queue', "plan and run the durable work queue"),
+}
+
+UPLOAD_BACKENDS = {
+    'azure': 'upload_to_azure',
+    'github': 'upload_to_github',
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    commands = "\n".join(f"  {name:<10} {text}" for name, (_, text) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog="trading-images",
+        description="Build, optimize and publish the trading image library",
+        epilog=f"commands:\n{commands}\n\nRun 'trading-images <command> --help' for a command's options.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--config', metavar='PATH',
+                        help="config file for every step (default: $TRADING_IMAGES_CONFIG or ./config.json)")
+    parser.add_argument('command', choices=COMMANDS, metavar='command', help="one of the commands below")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.config:
+        from config import CONFIG_ENV
+        os.environ[CONFIG_ENV] = os.path.abspath(args.config)
+
+    command, rest = args.command, args.args
+    module_name = COMMANDS[command][0]
+    if command == 'upload':
+        if not rest or rest[0] not in UPLOAD_BACKENDS:
+            parser.error(f"upload needs a backend: {' | '.join(UPLOAD_BACKENDS)}")
+        module_name = UPLOAD_BACKENDS[rest[0]]
+        command, rest = f"upload {rest[0]}", rest[1:]
+
+    # Scripts build their own parsers; make their usage lines read as subcommands
+    sys.argv[0] = f"trading-images {command}"
+
+    from config import ConfigError, load_config
+    try:
+        # Fail fast on a bad config; the parsed copy is cached for the command itself
+        if command != 'bench' and not {'-h', '--help'} & set(rest):
+            load_config()
+    except ConfigError as e:
+        print(f"❌ {e}")
+        return 1
+
+    module = importlib.import_module(module_name)
+    return module.main(rest)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -6,28 +6,80 @@ Uploads trading images to Azure Blob Storage with static website hosting.
 
 import os
 import json
+import time
+import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from pathlib import Path
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+from catalog import (IMMUTABLE_CACHE_CONTROL, INDEX_CACHE_CONTROL, INDEX_FILE, build_url_mapping, catalog_files,
+                     fingerprint_file, fingerprinted_name, write_catalog)
+from config import load_config
+from job_journal import JobJournal
+from manifest import Manifest
+from metrics import REGISTRY, add_instrumentation_args, instrumented, print_histograms
+from optimize_images import content_type
+
+# Server-side copies within one account are usually done at once; poll pending ones this long
+COPY_POLL_SECONDS = 0.5
+COPY_TIMEOUT_SECONDS = 60.0
 
 class AzureBlobUploader:
-    def __init__(self, config_path: str = "config.json"):
-        """Initialize the Azure uploader with configuration."""
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+    def __init__(self, config_path: Optional[str] = None, blob_service_client=None,
+                 fingerprint: Optional[bool] = None, base_dir: Optional[Path] = None,
+                 journal_name: str = "upload", content_settings_class=None):
+        """Initialize the Azure uploader with configuration.
 
-        # Get Azure Storage connection string from environment
-        self.connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
-        if not self.connection_string:
-            raise ValueError("Please set AZURE_STORAGE_CONNECTION_STRING environment variable")
+        content_settings_class replaces azure.storage.blob.ContentSettings, so a fake
+        blob_service_client works without the SDK installed.
+        """
+        self.config = load_config(config_path)
 
         self.storage_account_name = self.config['azure']['storage_account_name']
         self.container_name = self.config['azure']['container_name']
-
-        # Initialize blob service client
-        self.blob_service_client = BlobServiceClient.from_connection_string(self.connection_string)
-
-        self.base_dir = Path(__file__).parent
+        self.base_url = f"https://{self.storage_account_name}.z6.web.core.windows.net"
+
+        # Fingerprinted publishing names blobs by content hash (gold/3.1a2b3c4d.jpg) and marks
+        # them immutable, so caches never revalidate and a replaced image is simply a new URL
+        if fingerprint is None:
+            fingerprint = self.config['azure'].get('fingerprint', False)
+        self.fingerprint = fingerprint
+        self.backend = 'azure-fingerprinted' if fingerprint else 'azure'
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if fingerprint else None
+
+        # Upload tuning: files above max_single_put_size are sent as parallel blocks
+        self.upload_workers = self.config['azure'].get('upload_workers', 8)
+        self.max_block_concurrency = self.config['azure'].get('max_block_concurrency', 4)
+        self.max_single_put_size = self.config['azure'].get('max_single_put_size', 4 * 1024 * 1024)
+
+        # Created on first use, so URL mapping and --help never import the Azure SDK
+        self._blob_service_client = blob_service_client
+        self.content_settings_class = content_settings_class
+
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.manifest = Manifest(self.base_dir)
+        self.journal = JobJournal(self.base_dir, journal_name)
+        self.histogram = REGISTRY.histogram('stage_seconds', pipeline='upload', stage='upload')
+
+    @property
+    def blob_service_client(self):
+        """The BlobServiceClient, connected from AZURE_STORAGE_CONNECTION_STRING on first use."""
+        if self._blob_service_client is None:
+            from azure.storage.blob import BlobServiceClient
+
+            # Get Azure Storage connection string from environment
+            self.connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
+            if not self.connection_string:
+                raise ValueError("Please set AZURE_STORAGE_CONNECTION_STRING environment variable")
+
+            self._blob_service_client = BlobServiceClient.from_connection_string(
+                self.connection_string,
+                max_single_put_size=self.max_single_put_size,
+                max_block_size=self.max_single_put_size,
+            )
+        return self._blob_service_client
 
     def create_container_if_not_exists(self):
         """Create the $web container if it doesn't exist."""
@@ -41,32 +93,144 @@ class AzureBlobUploader:
         except Exception as e:
             print(f"❌ Error creating container: {e}")
 
-    def upload_image(self, local_path: Path, blob_name: str) -> bool:
-        """Upload a single image to Azure Blob Storage."""
+    @staticmethod
+    def file_md5(local_path: Path) -> bytes:
+        """Compute the MD5 digest Azure stores as the blob's Content-MD5."""
+        digest = hashlib.md5()
+        with open(local_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.digest()
+
+    def list_remote_md5s(self, prefix: Optional[str] = None) -> Dict[str, bytes]:
+        """List the container (or one prefix of it) and return blob name -> Content-MD5."""
+        container_client = self.blob_service_client.get_container_client(self.container_name)
+
+        remote = {}
+        for blob in container_client.list_blobs(name_starts_with=prefix):
+            content_md5 = blob.content_settings.content_md5
+            if content_md5:
+                remote[blob.name] = bytes(content_md5)
+        return remote
+
+    def upload_image(self, local_path: Path, blob_name: str, content_md5: Optional[bytes] = None,
+                     cache_control: Optional[str] = None, data: Optional[bytes] = None) -> bool:
+        """Upload a single image (or catalog file) to Azure Blob Storage.
+
+        Pass data when the caller has already read the file, so it isn't read again.
+        """
+        ContentSettings = self.content_settings_class
+        if ContentSettings is None:
+            from azure.storage.blob import ContentSettings
+
         try:
             blob_client = self.blob_service_client.get_blob_client(
                 container=self.container_name,
                 blob=blob_name
             )
 
-            # Set content type for images
-            content_settings = ContentSettings(content_type='image/jpeg')
+            # Set content type for images. Storing the MD5 explicitly keeps it on
+            # blobs uploaded as blocks, where Azure doesn't compute one itself.
+            content_settings = ContentSettings(
+                content_type=content_type(local_path),
+                content_md5=content_md5 or (hashlib.md5(data).digest() if data is not None
+                                        else self.file_md5(local_path)),
+                cache_control=cache_control
+            )
 
-            # Upload the file
-            with open(local_path, 'rb') as data:
+            # Upload the file (streamed from disk unless the caller already holds its bytes)
+            with self.histogram.time(), (nullcontext(data) if data is not None else open(local_path, 'rb')) as body:
                 blob_client.upload_blob(
-                    data,
+                    body,
                     overwrite=True,
-                    content_settings=content_settings
+                    content_settings=content_settings,
+                    max_concurrency=self.max_block_concurrency
                 )
 
+            size = len(data) if data is not None else local_path.stat().st_size
+            REGISTRY.inc('bytes_uploaded', size, backend=self.backend)
+            REGISTRY.inc('items', pipeline='upload', result='ok')
+            REGISTRY.log('item', pipeline='upload', blob=blob_name, ok=True)
             return True
         except Exception as e:
             print(f"❌ Error uploading {blob_name}: {e}")
+            REGISTRY.inc('items', pipeline='upload', result='failed')
+            REGISTRY.log('item', pipeline='upload', blob=blob_name, ok=False, error=str(e))
+            return False
+
+    def blob_name(self, relpath: str, sha256: Optional[str] = None) -> str:
+        """Published name of a local file: its relative path, or its fingerprinted name."""
+        if not self.fingerprint:
+            return relpath
+        if sha256:
+            return fingerprinted_name(relpath, sha256)
+        return fingerprint_file(self.base_dir, relpath)
+
+    def copy_blob(self, source_blob: str, blob_name: str, local_path: Optional[Path] = None,
+                  local_md5: Optional[bytes] = None) -> bool:
+        """Copy an existing blob server-side instead of re-sending identical bytes.
+
+        Counts only once the copy reports success; a failed, aborted or stuck copy
+        falls back to uploading local_path when one is given.
+        """
+        try:
+            source_client = self.blob_service_client.get_blob_client(
+                container=self.container_name,
+                blob=source_blob
+            )
+            blob_client = self.blob_service_client.get_blob_client(
+                container=self.container_name,
+                blob=blob_name
+            )
+            copy = blob_client.start_copy_from_url(source_client.url)
+            status = copy.get('copy_status')
+            deadline = time.monotonic() + COPY_TIMEOUT_SECONDS
+            while status == 'pending' and time.monotonic() < deadline:
+                time.sleep(COPY_POLL_SECONDS)
+                status = blob_client.get_blob_properties().copy.status
+            if status == 'pending':
+                blob_client.abort_copy(copy['copy_id'])
+            if status == 'success':
+                return True
+            print(f"⚠️  Copy of {source_blob} to {blob_name} ended {status}")
+        except Exception as e:
+            print(f"❌ Error copying {source_blob} to {blob_name}: {e}")
+
+        if local_path is None:
             return False
+        return self.upload_image(local_path, blob_name, local_md5, self.cache_control)
+
+    def collect_local_images(self, force: bool = False) -> Tuple[List[Tuple[Path, str, str, bool]], int]:
+        """Return (local_path, blob_name, owning slot, is original) for files to consider, plus the
+        count already published."""
+        images = []
+        published = 0
+
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
+
+        for asset in self.config['assets']:
+            folder = asset['folder']
+            entries = self.manifest.entries(folder)
+
+            if len(entries) < asset['images_per_asset']:
+                print(f"  ⚠️  {folder}: only {len(entries)}/{asset['images_per_asset']} images")
+
+            for slot, entry in entries:
+                if not force and self.manifest.is_uploaded(slot, self.backend):
+                    published += 1
+                    continue
+
+                # Blob name includes folder structure
+                images.append((self.base_dir / slot, self.blob_name(slot, entry['sha256']), slot, True))
 
-    def upload_all_images(self):
-        """Upload all images to Azure Blob Storage."""
+                # Responsive variants keep their relative path as the blob name
+                for relpath in entry['variants']:
+                    images.append((self.base_dir / relpath, self.blob_name(relpath), slot, False))
+
+        return images, published
+
+    def upload_all_images(self, force: bool = False):
+        """Upload new and changed images to Azure Blob Storage concurrently."""
         print("☁️  Starting Azure Blob Storage upload...")
         print(f"📦 Storage Account: {self.storage_account_name}")
         print(f"📁 Container: {self.container_name}")
@@ -74,52 +238,91 @@ class AzureBlobUploader:
         # Ensure container exists
         self.create_container_if_not_exists()
 
-        total_uploaded = 0
+        images, total_unchanged = self.collect_local_images(force)
         total_skipped = 0
 
-        for asset in self.config['assets']:
-            folder = asset['folder']
-            images_per_asset = asset['images_per_asset']
-
-            print(f"\n{'='*60}")
-            print(f"📁 Uploading: {folder.upper()}")
-            print(f"{'='*60}")
-
-            asset_folder = self.base_dir / folder
+        # The manifest already vouches for published slots; only list the
+        # container when something might need uploading.
+        remote_md5s = {} if force or not images else self.list_remote_md5s()
+
+        # Identical content (e.g. slots filled from the content store) only crosses
+        # the network once; other blobs with the same MD5 are copied server-side.
+        sources_by_md5 = {md5: name for name, md5 in remote_md5s.items()}
+
+        # A slot counts as published only once its original and every variant are in place
+        slots = {slot for _, _, slot, _ in images}
+        failed_slots = set()
+
+        pending = []
+        copies = []
+        for local_path, blob_name, slot, original in images:
+            local_md5 = self.file_md5(local_path)
+            if remote_md5s.get(blob_name) == local_md5:
+                total_unchanged += original
+                continue
+            if local_md5 in sources_by_md5:
+                copies.append((sources_by_md5[local_md5], blob_name, slot, local_path, local_md5))
+                continue
+            sources_by_md5[local_md5] = blob_name
+            pending.append((local_path, blob_name, local_md5, slot))
 
-            # Upload each image
-            for i in range(1, images_per_asset + 1):
-                image_filename = f"{folder}-{i}.jpg"
-                local_path = asset_folder / image_filename
+        print(f"\n{'='*60}")
+        print(f"📤 Uploading {len(pending)} changed images ({total_unchanged} unchanged, "
+              f"{len(copies)} server-side copies) with {self.upload_workers} workers")
+        print(f"{'='*60}")
 
-                if not local_path.exists():
-                    print(f"  ⚠️  Skipped: {image_filename} (file not found)")
+        total_uploaded = 0
+        with REGISTRY.stage('upload', 'images'), ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            futures = {}
+            for local_path, blob_name, local_md5, slot in pending:
+                self.journal.record(blob_name, 'upload', 'running', md5=local_md5.hex())
+                future = executor.submit(self.upload_image, local_path, blob_name, local_md5, self.cache_control)
+                futures[future] = (blob_name, slot)
+
+            for future in as_completed(futures):
+                blob_name, slot = futures[future]
+                success = future.result()
+                self.journal.record(blob_name, 'upload', 'done' if success else 'failed')
+                if success:
+                    print(f"  ☁️  Uploaded: {blob_name} ✅")
+                    total_uploaded += 1
+                else:
+                    failed_slots.add(slot)
                     total_skipped += 1
-                    continue
 
-                # Blob name includes folder structure
-                blob_name = f"{folder}/{image_filename}"
+            # Copies run after the uploads so every source blob exists
+            futures = {
+                executor.submit(self.copy_blob, source_blob, blob_name, local_path, local_md5): (blob_name, slot)
+                for source_blob, blob_name, slot, local_path, local_md5 in copies
+            }
 
-                print(f"  ☁️  Uploading: {blob_name}...", end=" ")
-
-                if self.upload_image(local_path, blob_name):
-                    print("✅ Done")
+            for future in as_completed(futures):
+                blob_name, slot = futures[future]
+                if future.result():
+                    print(f"  ♻️  Copied: {blob_name} ✅")
                     total_uploaded += 1
                 else:
+                    failed_slots.add(slot)
                     total_skipped += 1
 
+        for slot in slots - failed_slots:
+            self.manifest.mark_uploaded(slot, self.backend)
+        self.manifest.save()
+
         print(f"\n{'='*60}")
         print(f"✨ Upload Complete!")
         print(f"📤 Uploaded: {total_uploaded} images")
+        print(f"♻️  Unchanged: {total_unchanged} images")
         print(f"⏭️  Skipped: {total_skipped} images")
         print(f"{'='*60}")
+        print_histograms([self.histogram])
 
         # Generate and display URLs
         self.display_access_urls()
 
     def display_access_urls(self):
         """Display the static website URL for accessing images."""
-        base_url = f"https://{self.storage_account_name}.z6.web.core.windows.net"
+        base_url = self.base_url
 
         print(f"\n🌐 Your images are now available at:")
         print(f"   {base_url}/")
@@ -134,21 +337,9 @@ class AzureBlobUploader:
 
     def generate_url_mapping(self) -> Dict:
         """Generate complete URL mapping for all images."""
-        url_mapping = {}
-        base_url = f"https://{self.storage_account_name}.z6.web.core.windows.net"
-
-        for asset in self.config['assets']:
-            asset_name = asset['name']
-            folder = asset['folder']
-            images_per_asset = asset['images_per_asset']
-
-            asset_urls = []
-            for i in range(1, images_per_asset + 1):
-                image_filename = f"{folder}-{i}.jpg"
-                url = f"{base_url}/{folder}/{image_filename}"
-                asset_urls.append(url)
-
-            url_mapping[asset_name] = asset_urls
+        # List the files that actually exist, not an assumed 1..N numbering
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
+        url_mapping = build_url_mapping(self.base_dir, self.config, self.manifest, self.base_url, self.fingerprint)
 
         # Save to JSON file
         output_path = self.base_dir / 'image-urls.json'
@@ -160,17 +351,56 @@ class AzureBlobUploader:
 
         return url_mapping
 
+    def publish_catalog(self) -> Dict:
+        """Write the sharded URL catalog and upload whichever of its files the container lacks."""
+        base_url = self.base_url
+        index, _ = write_catalog(self.base_dir, self.config, self.manifest, base_url, 'azure', self.fingerprint)
+
+        files = catalog_files(index, 'azure')
+        remote_md5s = self.list_remote_md5s(prefix=files[-1].rsplit('/', 1)[0] + '/')
+
+        # Shards go first so the index never points at a missing shard
+        uploaded = 0
+        with REGISTRY.stage('upload', 'catalog'):
+            for relpath in files:
+                local_path = self.base_dir / relpath
+                local_md5 = self.file_md5(local_path)
+                if remote_md5s.get(relpath) == local_md5:
+                    continue
+                cache_control = INDEX_CACHE_CONTROL if relpath.endswith(INDEX_FILE) else IMMUTABLE_CACHE_CONTROL
+                if not self.upload_image(local_path, relpath, local_md5, cache_control=cache_control):
+                    break
+                uploaded += 1
 
-def main():
-    """Main entry point."""
-    try:
-        uploader = AzureBlobUploader()
+        print(f"🗂️  Catalog v{index['version']}: {uploaded} files uploaded")
+        print(f"   {base_url}/{files[-1]}")
+        return index
 
-        # Upload all images
-        uploader.upload_all_images()
 
-        # Generate URL mapping
-        uploader.generate_url_mapping()
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Upload trading images to Azure Blob Storage")
+    parser.add_argument('--fingerprint', action='store_true', default=None,
+                        help="publish under content-hashed names with immutable Cache-Control "
+                             "(default: azure.fingerprint in config.json)")
+    parser.add_argument('--urls-only', action='store_true',
+                        help="only regenerate image-urls.json, without connecting to Azure")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        with instrumented(args, 'upload'):
+            uploader = AzureBlobUploader(fingerprint=args.fingerprint)
+            if args.urls_only:
+                uploader.generate_url_mapping()
+                return 0
+
+            # Upload all images
+            uploader.upload_all_images()
+
+            # Generate URL mapping
+            uploader.generate_url_mapping()
+            uploader.publish_catalog()
 
     except Exception as e:
         print(f"❌ Error: {e}")
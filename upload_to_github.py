@@ -6,27 +6,41 @@ Commits and pushes images to GitHub repository with proper URLs.
 
 import os
 import json
+import zlib
+import hashlib
+import argparse
 import subprocess
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+from catalog import CATALOG_DIR, write_catalog
+from config import load_config
+from manifest import Manifest
+from metrics import REGISTRY, add_instrumentation_args, instrumented
+from optimize_images import VARIANTS_DIR
 
 class GitHubUploader:
-    def __init__(self, config_path: str = "config.json"):
+    def __init__(self, config_path: Optional[str] = None, base_dir: Optional[Path] = None,
+                 remote: str = "origin"):
         """Initialize GitHub uploader with configuration."""
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+        self.config = load_config(config_path)
 
-        self.base_dir = Path(__file__).parent
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.manifest = Manifest(self.base_dir)
         self.github_user = "oded-be-z"
         self.repo_name = "n8n-trading-images"
         self.branch = "main"
+        self.remote = remote
+        self.base_url = f"https://raw.githubusercontent.com/{self.github_user}/{self.repo_name}/{self.branch}"
 
-    def git_command(self, command: list) -> tuple:
+    def git_command(self, command: list, input: Optional[str] = None, env: Optional[Dict] = None) -> tuple:
         """Execute git command."""
         try:
             result = subprocess.run(
                 command,
                 cwd=self.base_dir,
+                input=input,
+                env=env,
                 capture_output=True,
                 text=True,
                 check=True
@@ -35,82 +49,202 @@ class GitHubUploader:
         except subprocess.CalledProcessError as e:
             return False, e.stderr
 
-    def check_git_status(self):
-        """Check current git status."""
-        success, output = self.git_command(['git', 'status', '--porcelain'])
-        if success:
-            if output.strip():
-                print(f"📝 Git status:\n{output}")
-                return True
-            else:
-                print("✓ No changes to commit")
-                return False
-        else:
-            print(f"❌ Error checking git status: {output}")
-            return False
+    def changed_paths(self) -> Tuple[List[str], List[str]]:
+        """Return (slots to publish, every file path to write into the commit) from the manifest.
+
+        Slots whose current content is already on GitHub are left out, so only new
+        or replaced images (and their variants) are hashed into git.
+        """
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']], full=True)
 
-    def commit_and_push(self):
-        """Commit all changes and push to GitHub."""
+        slots = []
+        paths = []
+        for asset in self.config['assets']:
+            for slot, entry in self.manifest.entries(asset['folder']):
+                if not self.manifest.is_uploaded(slot, 'github'):
+                    slots.append(slot)
+                    paths.append(slot)
+                    paths.extend(entry['variants'])
+
+        return slots, [path for path in paths + self.generated_paths() if (self.base_dir / path).is_file()]
+
+    def generated_paths(self) -> List[str]:
+        """The URL mapping and catalog files; small, and unchanged ones hash to blobs already in the tree."""
+        paths = ['image-urls.json']
+        catalog_dir = self.base_dir / CATALOG_DIR / 'github'
+        if catalog_dir.is_dir():
+            paths.extend(f"{CATALOG_DIR}/github/{path.name}" for path in sorted(catalog_dir.glob("*.json")))
+        return [path for path in paths if (self.base_dir / path).is_file()]
+
+    def write_blob(self, data: bytes) -> str:
+        """Store bytes as a loose git blob without spawning git. Returns the blob id."""
+        if not hasattr(self, '_objects_dir'):
+            _, git_dir = self.git_command(['git', 'rev-parse', '--absolute-git-dir'])
+            self._objects_dir = Path(git_dir.strip()) / 'objects'
+
+        raw = f"blob {len(data)}\0".encode('ascii') + data
+        blob = hashlib.sha1(raw).hexdigest()
+        path = self._objects_dir / blob[:2] / blob[2:]
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f"tmp_{blob[2:]}_{os.getpid()}_{id(data)}")
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(raw, 1))
+            os.replace(tmp_path, path)
+        return blob
+
+    def removed_paths(self, parent: Optional[str]) -> List[str]:
+        """Published files under the library's folders that no longer exist locally."""
+        if not parent:
+            return []
+        folders = [asset['folder'] for asset in self.config['assets']]
+        folders += [f"{VARIANTS_DIR}/{folder}" for folder in folders] + [f"{CATALOG_DIR}/github"]
+        success, output = self.git_command(['git', 'ls-tree', '-r', '--name-only', parent, '--', *folders])
+        if not success:
+            return []
+        return [path for path in output.splitlines() if not (self.base_dir / path).exists()]
+
+    def commit_and_push(self, blobs: Optional[Dict[str, str]] = None, slots: Optional[List[str]] = None):
+        """Commit only the changed images with git plumbing and push them to GitHub.
+
+        Blobs are written with one batched hash-object call and the commit is built
+        from the branch's tree in a private index, so the working tree is never
+        scanned and nothing outside the library can be staged by accident. A caller
+        that already wrote blobs (path -> blob id, see write_blob) passes them with
+        the slots they publish, and only the generated files are hashed here.
+        """
         print("\n" + "="*60)
         print("📤 Committing and pushing to GitHub...")
         print("="*60)
 
-        # Check if there are changes
-        if not self.check_git_status():
+        if blobs is None:
+            slots, paths = self.changed_paths()
+            blobs = {}
+        else:
+            slots, paths = slots or [], self.generated_paths()
+        success, parent = self.git_command(['git', 'rev-parse', '--verify', '-q', f'refs/heads/{self.branch}'])
+        parent = parent.strip() if success else None
+        removed = self.removed_paths(parent)
+        if not paths and not blobs and not removed:
             print("✓ Repository is up to date")
             return True
 
-        # Add all files
-        print("\n📝 Adding files to git...")
-        success, output = self.git_command(['git', 'add', '.'])
-        if not success:
-            print(f"❌ Error adding files: {output}")
-            return False
-        print("✅ Files added")
+        # Write every changed file as a blob in one process
+        if paths:
+            success, output = self.git_command(['git', 'hash-object', '-w', '--stdin-paths'],
+                                               input="\n".join(paths) + "\n")
+            if not success:
+                print(f"❌ Error hashing files: {output}")
+                return False
+            # Blobs the caller wrote win over the files on disk with the same path
+            blobs = {**dict(zip(paths, output.split())), **blobs}
+        paths = list(blobs)
+
+        index_info = [f"100644 {blob}\t{path}" for path, blob in blobs.items()]
+        index_info += [f"0 {'0' * 40}\t{path}" for path in removed]
+
+        # Build the new tree from the branch tip in a private index; only the touched
+        # folders' subtrees are rewritten
+        success, git_dir = self.git_command(['git', 'rev-parse', '--absolute-git-dir'])
+        index_file = Path(git_dir.strip()) / 'publish-index'
+        env = {**os.environ, 'GIT_INDEX_FILE': str(index_file)}
+        try:
+            steps = [
+                (['git', 'read-tree', parent] if parent else ['git', 'read-tree', '--empty'], None),
+                (['git', 'update-index', '--index-info'], "\n".join(index_info) + "\n"),
+                (['git', 'write-tree'], None),
+            ]
+            for command, stdin in steps:
+                success, output = self.git_command(command, input=stdin, env=env)
+                if not success:
+                    print(f"❌ Error building tree ({command[1]}): {output}")
+                    return False
+            tree = output.strip()
+        finally:
+            index_file.unlink(missing_ok=True)
+
+        if parent:
+            _, parent_tree = self.git_command(['git', 'rev-parse', f'{parent}^{{tree}}'])
+            if parent_tree.strip() == tree:
+                print("✓ Repository is up to date")
+                self._mark_published(slots)
+                return True
 
         # Commit
         print("\n💾 Creating commit...")
-        commit_message = "Add n8n trading images library with 40 professional images"
-        success, output = self.git_command(['git', 'commit', '-m', commit_message])
+        changes = []
+        if slots:
+            changed_assets = sorted({slot.split('/', 1)[0] for slot in slots})
+            changes.append(f"publish {len(slots)} images ({', '.join(changed_assets)})")
+        if removed:
+            changes.append(f"remove {len(removed)} files")
+        commit_message = (", ".join(changes) or "update image URL catalog").capitalize()
+        command = ['git', 'commit-tree', tree, '-m', commit_message]
+        if parent:
+            command += ['-p', parent]
+        success, output = self.git_command(command)
         if not success:
-            if "nothing to commit" in output:
-                print("✓ Nothing to commit, working tree clean")
-            else:
-                print(f"❌ Error committing: {output}")
-                return False
-        else:
-            print(f"✅ Commit created: {commit_message}")
+            print(f"❌ Error committing: {output}")
+            return False
+        commit = output.strip()
+
+        success, output = self.git_command(['git', 'update-ref', f'refs/heads/{self.branch}', commit, parent or ''])
+        if not success:
+            print(f"❌ Error updating {self.branch}: {output}")
+            return False
+        print(f"✅ Commit created: {commit_message}")
+
+        # If the branch is checked out, resync the real index for just the published paths
+        success, head = self.git_command(['git', 'symbolic-ref', '-q', 'HEAD'])
+        if success and head.strip() == f'refs/heads/{self.branch}':
+            self.git_command(['git', 'reset', '-q', '--pathspec-from-file=-'],
+                             input="\n".join(paths + removed) + "\n")
 
         # Push to GitHub
         print("\n🚀 Pushing to GitHub...")
-        success, output = self.git_command(['git', 'push', 'origin', self.branch])
+        with REGISTRY.histogram('stage_seconds', pipeline='upload', stage='git_push').time():
+            success, output = self.git_command(['git', 'push', self.remote, f'{commit}:refs/heads/{self.branch}'])
         if not success:
             print(f"❌ Error pushing: {output}")
+            REGISTRY.inc('items', len(slots), pipeline='upload', result='failed')
             return False
 
         print("✅ Successfully pushed to GitHub!")
+        REGISTRY.inc('items', len(slots), pipeline='upload', result='ok')
+        REGISTRY.inc('bytes_uploaded', sum((self.base_dir / path).stat().st_size for path in paths
+                                           if (self.base_dir / path).is_file()),
+                     backend='github')
+        REGISTRY.log('git_push', pipeline='upload', commit=commit, files=len(paths), removed=len(removed))
+        self._mark_published(slots)
         return True
 
+    def _mark_published(self, slots: List[str]):
+        for slot in slots:
+            self.manifest.mark_uploaded(slot, 'github')
+        self.manifest.save()
+
     def generate_github_urls(self) -> Dict:
         """Generate GitHub raw URLs for all images."""
         url_mapping = {}
 
         # Base URL for raw GitHub content
-        base_url = f"https://raw.githubusercontent.com/{self.github_user}/{self.repo_name}/{self.branch}"
+        base_url = self.base_url
 
         print("\n" + "="*60)
         print("🔗 Generating GitHub URLs...")
         print("="*60)
 
+        # List the files that actually exist, not an assumed 1..N numbering
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']], full=True)
+        self.manifest.save()
+
         for asset in self.config['assets']:
             asset_name = asset['name']
             folder = asset['folder']
-            images_per_asset = asset['images_per_asset']
 
             asset_urls = []
-            for i in range(1, images_per_asset + 1):
-                image_filename = f"{folder}-{i}.jpg"
-                url = f"{base_url}/{folder}/{image_filename}"
+            for slot, _ in self.manifest.entries(folder):
+                url = f"{base_url}/{slot}"
                 asset_urls.append(url)
 
             url_mapping[asset_name] = asset_urls
@@ -122,11 +256,14 @@ class GitHubUploader:
             json.dump(url_mapping, f, indent=2)
 
         print(f"\n📄 Generated: image-urls.json")
+
+        index, _ = write_catalog(self.base_dir, self.config, self.manifest, base_url, 'github')
+        print(f"🗂️  Catalog v{index['version']}: {base_url}/catalog/github/index.json")
         return url_mapping
 
     def display_urls(self):
         """Display example URLs for accessing images."""
-        base_url = f"https://raw.githubusercontent.com/{self.github_user}/{self.repo_name}/{self.branch}"
+        base_url = self.base_url
 
         print(f"\n🌐 Your images are now available at:")
         print(f"   {base_url}/[asset]/[filename].jpg")
@@ -145,19 +282,26 @@ class GitHubUploader:
         print(f"\n📄 All URLs saved in: image-urls.json")
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     """Main entry point."""
+    parser = argparse.ArgumentParser(description="Publish trading images to GitHub")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
+
     try:
-        uploader = GitHubUploader()
+        with instrumented(args, 'upload'):
+            uploader = GitHubUploader()
+
+            # Generate GitHub URLs first so the mapping and catalog ship in the same push
+            uploader.generate_github_urls()
 
-        # Commit and push to GitHub
-        if not uploader.commit_and_push():
+            # Commit and push to GitHub
+            with REGISTRY.stage('upload', 'git'):
+                pushed = uploader.commit_and_push()
+        if not pushed:
             print("\n❌ Upload failed!")
             return 1
 
-        # Generate GitHub URLs
-        uploader.generate_github_urls()
-
         # Display URLs
         uploader.display_urls()
 
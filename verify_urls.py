@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Published URL Verifier
+Checks that every published URL serves the bytes in the local library: concurrent HEAD
+(or one-byte ranged GET) requests, bounded per host, compared on status, content type,
+length and ETag/Content-MD5. Reports cold-cache latency and can warm CDN edges.
+"""
+
+import json
+import time
+import base64
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from catalog import CATALOG_DIR, INDEX_FILE, fingerprint_file, fingerprinted_name
+from config import load_config
+from http_client import create_session
+from manifest import Manifest
+from metrics import REGISTRY, add_instrumentation_args, instrumented, print_histograms
+from optimize_images import content_type
+
+METHODS = ('head', 'range')
+
+# Headers CDNs use to say whether the edge already held the object
+CACHE_STATUS_HEADERS = ('x-cache', 'cf-cache-status', 'x-cache-status', 'cdn-cache')
+
+# Hex ETag length -> digest of the local file it is compared with
+ETAG_DIGESTS = {32: 'md5', 40: 'git_sha1', 64: 'sha256'}
+
+
+def file_digests(path: Path) -> Dict[str, str]:
+    """MD5, git blob SHA-1 and SHA-256 of a file: what the backends' ETags are made of."""
+    data = path.read_bytes()
+    git_blob = hashlib.sha1(f"blob {len(data)}\0".encode('ascii'))
+    git_blob.update(data)
+    return {
+        'md5': hashlib.md5(data).hexdigest(),
+        'git_sha1': git_blob.hexdigest(),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+
+
+def mapping_urls(mapping: Dict) -> List[str]:
+    """Every URL in an image-urls.json mapping, originals and variants."""
+    urls = []
+    for asset, value in mapping.items():
+        if asset != 'variants':
+            urls.extend(value)
+            continue
+        for images in value.values():
+            for by_format in images:
+                for by_width in by_format.values():
+                    urls.extend(by_width.values())
+    return urls
+
+
+def catalog_urls(base_dir: Path, name: str) -> List[str]:
+    """Every URL a catalog exposes: the index, its shards and their images and variants."""
+    catalog_dir = Path(base_dir) / CATALOG_DIR / name
+    with open(catalog_dir / INDEX_FILE, 'r') as f:
+        index = json.load(f)
+
+    urls = [f"{index['base_url']}/{CATALOG_DIR}/{name}/{INDEX_FILE}"]
+    for entry in index['assets'].values():
+        urls.append(entry['url'])
+        with open(catalog_dir / entry['shard'], 'r') as f:
+            shard = json.load(f)
+        for image in shard['images']:
+            urls.append(image['url'])
+            for by_width in image.get('variants', {}).values():
+                urls.extend(by_width.values())
+    return urls
+
+
+class LibraryIndex:
+    def __init__(self, base_dir: Path, config: Dict, manifest: Manifest):
+        """Published name -> local relpath for every image, variant and catalog file."""
+        self.base_dir = Path(base_dir)
+        self.names: Dict[str, str] = {}
+        self.variants: List[str] = []
+        self._variants_fingerprinted = False
+
+        for asset in config['assets']:
+            for slot, entry in manifest.entries(asset['folder']):
+                self.names[slot] = slot
+                self.names[fingerprinted_name(slot, entry['sha256'])] = slot
+                for relpath in entry.get('variants', []):
+                    self.names[relpath] = relpath
+                    self.variants.append(relpath)
+        for path in (self.base_dir / CATALOG_DIR).glob('*/*.json'):
+            relpath = path.relative_to(self.base_dir).as_posix()
+            self.names[relpath] = relpath
+
+    def _lookup(self, parts: List[str]) -> Optional[str]:
+        for i in range(len(parts)):
+            relpath = self.names.get('/'.join(parts[i:]))
+            if relpath:
+                return relpath
+        return None
+
+    def resolve(self, url: str) -> Optional[str]:
+        """The local file a URL should serve (matched on the URL path's tail), or None."""
+        parts = urlsplit(url).path.strip('/').split('/')
+        relpath = self._lookup(parts)
+        if relpath is None and not self._variants_fingerprinted:
+            # Fingerprinted variant names need their files hashed; only done when one shows up
+            self._variants_fingerprinted = True
+            for variant in self.variants:
+                if (self.base_dir / variant).exists():
+                    self.names[fingerprint_file(self.base_dir, variant)] = variant
+            relpath = self._lookup(parts)
+        return relpath
+
+
+class UrlVerifier:
+    def __init__(self, config_path: Optional[str] = None, base_dir: Optional[Path] = None,
+                 method: Optional[str] = None, session: Optional[requests.Session] = None):
+        """Verify published URLs against the local library."""
+        self.config = load_config(config_path)
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+
+        settings = self.config.get('verify', {})
+        self.method = method or settings.get('method', 'head')
+        if self.method not in METHODS:
+            raise ValueError(f"unknown method {self.method!r} (choose from {', '.join(METHODS)})")
+        self.workers = settings.get('workers', 32)
+        self.per_host = settings.get('per_host', 8)
+        self.session = session or create_session(retries=2, backoff_factor=0.5, pool_maxsize=self.per_host,
+                                                  timeout=(5.0, settings.get('timeout_seconds', 10)))
+
+        self.manifest = Manifest(self.base_dir)
+        self.manifest.sync([asset['folder'] for asset in self.config['assets']])
+        self.library = LibraryIndex(self.base_dir, self.config, self.manifest)
+
+        self.histograms = {
+            'cold': REGISTRY.histogram('verify_seconds', stage='cold'),
+            'warm': REGISTRY.histogram('verify_seconds', stage='warm'),
+        }
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._hosts_lock = threading.Lock()
+        self._digests: Dict[str, Dict[str, str]] = {}
+        self._digests_lock = threading.Lock()
+
+    def host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """The semaphore that caps concurrent requests to a URL's host."""
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def digests(self, relpath: str) -> Dict[str, str]:
+        with self._digests_lock:
+            cached = self._digests.get(relpath)
+        if cached is None:
+            cached = file_digests(self.base_dir / relpath)
+            with self._digests_lock:
+                self._digests[relpath] = cached
+        return cached
+
+    def probe(self, url: str) -> requests.Response:
+        """One HEAD or one-byte ranged GET; the body is never downloaded."""
+        with self.host_slot(url):
+            if self.method == 'head':
+                return self.session.head(url, allow_redirects=True)
+            response = self.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True)
+            response.close()
+            return response
+
+    def warm(self, url: str) -> requests.Response:
+        """Fetch the whole object so the CDN edge that served it caches it."""
+        with self.host_slot(url):
+            response = self.session.get(url, stream=True)
+            for _ in response.iter_content(chunk_size=64 * 1024):
+                pass
+            response.close()
+            return response
+
+    @staticmethod
+    def cache_status(response: requests.Response) -> Optional[str]:
+        for header in CACHE_STATUS_HEADERS:
+            if header in response.headers:
+                return response.headers[header]
+        return None
+
+    def compare(self, response: requests.Response, relpath: str) -> List[str]:
+        """What differs between a response's headers and the local file."""
+        problems = []
+        expected_type = content_type(Path(relpath))
+        served_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        # raw.githubusercontent.com serves every text file, catalogs included, as text/plain
+        text_ok = not expected_type.startswith('image/') and served_type == 'text/plain'
+        if served_type != expected_type and not text_ok:
+            problems.append(f"content type {served_type or 'missing'}, expected {expected_type}")
+
+        size = (self.base_dir / relpath).stat().st_size
+        length = response.headers.get('Content-Length')
+        if response.status_code == 206:
+            length = response.headers.get('Content-Range', '').rpartition('/')[2]
+        if length and length != '*' and int(length) != size:
+            problems.append(f"length {length}, expected {size}")
+
+        digests = self.digests(relpath)
+        content_md5 = response.headers.get('Content-MD5')
+        if content_md5 and base64.b64decode(content_md5).hex() != digests['md5']:
+            problems.append("Content-MD5 does not match the local file")
+
+        etag = response.headers.get('ETag', '').removeprefix('W/').strip('"').lower()
+        digest = ETAG_DIGESTS.get(len(etag))
+        if digest and all(c in '0123456789abcdef' for c in etag) and etag != digests[digest]:
+            problems.append(f"ETag does not match the local file's {digest}")
+        return problems
+
+    def check(self, url: str, relpath: Optional[str], warm: bool = False) -> Dict:
+        """Verify one URL; with warm, also pull it through the CDN and time it again."""
+        result = {'url': url, 'relpath': relpath, 'problems': []}
+        try:
+            response = self.probe(url)
+        except requests.RequestException as e:
+            result['problems'].append(f"request failed: {type(e).__name__}")
+            return result
+
+        result['status'] = response.status_code
+        result['cold_seconds'] = round(response.elapsed.total_seconds(), 4)
+        result['cache'] = self.cache_status(response)
+        self.histograms['cold'].observe(response.elapsed.total_seconds())
+
+        if response.status_code not in (200, 206):
+            result['problems'].append(f"HTTP {response.status_code}")
+        elif relpath is None:
+            result['problems'].append("not in the local library")
+        else:
+            result['problems'].extend(self.compare(response, relpath))
+
+        if warm and not result['problems']:
+            try:
+                self.warm(url)
+                response = self.probe(url)
+            except requests.RequestException as e:
+                result['problems'].append(f"warm-up failed: {type(e).__name__}")
+                return result
+            result['warm_seconds'] = round(response.elapsed.total_seconds(), 4)
+            result['warm_cache'] = self.cache_status(response)
+            self.histograms['warm'].observe(response.elapsed.total_seconds())
+        return result
+
+    def verify(self, urls: List[str], warm: bool = False) -> List[Dict]:
+        """Check every URL concurrently (at most per_host at a time to any one host)."""
+        urls = list(dict.fromkeys(urls))
+        targets = [(url, self.library.resolve(url)) for url in urls]
+        hosts = {urlsplit(url).netloc for url in urls}
+        print(f"🔎 Verifying {len(urls)} URLs on {len(hosts)} host(s) with {self.method.upper()} "
+              f"({self.per_host} per host){', warming edges' if warm else ''}...")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(lambda target: self.check(*target, warm=warm), targets))
+        seconds = time.perf_counter() - started
+
+        for result in results:
+            REGISTRY.inc('items', pipeline='verify', result='failed' if result['problems'] else 'ok')
+        REGISTRY.log('verify', urls=len(results), failed=sum(1 for result in results if result['problems']),
+                     seconds=round(seconds, 3), cold_p50=round(self.histograms['cold'].percentile(50), 4))
+        self.print_report(results, seconds)
+        return results
+
+    def print_report(self, results: List[Dict], seconds: float):
+        failed = [result for result in results if result['problems']]
+        print(f"\n{'='*60}")
+        print(f"✅ {len(results) - len(failed)} OK   ❌ {len(failed)} failed   ({seconds:.2f}s)")
+        for result in failed[:50]:
+            print(f"  ❌ {result['url']}: {'; '.join(result['problems'])}")
+        if len(failed) > 50:
+            print(f"  ... and {len(failed) - 50} more")
+
+        cached = [result['cache'] for result in results if result.get('cache')]
+        if cached:
+            hits = sum(1 for status in cached if 'HIT' in status.upper())
+            print(f"🌐 Edge cache on first request: {hits}/{len(cached)} hits")
+        warmed = [result['warm_cache'] for result in results if result.get('warm_cache')]
+        if warmed:
+            hits = sum(1 for status in warmed if 'HIT' in status.upper())
+            print(f"🔥 Edge cache after warm-up: {hits}/{len(warmed)} hits")
+        print_histograms(self.histograms.values())
+        print(f"{'='*60}")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Verify that every published image URL resolves")
+    parser.add_argument('--catalog', metavar='NAME', action='append',
+                        help="verify everything in catalog/NAME/ (repeatable), e.g. azure or github")
+    parser.add_argument('--mapping', metavar='PATH', action='append',
+                        help="verify every URL in a mapping file (default: image-urls.json)")
+    parser.add_argument('--method', choices=METHODS, help="HEAD, or a one-byte ranged GET for CDNs that "
+                                                          "mishandle HEAD (default: verify.method)")
+    parser.add_argument('--warm', action='store_true', help="fetch every good URL in full to warm CDN edges")
+    parser.add_argument('--report', metavar='PATH', help="write every result as JSON")
+    add_instrumentation_args(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        with instrumented(args, 'verify'):
+            verifier = UrlVerifier(method=args.method)
+
+            urls = []
+            for name in args.catalog or []:
+                urls.extend(catalog_urls(verifier.base_dir, name))
+            for path in args.mapping or ([] if args.catalog else ['image-urls.json']):
+                with open(verifier.base_dir / path, 'r') as f:
+                    urls.extend(mapping_urls(json.load(f)))
+
+            results = verifier.verify(urls, warm=args.warm)
+            if args.report:
+                with open(args.report, 'w') as f:
+                    json.dump({'checked': len(results), 'failed': sum(1 for r in results if r['problems']),
+                               'results': results}, f, indent=2)
+                print(f"📄 Report saved to {args.report}")
+            if any(result['problems'] for result in results):
+                return 1
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,690 @@
+#!/usr/bin/env python3
+"""
+Library Work Queue
+Durable task queue (SQLite by default) for building the library with many worker processes:
+workers on one or more hosts claim fetch, generate, optimize and upload tasks under leases,
+retry failures with backoff, and share the API rate limits through the queue itself.
+"""
+
+import os
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Mapping, Optional
+from urllib.parse import urlsplit
+
+from config import load_config
+from dalle_scheduler import GenerationDeferred, pacing, request_cost
+from fetch_images import TradingImagesFetcher
+from generate_with_dalle import DEFAULT_OPTIONS, IMAGE_URL_TTL, DalleImageGenerator
+from image_store import ContentStore
+from manifest import Manifest
+from metrics import REGISTRY, add_instrumentation_args, instrumented
+from optimize_images import ImageOptimizer, optimize_image, variant_relpath
+
+DEFAULT_QUEUE = "sqlite:///.queue/work.db"
+KINDS = ('fetch', 'generate', 'optimize', 'upload')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    checkpoint TEXT,
+    result TEXT,
+    error TEXT,
+    merged INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    UNIQUE (kind, key)
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (state, kind, not_before);
+CREATE TABLE IF NOT EXISTS claims (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS limits (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    capacity REAL NOT NULL,
+    period REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter: ~5s, 10s, 20s ... capped at 5 minutes."""
+    return min(300.0, 5.0 * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+
+class SQLiteQueue:
+    """Queue backend on a local SQLite database in WAL mode.
+
+    Backends provide enqueue/claim/heartbeat/checkpoint/complete/fail, the claim_key
+    registry and take_tokens for shared rate limits; see BACKENDS to add another
+    (e.g. a network database so workers on several hosts share one queue).
+    """
+
+    def __init__(self, path: Path, lease_seconds: float = 120.0, max_attempts: int = 5):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self.db.executescript(_SCHEMA)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite connections can't be shared between threads."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run a block under SQLite's write lock, so concurrent claims never collide."""
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def enqueue(self, kind: str, key: str, payload: Dict, requeue_finished: bool = True) -> bool:
+        """Add a task (one per kind+key). Finished or dead tasks are reset; pending ones are left alone."""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT state FROM tasks WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            if row is None:
+                db.execute("INSERT INTO tasks (kind, key, payload, max_attempts, updated) VALUES (?, ?, ?, ?, ?)",
+                           (kind, key, json.dumps(payload), self.max_attempts, now))
+                return True
+            if requeue_finished and row['state'] in ('done', 'dead'):
+                db.execute("UPDATE tasks SET payload = ?, state = 'queued', attempts = 0, not_before = 0, "
+                           "lease_owner = NULL, lease_until = NULL, checkpoint = NULL, result = NULL, "
+                           "error = NULL, merged = 0, updated = ? WHERE kind = ? AND key = ?",
+                           (json.dumps(payload), now, kind, key))
+                return True
+        return False
+
+    def claim(self, owner: str, kinds: List[str]) -> Optional[Dict]:
+        """Lease the oldest runnable task of the given kinds, or return None.
+
+        A task is runnable when queued or deferred and past its not_before, or when its
+        lease has expired (its worker died). Tasks out of attempts are marked dead instead.
+        """
+        now = time.time()
+        marks = ",".join("?" * len(kinds))
+        with self.transaction() as db:
+            while True:
+                row = db.execute(
+                    f"SELECT * FROM tasks WHERE kind IN ({marks}) AND "
+                    f"((state IN ('queued', 'deferred') AND not_before <= ?) OR (state = 'leased' AND lease_until < ?)) "
+                    f"ORDER BY id LIMIT 1", (*kinds, now, now)).fetchone()
+                if row is None:
+                    return None
+                if row['attempts'] >= row['max_attempts']:
+                    db.execute("UPDATE tasks SET state = 'dead', lease_owner = NULL, updated = ?, "
+                               "error = COALESCE(error, 'lease expired') WHERE id = ?", (now, row['id']))
+                    continue
+                db.execute("UPDATE tasks SET state = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                           "lease_until = ?, updated = ? WHERE id = ?",
+                           (owner, now + self.lease_seconds, now, row['id']))
+                task = dict(row)
+                task['attempts'] += 1
+                task['payload'] = json.loads(task['payload'])
+                task['checkpoint'] = json.loads(task['checkpoint']) if task['checkpoint'] else {}
+                return task
+
+    def heartbeat(self, owner: str) -> int:
+        """Extend every lease held by owner. Returns how many were extended."""
+        with self.transaction() as db:
+            return db.execute("UPDATE tasks SET lease_until = ? WHERE state = 'leased' AND lease_owner = ?",
+                              (time.time() + self.lease_seconds, owner)).rowcount
+
+    def checkpoint(self, task: Dict, owner: str, data: Dict) -> bool:
+        """Save progress that a retry should reuse (e.g. a paid generation's image URL)."""
+        with self.transaction() as db:
+            return db.execute("UPDATE tasks SET checkpoint = ?, updated = ? WHERE id = ? AND lease_owner = ? "
+                              "AND state = 'leased'", (json.dumps(data), time.time(), task['id'], owner)).rowcount == 1
+
+    def complete(self, task: Dict, owner: str, result: Dict) -> bool:
+        """Mark a leased task done. Returns False if the lease was lost to another worker."""
+        with self.transaction() as db:
+            return db.execute("UPDATE tasks SET state = 'done', result = ?, error = NULL, lease_owner = NULL, "
+                              "updated = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                              (json.dumps(result), time.time(), task['id'], owner)).rowcount == 1
+
+    def fail(self, task: Dict, owner: str, error: str) -> str:
+        """Release a failed task for a backed-off retry, or mark it dead. Returns the new state."""
+        state = 'dead' if task['attempts'] >= task['max_attempts'] else 'queued'
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET state = ?, error = ?, not_before = ?, lease_owner = NULL, updated = ? "
+                       "WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                       (state, error, now + retry_delay(task['attempts']), now, task['id'], owner))
+        return state
+
+    def defer(self, task: Dict, owner: str, until: float, reason: str) -> bool:
+        """Set a leased task aside until `until` without counting the attempt.
+
+        Deferred tasks don't count as pending, so workers that aren't --forever exit.
+        """
+        with self.transaction() as db:
+            return db.execute("UPDATE tasks SET state = 'deferred', attempts = attempts - 1, error = ?, "
+                              "not_before = ?, lease_owner = NULL, updated = ? "
+                              "WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                              (reason, until, time.time(), task['id'], owner)).rowcount == 1
+
+    def retry_dead(self) -> int:
+        """Give every dead task a fresh set of attempts."""
+        with self.transaction() as db:
+            return db.execute("UPDATE tasks SET state = 'queued', attempts = 0, not_before = 0, updated = ? "
+                              "WHERE state = 'dead'", (time.time(),)).rowcount
+
+    def pending(self, kinds: List[str]) -> int:
+        """Tasks of these kinds that are queued or leased (i.e. not finished yet)."""
+        marks = ",".join("?" * len(kinds))
+        return self.db.execute(f"SELECT COUNT(*) FROM tasks WHERE kind IN ({marks}) "
+                               f"AND state IN ('queued', 'leased')", kinds).fetchone()[0]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return {kind: {state: count}}."""
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in self.db.execute("SELECT kind, state, COUNT(*) AS n FROM tasks GROUP BY kind, state"):
+            stats.setdefault(row['kind'], {})[row['state']] = row['n']
+        return stats
+
+    def claim_key(self, namespace: str, key: str, owner: str) -> bool:
+        """Reserve a key across all workers (e.g. an Unsplash photo id). True if owner holds it."""
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO claims (namespace, key, owner) VALUES (?, ?, ?)",
+                       (namespace, key, owner))
+            row = db.execute("SELECT owner FROM claims WHERE namespace = ? AND key = ?",
+                             (namespace, key)).fetchone()
+        return row['owner'] == owner
+
+    def take_tokens(self, name: str, capacity: float, period: float, tokens: float = 1.0,
+                    remaining: Optional[float] = None) -> float:
+        """Token bucket shared by every worker. Takes tokens and returns 0, or returns seconds to wait.
+
+        With remaining (a server's X-Ratelimit-Remaining), clamps the bucket instead of taking.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT * FROM limits WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                level = capacity
+            else:
+                capacity = row['capacity'] if remaining is not None else capacity
+                level = min(capacity, row['tokens'] + (now - row['updated']) * capacity / period)
+
+            wait = 0.0
+            if remaining is not None:
+                level = min(level, remaining)
+            elif level >= tokens:
+                level -= tokens
+            else:
+                wait = (tokens - level) * period / capacity
+
+            db.execute("INSERT OR REPLACE INTO limits (name, tokens, capacity, period, updated) "
+                       "VALUES (?, ?, ?, ?, ?)", (name, level, capacity, period, now))
+        return wait
+
+    def limits(self) -> List[Dict]:
+        return [dict(row) for row in self.db.execute("SELECT * FROM limits ORDER BY name")]
+
+    def done_unmerged(self) -> List[Dict]:
+        """Finished, unmerged tasks in pipeline order: a re-queued optimize/upload row keeps its
+        old id, so it must not be merged before the fetch/generate that produced its content."""
+        rows = self.db.execute(
+            "SELECT * FROM tasks WHERE state = 'done' AND merged = 0 ORDER BY "
+            "CASE kind WHEN 'fetch' THEN 0 WHEN 'generate' THEN 0 WHEN 'optimize' THEN 1 ELSE 2 END, updated, id"
+        ).fetchall()
+        tasks = []
+        for row in rows:
+            task = dict(row)
+            task['payload'] = json.loads(task['payload'])
+            task['result'] = json.loads(task['result'])
+            tasks.append(task)
+        return tasks
+
+
+# URL scheme -> backend factory(location, lease_seconds, max_attempts)
+BACKENDS: Dict[str, Callable[..., SQLiteQueue]] = {
+    'sqlite': lambda location, **options: SQLiteQueue(location, **options),
+}
+
+
+def open_queue(url: str, base_dir: Path, **options) -> SQLiteQueue:
+    """Open a queue by URL: sqlite:///relative/path.db (relative to base_dir) or sqlite:////abs/path.db."""
+    parts = urlsplit(url)
+    if parts.scheme not in BACKENDS:
+        raise ValueError(f"Unknown queue backend {parts.scheme!r} (known: {', '.join(sorted(BACKENDS))})")
+    location = parts.path[1:] if parts.path.startswith('/') else parts.path
+    return BACKENDS[parts.scheme](Path(base_dir) / location, **options)
+
+
+class SharedTokenBucket:
+    def __init__(self, queue: SQLiteQueue, name: str, capacity: int, refill_period: float):
+        """TokenBucket-compatible limiter whose tokens live in the queue, shared by every worker."""
+        self.queue = queue
+        self.name = name
+        self.capacity = float(capacity)
+        self.refill_period = refill_period
+        self.total_wait = 0.0
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Block until `tokens` are available and take them. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            wait = self.queue.take_tokens(self.name, self.capacity, self.refill_period, tokens)
+            if not wait:
+                break
+            # Re-check at least every few seconds: another worker may clamp or refill the bucket
+            delay = min(wait, 5.0) * random.uniform(0.9, 1.1)
+            time.sleep(delay)
+            waited += delay
+
+        self.total_wait += waited
+        if waited:
+            REGISTRY.inc('rate_limit_wait_seconds', waited, limiter=self.name)
+        return waited
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> Optional[int]:
+        """Clamp the shared bucket to the server's X-Ratelimit-Remaining."""
+        try:
+            remaining = int(headers.get('X-Ratelimit-Remaining'))
+        except (TypeError, ValueError):
+            return None
+        self.queue.take_tokens(self.name, self.capacity, self.refill_period, remaining=remaining)
+        return remaining
+
+
+class QueueFetcher(TradingImagesFetcher):
+    """Fetcher whose photo claims are shared through the queue, so two workers never pick the same photo."""
+
+    def __init__(self, queue: SQLiteQueue, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue = queue
+        self.current_slot = threading.local()
+
+    def claim_photo(self, photo_id: Optional[str]) -> bool:
+        if not super().claim_photo(photo_id):
+            return False
+        return photo_id is None or self.queue.claim_key('unsplash_photo', photo_id, self.current_slot.value)
+
+
+class QueueWorker:
+    def __init__(self, queue: SQLiteQueue, config_path: Optional[str] = None, base_dir: Optional[Path] = None,
+                 worker_id: Optional[str] = None, upload_backend: str = "azure", blob_service_client=None):
+        """A worker process: runs claimed tasks on a few threads until the queue drains."""
+        self.config = load_config(config_path)
+
+        self.queue = queue
+        self.config_path = config_path
+        self.base_dir = Path(base_dir or Path(__file__).parent)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.upload_backend = upload_backend
+        self.blob_service_client = blob_service_client
+
+        # Global quotas, shared by every worker through the queue
+        unsplash_config = self.config['unsplash']
+        dalle_config = self.config.get('dalle', {})
+        self.limits = {
+            'unsplash': SharedTokenBucket(queue, 'unsplash', unsplash_config.get('rate_limit_per_hour', 50), 3600.0),
+            # Paced like DalleScheduler's bucket, so N workers can't burst a whole minute's quota at once
+            'azure_openai': SharedTokenBucket(queue, 'azure_openai',
+                                              *pacing(dalle_config.get('requests_per_minute', 6))),
+        }
+
+        self.handlers = {
+            'fetch': self.run_fetch,
+            'generate': self.run_generate,
+            'optimize': self.run_optimize,
+            'upload': self.run_upload,
+        }
+        self._clients: Dict[str, object] = {}
+        self._clients_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def client(self, kind: str):
+        """Build the fetcher/generator/optimizer/uploader on first use (each needs its own credentials)."""
+        with self._clients_lock:
+            if kind not in self._clients:
+                journal_name = f"queue-{self.worker_id}-{kind}"
+                if kind == 'fetch':
+                    client = QueueFetcher(self.queue, self.config_path, base_dir=self.base_dir,
+                                          journal_name=journal_name)
+                    client.rate_limiter = self.limits['unsplash']
+                    client._variant_pool = ThreadPoolExecutor(max_workers=client.variant_workers)
+                elif kind == 'generate':
+                    client = DalleImageGenerator(self.config_path, base_dir=self.base_dir,
+                                                 journal_name=journal_name)
+                    client.rate_limiter = self.limits['azure_openai']
+                elif kind == 'optimize':
+                    client = ImageOptimizer(self.config_path, base_dir=self.base_dir)
+                else:
+                    from upload_to_azure import AzureBlobUploader
+                    client = AzureBlobUploader(self.config_path, blob_service_client=self.blob_service_client,
+                                               base_dir=self.base_dir,
+                                               fingerprint=self.upload_backend == 'azure-fingerprinted',
+                                               journal_name=journal_name)
+                self._clients[kind] = client
+            return self._clients[kind]
+
+    def run_fetch(self, task: Dict) -> Dict:
+        payload = task['payload']
+        slot = payload['slot']
+        fetcher = self.client('fetch')
+        fetcher.current_slot.value = slot
+        (self.base_dir / slot).parent.mkdir(exist_ok=True)
+
+        success, message = fetcher.fetch_slot(payload['query'], self.base_dir / slot)
+        if not success:
+            raise RuntimeError(message)
+        entry = fetcher.manifest.get(slot)
+        return {
+            'sha256': entry['sha256'],
+            'dhash': fetcher.store.objects[entry['sha256']]['dhash'],
+            'width': entry['width'],
+            'height': entry['height'],
+            'fields': {'source': 'unsplash', 'query': payload['query'], 'photo_id': entry.get('photo_id'),
+                       'score': entry.get('score')},
+            'variants': entry['variants'],
+        }
+
+    def run_generate(self, task: Dict) -> Dict:
+        payload = task['payload']
+        slot = payload['slot']
+        generator = self.client('generate')
+        (self.base_dir / slot).parent.mkdir(exist_ok=True)
+
+        prompt = payload.get('prompt') or generator.prompt_for(payload['asset'], payload['index'])
+
+        # A paid generation whose download failed is not repeated while its URL is valid
+        checkpoint = task['checkpoint']
+        if checkpoint.get('url') and time.time() - checkpoint['ts'] < IMAGE_URL_TTL:
+            image_url = checkpoint['url']
+        else:
+            options = {**DEFAULT_OPTIONS, **payload.get('options', {})}
+            cost = request_cost(options)
+            if not generator.scheduler.ledger.reserve(cost):
+                # Not a failure: the task waits, without using an attempt, until the month rolls over
+                raise GenerationDeferred('budget', until=generator.scheduler.ledger.resets_at())
+            generator.rate_limiter.acquire()
+            try:
+                image_url = generator.generate_image(prompt, **options)
+            except Exception:
+                generator.scheduler.ledger.settle(cost, charged=False)
+                raise
+            generator.scheduler.ledger.settle(cost, charged=True)
+            REGISTRY.inc('dalle_generations', size=options['size'], quality=options['quality'])
+            self.queue.checkpoint(task, self.worker_id, {'url': image_url, 'ts': time.time()})
+
+        downloaded = generator.download_image(image_url, self.base_dir / slot)
+        if downloaded is None:
+            raise IOError(f"could not download the generated image for {slot}")
+        return {
+            'sha256': downloaded.sha256,
+            'dhash': f"{downloaded.dhash:016x}",
+            'width': downloaded.width,
+            'height': downloaded.height,
+            'fields': {'source': 'dalle', 'prompt': prompt},
+            'variants': [],
+        }
+
+    def run_optimize(self, task: Dict) -> Dict:
+        slot = task['payload']['slot']
+        folder, image_filename = slot.split('/', 1)
+        optimizer = self.client('optimize')
+        optimize_image(str(self.base_dir / slot), folder, str(self.base_dir),
+                       optimizer.widths, optimizer.formats, optimizer.qualities)
+        relpaths = [variant_relpath(folder, image_filename, width, fmt)
+                    for width in optimizer.widths for fmt in optimizer.formats]
+        return {'variants': [relpath for relpath in relpaths if (self.base_dir / relpath).exists()]}
+
+    def run_upload(self, task: Dict) -> Dict:
+        payload = task['payload']
+        uploader = self.client('upload')
+        files = [(payload['slot'], payload.get('sha256'))] + [(relpath, None) for relpath in payload.get('variants', [])]
+        for relpath, sha in files:
+            local_path = self.base_dir / relpath
+            if not uploader.upload_image(local_path, uploader.blob_name(relpath, sha),
+                                         uploader.file_md5(local_path), uploader.cache_control):
+                raise IOError(f"upload of {relpath} failed")
+        return {'backend': uploader.backend}
+
+    def follow_up(self, task: Dict, result: Dict):
+        """Queue the slot's next stage (fetch/generate -> optimize -> upload) as listed in its payload."""
+        payload = task['payload']
+        then = payload.get('then', [])
+        if not then:
+            return
+        sha = result.get('sha256', payload.get('sha256'))
+        variants = result.get('variants', payload.get('variants', []))
+        self.queue.enqueue(then[0], payload['slot'], {'slot': payload['slot'], 'sha256': sha,
+                                                      'variants': variants, 'then': then[1:]})
+
+    def run_task(self, task: Dict):
+        started = time.perf_counter()
+        try:
+            result = self.handlers[task['kind']](task)
+        except GenerationDeferred as e:
+            until = e.until or time.time() + retry_delay(1)
+            self.queue.defer(task, self.worker_id, until, str(e))
+            REGISTRY.inc('queue_tasks', kind=task['kind'], result='deferred')
+            REGISTRY.log('task', kind=task['kind'], key=task['key'], attempt=task['attempts'], state='deferred',
+                         reason=e.reason, until=round(until))
+            print(f"  ⏸️  {task['kind']} {task['key']}: {e}, until "
+                  f"{time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(until))}")
+            return
+        except Exception as e:
+            state = self.queue.fail(task, self.worker_id, str(e))
+            REGISTRY.inc('queue_tasks', kind=task['kind'], result='dead' if state == 'dead' else 'retry')
+            REGISTRY.log('task', kind=task['kind'], key=task['key'], attempt=task['attempts'], state=state,
+                         error=str(e))
+            print(f"  ❌ {task['kind']} {task['key']} (attempt {task['attempts']}): {e}")
+            return
+
+        seconds = time.perf_counter() - started
+        REGISTRY.histogram('stage_seconds', pipeline='queue', stage=task['kind']).observe(seconds)
+        if not self.queue.complete(task, self.worker_id, result):
+            REGISTRY.inc('queue_tasks', kind=task['kind'], result='lease_lost')
+            print(f"  ⚠️  {task['kind']} {task['key']}: lease lost, another worker owns it now")
+            return
+        REGISTRY.inc('queue_tasks', kind=task['kind'], result='done')
+        REGISTRY.log('task', kind=task['kind'], key=task['key'], attempt=task['attempts'], state='done',
+                     seconds=round(seconds, 3))
+        print(f"  ✅ {task['kind']} {task['key']} ({seconds:.1f}s)")
+        self.follow_up(task, result)
+
+    def _heartbeat_loop(self):
+        while not self._stopping.wait(self.queue.lease_seconds / 3):
+            self.queue.heartbeat(self.worker_id)
+
+    def _work_loop(self, kinds: List[str], forever: bool, poll_seconds: float):
+        while not self._stopping.is_set():
+            task = self.queue.claim(self.worker_id, kinds)
+            if task:
+                self.run_task(task)
+            elif forever or self.queue.pending(kinds):
+                # Nothing runnable yet: tasks are backing off or leased by other workers
+                time.sleep(poll_seconds * random.uniform(0.5, 1.5))
+            else:
+                return
+
+    def run(self, kinds: List[str], threads: int = 4, forever: bool = False, poll_seconds: float = 2.0):
+        """Claim and run tasks on `threads` threads until none are pending (or forever)."""
+        print(f"👷 Worker {self.worker_id}: {', '.join(kinds)} on {threads} threads")
+        self._stopping.clear()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                for future in [pool.submit(self._work_loop, kinds, forever, poll_seconds) for _ in range(threads)]:
+                    future.result()
+        finally:
+            self._stopping.set()
+            with self._clients_lock:
+                fetcher = self._clients.pop('fetch', None)
+            if fetcher is not None:
+                # Its variant pool is gone; a later run() builds a fresh fetcher
+                fetcher._variant_pool.shutdown()
+
+
+def merge_results(queue: SQLiteQueue, base_dir: Path) -> int:
+    """Apply finished tasks to the manifest and content store. Returns the number merged.
+
+    Workers never write the manifest or store index themselves; this single writer
+    runs under the queue's write lock, so concurrent merges can't clobber each other.
+    """
+    base_dir = Path(base_dir)
+    with queue.transaction() as db:
+        tasks = queue.done_unmerged()
+        if not tasks:
+            return 0
+        manifest = Manifest(base_dir)
+        store = ContentStore(base_dir)
+
+        for task in tasks:
+            slot, result = task['payload']['slot'], task['result']
+            if task['kind'] in ('fetch', 'generate'):
+                if not (base_dir / slot).exists():
+                    continue
+                manifest.record(slot, sha256=result['sha256'], dimensions=(result['width'], result['height']),
+                                **result['fields'])
+                store.add_slot(slot, photo_id=result['fields'].get('photo_id'), sha=result['sha256'],
+                               hash_value=int(result['dhash'], 16))
+                if result['variants']:
+                    manifest.set_variants(slot, result['variants'])
+            elif (manifest.get(slot) or {}).get('sha256') == task['payload'].get('sha256'):
+                # Optimize/upload results only apply to the content they were run on
+                if task['kind'] == 'optimize':
+                    manifest.set_variants(slot, result['variants'])
+                else:
+                    manifest.mark_uploaded(slot, result['backend'])
+
+        manifest.save()
+        store.save()
+        db.executemany("UPDATE tasks SET merged = 1 WHERE id = ?", [(task['id'],) for task in tasks])
+    return len(tasks)
+
+
+def plan(queue: SQLiteQueue, config: Dict, base_dir: Path, source: str = 'unsplash',
+         upload_backend: Optional[str] = None) -> Dict[str, int]:
+    """Queue every task the library needs: missing slots, missing variants, unpublished images."""
+    merge_results(queue, base_dir)
+    manifest = Manifest(base_dir)
+    manifest.sync([asset['folder'] for asset in config['assets']], full=True)
+    manifest.save()
+
+    after = ['optimize'] + (['upload'] if upload_backend else [])
+    queued = {kind: 0 for kind in KINDS}
+    for asset in config['assets']:
+        folder = asset['folder']
+        for i in range(asset['images_per_asset']):
+            slot = f"{folder}/{folder}-{i + 1}.jpg"
+            entry = manifest.get(slot)
+            if entry is None and source == 'dalle':
+                # The worker picks the prompt from the generator's set for this asset
+                kind, payload = 'generate', {'slot': slot, 'asset': asset['name'], 'index': i, 'then': after}
+            elif entry is None:
+                kind, payload = 'fetch', {'slot': slot, 'query': asset['search_terms'][i % len(asset['search_terms'])],
+                                          'then': after}
+            elif not entry['variants']:
+                kind, payload = 'optimize', {'slot': slot, 'sha256': entry['sha256'], 'then': after[1:]}
+            elif upload_backend and not manifest.is_uploaded(slot, upload_backend):
+                kind, payload = 'upload', {'slot': slot, 'sha256': entry['sha256'],
+                                           'variants': entry['variants'], 'then': []}
+            else:
+                continue
+            queued[kind] += queue.enqueue(kind, slot, payload)
+    return queued
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Build the library with a durable work queue and worker processes")
+    parser.add_argument('--queue', help=f"queue URL (default: queue.url in config.json or {DEFAULT_QUEUE})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help="queue the tasks the library still needs")
+    plan_parser.add_argument('--source', choices=['unsplash', 'dalle'], default='unsplash',
+                             help="where missing images come from")
+    plan_parser.add_argument('--upload', choices=['azure', 'azure-fingerprinted'],
+                             help="also publish each image once optimized")
+
+    worker_parser = commands.add_parser('worker', help="claim and run tasks until the queue drains")
+    worker_parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    worker_parser.add_argument('--threads', type=int, help="tasks run at once (default: queue.worker_threads)")
+    worker_parser.add_argument('--worker-id', help="lease owner name (default: <host>-<pid>)")
+    worker_parser.add_argument('--upload-backend', choices=['azure', 'azure-fingerprinted'], default='azure')
+    worker_parser.add_argument('--forever', action='store_true', help="keep polling when the queue is empty")
+    add_instrumentation_args(worker_parser)
+
+    commands.add_parser('status', help="show task counts and shared rate limits")
+    commands.add_parser('merge', help="apply finished tasks to the manifest")
+    commands.add_parser('retry-dead', help="give dead tasks a fresh set of attempts")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config()
+        queue_config = config.get('queue', {})
+        base_dir = Path(__file__).parent
+        queue = open_queue(args.queue or queue_config.get('url', DEFAULT_QUEUE), base_dir,
+                           lease_seconds=queue_config.get('lease_seconds', 120),
+                           max_attempts=queue_config.get('max_attempts', 5))
+
+        if args.command == 'plan':
+            queued = plan(queue, config, base_dir, args.source, args.upload)
+            print(f"📋 Queued: " + ", ".join(f"{count} {kind}" for kind, count in queued.items()))
+        elif args.command == 'worker':
+            worker = QueueWorker(queue, worker_id=args.worker_id, upload_backend=args.upload_backend)
+            with instrumented(args, 'queue'):
+                worker.run(args.kinds, args.threads or queue_config.get('worker_threads', 4), args.forever)
+            print(f"🔀 Merged {merge_results(queue, base_dir)} finished tasks into the manifest")
+        elif args.command == 'merge':
+            print(f"🔀 Merged {merge_results(queue, base_dir)} finished tasks into the manifest")
+        elif args.command == 'retry-dead':
+            print(f"🔁 Requeued {queue.retry_dead()} dead tasks")
+
+        if args.command in ('plan', 'status'):
+            for kind, states in sorted(queue.stats().items()):
+                print(f"  {kind:<9} " + "  ".join(f"{state}={count}" for state, count in sorted(states.items())))
+            for limit in queue.limits():
+                print(f"  ⏳ {limit['name']}: {limit['tokens']:.1f}/{limit['capacity']:g} tokens "
+                      f"per {limit['period']:g}s")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())